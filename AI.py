@@ -3,18 +3,27 @@ from transformers import pipeline
 import requests
 import os
 from dotenv import load_dotenv
+from settings import get_settings
 
 load_dotenv()
 
 class AI:
-    def __init__(self, model_id):
-        self.model_id = model_id
-        self.url = "https://api.hyperbolic.xyz/v1/chat/completions"
+    def __init__(self, model_id=None):
+        # None follows llm.model_id from the settings, also after a reload
+        self._model_id = model_id
         self.header = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {os.getenv('API_KEY')}"  
         }
 
+    @property
+    def model_id(self):
+        return self._model_id or get_settings().llm.model_id
+
+    @property
+    def url(self):
+        return get_settings().llm.api_url
+
     def generate_response(self, conversation):
         data = {
             "model": self.model_id,
@@ -22,7 +31,11 @@ class AI:
             "stream": False
         }
 
-        response = requests.post(self.url, json=data, headers=self.header)
+        try:
+            response = requests.post(self.url, json=data, headers=self.header,
+                                     timeout=get_settings().llm.request_timeout)
+        except requests.RequestException as e:
+            return f"Error: {e}"
         if response.status_code == 200:
             result = response.json()
             # Adjust according to the actual response structure
@@ -58,6 +71,5 @@ class AI:
             print(f"Assistant: {response_text}")
 
 if __name__ == "__main__":
-    model_id = "meta-llama/Meta-Llama-3-70B-Instruct"  
-    ai = AI(model_id)
+    ai = AI()
     ai.run()
@@ -1,7 +1,17 @@
 import streamlit as st
 from AI import AI
 from autmati import EmailAutomation
-from database import DatabaseManager
+from database import DatabaseManager, HISTORY_COLUMNS
+from history_export import export_history
+from archive import EmailArchive
+from metrics import compute_dashboard_metrics
+from recipient_filter import RecipientFilter
+from scheduler import CampaignScheduler
+from retry_queue import RetryQueue, RetryWorker
+from records import Outcome, read_recipients
+from progress import ProgressReporter, format_progress
+from chat_cache import ChatResponseCache, answer_from_metrics, data_version, email_metrics, is_metrics_question
+from settings import get_settings
 import pandas as pd
 import os
 from typing import Dict, List
@@ -9,11 +19,12 @@ from streamlit_option_menu import option_menu
 import time
 from dotenv import load_dotenv
 import uuid
+import tempfile
 from contextlib import contextmanager
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 
 
@@ -77,6 +88,8 @@ def get_database_manager(user_id):
 # Initialize database with consistent user_id
 if 'db' not in st.session_state:
     st.session_state.db = get_database_manager(st.session_state.user_id)
+# Reads count as activity too, otherwise a user who only browses gets reaped
+st.session_state.db.touch_activity()
 
 if "email_activities" not in st.session_state:
     st.session_state.email_activities = []
@@ -93,12 +106,21 @@ if "llm_context" not in st.session_state:
 # Initialize AI model
 @st.cache_resource
 def load_ai_model():
-    model_id = "meta-llama/Meta-Llama-3-70B-Instruct"  
-    return AI(model_id)
+    # Model and API URL follow the [llm] settings
+    return AI()
 
 if "ai_model" not in st.session_state:
     st.session_state.ai_model = load_ai_model()
 
+@st.cache_resource
+def get_chat_cache(user_id, maxsize, ttl):
+    """Chat answers shared by all sessions of a user, rebuilt when the cache settings change"""
+    return ChatResponseCache(maxsize=maxsize, ttl=ttl)
+
+@st.cache_resource
+def get_email_archive():
+    return EmailArchive()
+
 # System prompt
 if "messages" not in st.session_state:
     system_message = {
@@ -129,8 +151,8 @@ with st.sidebar:
     
     selected = option_menu(
         menu_title=None,
-        options=["Email Automation", "Chat Interface", "Data Metrics"],
-        icons=["envelope-fill", "chat-dots-fill", "arrow-repeat", "graph-up"], 
+        options=["Email Automation", "Chat Interface", "Data Metrics", "History"],
+        icons=["envelope-fill", "chat-dots-fill", "graph-up", "clock-history"], 
         default_index=0,
         styles={
             "container": {"padding": "0!important", "background-color": "transparent"},
@@ -164,15 +186,40 @@ with st.sidebar:
 # ----- EMAIL AUTOMATION -----
 def email_automation_page():
     st.title("Email Automation")
+    settings = get_settings()
+
+    # Outside the form so the account fields appear as soon as the count changes
+    extra_count = st.number_input(
+        "Additional Sender Accounts", min_value=0, max_value=10, value=0,
+        help="Extra accounts on the same SMTP server and port, each adds its own quota."
+    )
     
     # Email configuration form
     with st.form(key="email_config_form"):
         with st.expander("Email Configurations", expanded=True):
-            smtp_server = st.text_input("SMTP Server", value="smtp.gmail.com")
-            port = st.number_input("Port", value=587)
+            smtp_server = st.text_input("SMTP Server", value=settings.smtp.server)
+            port = st.number_input("Port", value=settings.smtp.port)
             sender_email = st.text_input("Sender Email")
             sender_name = st.text_input("Your Name")
             sender_password = st.text_input("App Password", type="password")
+            rate_limit = st.number_input(
+                f"Rate Limit per Account (emails per {settings.smtp.rate_period:g}s, 0 = unlimited)",
+                min_value=0, value=settings.smtp.rate_limit or 0
+            )
+            extra_accounts = []
+            for i in range(extra_count):
+                email_col, password_col = st.columns(2)
+                extra_accounts.append((
+                    email_col.text_input(f"Account {i + 2} Email", key=f"extra_email_{i}"),
+                    password_col.text_input(f"Account {i + 2} App Password", type="password",
+                                            key=f"extra_password_{i}")
+                ))
+            html_alternative = st.checkbox("Also send an HTML version")
+            generation_batch_size = st.number_input(
+                "Recipients per LLM Request",
+                min_value=1, max_value=16, value=min(settings.campaign.generation_batch_size, 16),
+                help="Generate several short emails in one request to save prompt tokens."
+            )
             
         # Form submit button
         config_submitted = st.form_submit_button("Save Configuration")
@@ -180,13 +227,28 @@ def email_automation_page():
     if config_submitted:
         if sender_email and sender_password and sender_name:
             st.success("Email configuration saved!")
+            sender_accounts = []
+            for account_email, account_password in extra_accounts:
+                if not account_email.strip() or not account_password.strip():
+                    continue
+                sender_accounts.append({
+                    "smtp_server": smtp_server,
+                    "port": port,
+                    "sender_email": account_email.strip(),
+                    "sender_password": account_password.strip(),
+                    "rate_limit": rate_limit
+                })
             # Store configuration in session state
             st.session_state.email_config = {
                 "smtp_server": smtp_server,
                 "port": port,
                 "sender_email": sender_email,
                 "sender_name": sender_name,
-                "sender_password": sender_password
+                "sender_password": sender_password,
+                "sender_accounts": sender_accounts,
+                "rate_limit": rate_limit,
+                "html_alternative": html_alternative,
+                "generation_batch_size": generation_batch_size
             }
         else:
             st.warning("Please fill in all required fields")
@@ -215,14 +277,28 @@ def email_automation_page():
         uploaded_file = st.file_uploader("Upload CSV file", type=['csv'])
         
         if uploaded_file is not None:
-            df = pd.read_csv(uploaded_file)
+            # Only the preview is loaded into pandas, the campaign streams compact records
+            df = pd.read_csv(uploaded_file, nrows=1000)
             st.dataframe(df)
             
             # Create form for email content
             with st.form(key="email_content_form"):
                 email_context = st.text_area("Email Context")
+                dry_run = st.checkbox("Dry run (generate offline and write messages to a file instead of sending)",
+                                      value=settings.campaign.dry_run)
+                with st.expander("Schedule Delivery"):
+                    start_date = st.date_input("Start Date")
+                    start_time = st.time_input("Start Time (UTC)")
+                    window_hours = st.number_input("Delivery Window (hours)", min_value=1, value=8)
+                    delivery_start, delivery_end = st.slider(
+                        "Delivery Hours (recipient's local time)",
+                        min_value=0, max_value=23, value=(8, 21)
+                    )
+                    st.caption("Emails are only delivered between the two selected hours in each recipient's timezone "
+                               "(optional 'timezone' CSV column, UTC by default).")
                 preview_email = st.form_submit_button("Preview Email")
                 send_emails = st.form_submit_button("Send Emails")
+                schedule_emails = st.form_submit_button("Schedule Emails")
 
 
                 #preview email
@@ -242,7 +318,9 @@ def email_automation_page():
                                 email_context
                             )
                             if email_body:
+                                token_stats = email_automation.token_stats
                                 st.markdown("### Email Preview")
+                                st.caption(f"Prompt: ~{token_stats.prompt_tokens_per_request():.0f} tokens")
                                 st.markdown(f"**To:** {recipient_name}")
                                 st.markdown(f"**Subject:** {subject}")
                                 st.markdown(email_body)
@@ -258,62 +336,158 @@ def email_automation_page():
                     
                     try:
                         with st.spinner('Initializing email automation...'):
-                            email_automation = EmailAutomation(
-                                api_key=f"{os.getenv('API_KEY')}",
-                                **st.session_state.email_config
-                            )
-                            temp_file = "temp.csv"
-                            with open(temp_file, "wb") as f:
-                                f.write(uploaded_file.getbuffer())
-                            
-                            df = pd.read_csv(temp_file)
-                            total_emails = len(df)
-                            
+                            if dry_run:
+                                sink_path = f"dry_run_{datetime.now():%Y%m%d_%H%M%S}.jsonl.gz"
+                                email_automation = EmailAutomation.dry_run(
+                                    st.session_state.email_config["sender_name"],
+                                    sink_path=sink_path,
+                                    html_alternative=st.session_state.email_config["html_alternative"],
+                                    generation_batch_size=st.session_state.email_config["generation_batch_size"]
+                                )
+                            else:
+                                # Shares the background workers' pool and its rate-limit state
+                                email_automation = EmailAutomation(
+                                    api_key=f"{os.getenv('API_KEY')}",
+                                    sender_pool=get_sender_automation(db.user_id).sender_pool,
+                                    **st.session_state.email_config
+                                )
+                            recipients = list(read_recipients(uploaded_file))
+
+                            # Drop duplicates, suppressed and recently emailed recipients before generation
+                            recipient_filter = RecipientFilter.from_database(db, expected_size=len(recipients))
+                            rows, skipped = recipient_filter.filter_rows(recipients)
+                            del recipients
+                            if skipped:
+                                with st.expander(f"Skipped {len(skipped)} recipients"):
+                                    st.dataframe(pd.DataFrame(
+                                        [(row.email, reason) for row, reason in skipped],
+                                        columns=['Email', 'Reason']
+                                    ))
                             progress_bar = st.progress(0)
                             status_text = st.empty()
+                            # Coalesces per-row updates into a few UI deltas per second
+                            progress = ProgressReporter(
+                                total=len(rows), render=progress_renderer(progress_bar, status_text),
+                                fps=settings.campaign.progress_fps
+                            )
                             
-                            email_summary = []
-                            
-                            for index, row in df.iterrows():
-                                status_text.text(f"Sending email {index + 1} of {total_emails}...")
-                                progress_bar.progress((index + 1) / total_emails)
-                                
-                                recipient_name = row['recipient_name']
-                                recipient_email = row['email']
-                                subject = row['subject']
-                                
-                                email_body = email_automation.generate_email(
-                                    subject, 
-                                    recipient_name, 
-                                    email_context
+                            # Dry runs never fail to send, and must not leave rows behind to retry
+                            retry_queue = None if dry_run else RetryQueue(db)
+                            email_automation.retry_queue = retry_queue
+                            failed_rows = []
+                            email_automation.on_failed = lambda row, stage, error: failed_rows.append(
+                                Outcome(row.email, stage, str(error))
+                            )
+                            # Dry runs must not count as past sends for the recipient filter
+                            if not dry_run:
+                                email_automation.on_sent = lambda row, context, email_body: db.save_email_activity(
+                                    row.recipient_name, row.subject, context, email_body,
+                                    recipient_email=row.email
                                 )
-                                if email_body:
-                                    db.save_email_activity(
-                                        recipient_name,
-                                        subject,
-                                        email_context,
-                                        email_body
-                                    )
-                                    
-                                    email_automation.send_email(recipient_email, subject, email_body)
-                                    email_summary.append({
-                                        "recipient": recipient_name,
-                                        "email": recipient_email,
-                                        "subject": subject
-                                    })
-                            
-                            progress_bar.progress(1.0)
-                            status_text.empty()
-                            st.success("All emails sent successfully!")
-                            time.sleep(.5)
-                            st.toast("Success! 🎉")
-                            
-                            if os.path.exists(temp_file):
-                                os.remove(temp_file)
+                            # The batched generate, render and send stages keep every pooled
+                            # sender connection busy; sends are saved as they happen
+                            email_automation.process_recipients(rows, email_context, progress=progress)
+                            token_stats = email_automation.token_stats
+                            if token_stats.requests and not dry_run:
+                                db.save_token_usage(
+                                    tokens_used=token_stats.total_tokens,
+                                    operation_type="email_generation"
+                                )
+                            # Rows that failed to send still had a body generated
+                            generated = email_automation.counts["sent"] + email_automation.counts["failed"]
+                            st.caption(
+                                f"Prompt tokens per email: {token_stats.prompt_tokens_per_email(generated):.0f}"
+                                + (f" ({token_stats.cached_tokens:,} served from the provider cache)"
+                                   if token_stats.cached_tokens else "")
+                            )
+                            if dry_run:
+                                sink = email_automation.sender_pool
+                                st.info(f"Dry run wrote {sink.count} messages ({sink.bytes_written:,} bytes) to {sink_path}")
+                            if not failed_rows:
+                                if not dry_run:
+                                    st.success("All emails sent successfully!")
+                                time.sleep(.5)
+                                st.toast("Success! 🎉")
+                            else:
+                                st.warning(
+                                    f"Sent {progress.counters.sent} of {progress.counters.total} emails. "
+                                    + (f"{retry_queue.queued} queued for automatic retry, "
+                                       f"{retry_queue.dead_lettered} moved to dead letters."
+                                       if retry_queue is not None else "")
+                                )
+                                with st.expander(f"Failed {len(failed_rows)} emails"):
+                                    st.dataframe(pd.DataFrame(
+                                        [(o.email, o.stage, o.error) for o in failed_rows],
+                                        columns=['Email', 'Stage', 'Error']
+                                    ))
+                                if retry_queue is not None and retry_queue.queued:
+                                    get_retry_worker(db.user_id)
+
                             
                     except Exception as e:
                         st.error(f"Error sending emails: {e}")
 
+                if schedule_emails:
+                    db = st.session_state.db
+                    try:
+                        recipients = list(read_recipients(uploaded_file))
+                        rows, skipped = RecipientFilter.from_database(
+                            db, expected_size=len(recipients)
+                        ).filter_rows(recipients)
+                        scheduler = get_campaign_scheduler(db.user_id)
+                        campaign_id = scheduler.schedule_campaign(
+                            rows,
+                            email_context,
+                            datetime.combine(start_date, start_time).replace(tzinfo=timezone.utc),
+                            window=timedelta(hours=window_hours),
+                            # Quiet hours run from the end of the allowed range to its start
+                            quiet_hours=(delivery_end, delivery_start)
+                        )
+                        st.success(f"Scheduled {len(rows)} emails (campaign {campaign_id[:8]}), "
+                                   f"skipped {len(skipped)}")
+                    except Exception as e:
+                        st.error(f"Error scheduling emails: {e}")
+
+
+def progress_renderer(progress_bar, status_text):
+    """Render ProgressReporter snapshots into a progress bar and status line"""
+    def render(snapshot):
+        progress_bar.progress(min(snapshot["fraction"], 1.0))
+        status_text.text(format_progress(snapshot))
+    return render
+
+@st.cache_resource
+def get_sender_automation(user_id):
+    """
+    One sender per user, with the configuration saved at first use. The
+    scheduler, the retry worker and campaigns all send through its pool, so
+    together they keep to each account's rate limit.
+    """
+    return EmailAutomation(
+        api_key=f"{os.getenv('API_KEY')}",
+        **st.session_state.email_config
+    )
+
+@st.cache_resource
+def get_retry_worker(user_id):
+    """One background retry worker per user, replaying failed rows from the retry queue"""
+    worker = RetryWorker(st.session_state.db, get_sender_automation(user_id))
+    worker.start()
+    return worker
+
+@st.cache_resource
+def get_campaign_scheduler(user_id):
+    """One background scheduler per user, sending with the configuration saved at first use"""
+    scheduler = CampaignScheduler(st.session_state.db, get_sender_automation(user_id))
+    scheduler.start()
+    return scheduler
+
+# Drain the persisted schedule and retry queues as soon as sender credentials
+# are known, not only when a new campaign is sent or scheduled
+if "email_config" in st.session_state:
+    get_campaign_scheduler(st.session_state.db.user_id)
+    get_retry_worker(st.session_state.db.user_id)
+
 if st.session_state.active_menu == "Email Automation":
     email_automation_page()
 
@@ -331,24 +505,39 @@ elif st.session_state.active_menu == "Chat Interface":
 
     # Modify the chat input handling
     if prompt := st.chat_input("What would you like to ask?"):
-        recent_emails = db.get_recent_email_activities(5)
-        system_context = st.session_state.messages[0]["content"]
-            
-        # Always include database status
-        email_context = "\n[EMAIL CONTEXT]\n"
-        if recent_emails:
-            for email in recent_emails:
-                email_context += f"""
-                Recipient: {email[0]}
-                Subject: {email[1]}
-                Email Content: {email[2]}
+        # The version check is cheap, the full metrics (archive included) are only built on a miss
+        archive = get_email_archive()
+        version = data_version(db, archive)
+        chat_settings = get_settings().chat
+        chat_cache = get_chat_cache(db.user_id, chat_settings.cache_size, chat_settings.cache_ttl)
+        model_id = st.session_state.ai_model.model_id
+
+        full_response = chat_cache.get(prompt, version, model_id)
+        if full_response is None and is_metrics_question(prompt):
+            full_response = answer_from_metrics(prompt, email_metrics(db, archive))
+            chat_cache.put(prompt, version, full_response, model_id)
+        from_model = full_response is None
+
+        if from_model:
+            recent_emails = db.get_recent_email_activities(5)
+            system_context = st.session_state.messages[0]["content"]
                 
-                -------------------"""
-        else:
-            email_context += "DATABASE STATUS: No email records found\n"
-        
-        system_context += email_context
-        st.session_state.messages[0]["content"] = system_context
+            # Always include database status
+            email_context = "\n[EMAIL CONTEXT]\n"
+            if recent_emails:
+                for email in recent_emails:
+                    email_context += f"""
+                    Recipient: {email[0]}
+                    Subject: {email[1]}
+                    Email Content: {email[2]}
+                    
+                    -------------------"""
+            else:
+                email_context += "DATABASE STATUS: No email records found\n"
+            
+            # Replace the previous context instead of appending to it
+            system_context = system_context.split("\n[EMAIL CONTEXT]\n")[0] + email_context
+            st.session_state.messages[0]["content"] = system_context
         
         st.session_state.messages.append({
             "role": "user",
@@ -360,119 +549,227 @@ elif st.session_state.active_menu == "Chat Interface":
 
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
-            # Pass full context to AI
-            full_response = st.session_state.ai_model.generate_response(st.session_state.messages)
-                
+            if from_model:
+                # Pass full context to AI
+                full_response = st.session_state.ai_model.generate_response(st.session_state.messages)
+                if not full_response.startswith("Error:"):
+                    chat_cache.put(prompt, version, full_response, model_id)
+                    
+                if chat_settings.stream_delay:
+                    placeholder_text = ""
+                    for chunk in full_response.split():
+                        placeholder_text += chunk + " "
+                        message_placeholder.markdown(placeholder_text + "▌")
+                        time.sleep(chat_settings.stream_delay)
+
             # Save assistant's response
             db.save_conversation("assistant", full_response)
                 
-            placeholder_text = ""
-            for chunk in full_response.split():
-                placeholder_text += chunk + " "
-                message_placeholder.markdown(placeholder_text + "▌")
-                time.sleep(0.05)
-                
             message_placeholder.markdown(full_response)
 
         st.session_state.messages.append({"role": "assistant", "content": full_response})
 
-        # Save token usage
-        db.save_token_usage(tokens_used=150, operation_type="chat_completion")
+        # Save token usage, only completions cost tokens
+        if from_model:
+            db.save_token_usage(tokens_used=150, operation_type="chat_completion")
 
 
 # ----- METRICS DASHBOARD -----
+@st.cache_data(ttl=30, show_spinner=False)
+def load_dashboard_metrics(user_id, _db):
+    """One snapshot query plus the archived aggregates, shared by every tab"""
+    snapshot = _db.get_metrics_snapshot()
+    archived = get_email_archive().archived_snapshot(user_id)
+    return compute_dashboard_metrics(snapshot, archived)
+
 def metrics_dashboard_page():
     st.title("Metrics Dashboard")
     db = st.session_state.db
 
-    tab1, tab2 = st.tabs(["Email Activity", "Token Usage"])
+    try:
+        metrics = load_dashboard_metrics(db.user_id, db)
+    except Exception as e:
+        st.error(f"Error loading metrics: {str(e)}")
+        print(f"Metrics error: {str(e)}")
+        return
+
+    daily = metrics["daily"]
+    recent = daily[daily["Date"] >= daily["Date"].max() - pd.Timedelta(days=29)]
+
+    tab1, tab2, tab3 = st.tabs(["Email Activity", "Token Usage", "Long Range"])
 
     with tab1:
         st.subheader("Email Activity")
-        try:
-            # Get email metrics
-            total_emails, unique_recipients, active_days, last_sent = db.get_email_metrics() or (0, 0, 0, None)
-            
-            # Display email metrics
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Total Emails", f"{total_emails:,}" if total_emails else "0")
-            with col2:
-                st.metric("Unique Recipients", f"{unique_recipients:,}" if unique_recipients else "0")
-            with col3:
-                st.metric("Active Days", f"{active_days}" if active_days else "0")
-            with col4:
-                st.metric("Last Sent", last_sent.strftime("%Y-%m-%d") if last_sent else "Never")
-
-            # Get and display daily email counts
-            daily_counts = db.get_daily_email_counts()
-            if daily_counts and len(daily_counts) > 0:
-                df_emails = pd.DataFrame(daily_counts, columns=['Date', 'Count'])
-                
-                fig = px.line(
-                    df_emails,
-                    x='Date',
-                    y='Count',
-                    title='Daily Email Activity'
-                )
-                fig.update_layout(
-                    xaxis_title="Date",
-                    yaxis_title="Emails Sent",
-                    showlegend=False
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No email activity data available yet")
-        
-        except Exception as e:
-            st.error(f"Error loading email metrics: {str(e)}")
-            print(f"Email metrics error: {str(e)}")
+        this_week, _, emails_delta = metrics["emails_week_over_week"]
+        last_sent = metrics["last_sent"]
+
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Total Emails", f"{metrics['total_emails']:,}")
+        with col2:
+            st.metric("Unique Recipients", f"{metrics['unique_recipients']:,}")
+        with col3:
+            st.metric("Active Days", f"{metrics['active_days']}")
+        with col4:
+            st.metric("Last Sent", last_sent.strftime("%Y-%m-%d") if last_sent is not None else "Never")
+
+        st.metric(
+            "Emails This Week",
+            f"{this_week:,}",
+            delta=f"{emails_delta:+.0f}% vs last week" if emails_delta is not None else None
+        )
+
+        if metrics["total_emails"]:
+            fig = px.line(
+                recent,
+                x='Date',
+                y=['Emails', 'Emails7dAvg'],
+                title='Daily Email Activity (30 days)'
+            )
+            fig.update_layout(
+                xaxis_title="Date",
+                yaxis_title="Emails Sent",
+                legend_title=None
+            )
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No email activity data available yet")
 
     with tab2:
         st.subheader("Token Usage")
-        try:
-            # Get token metrics with proper column handling
-            token_data = db.get_daily_token_usage(days=30)
-            
-            if token_data and len(token_data) > 0:
-                # Convert to DataFrame with correct columns
-                df_tokens = pd.DataFrame(token_data, columns=['Date', 'Tokens', 'Operations'])
-                
-                # Create token usage chart
-                fig = px.bar(
-                    df_tokens,
-                    x='Date',
-                    y='Tokens',
-                    title='Daily Token Usage'
-                )
-                fig.update_layout(
-                    xaxis_title="Date",
-                    yaxis_title="Tokens Used",
-                    showlegend=False
+        if metrics["total_operations"]:
+            fig = px.bar(
+                recent,
+                x='Date',
+                y='Tokens',
+                title='Daily Token Usage (30 days)'
+            )
+            fig.add_scatter(x=recent['Date'], y=recent['Tokens7dAvg'], name='7-day average')
+            fig.update_layout(
+                xaxis_title="Date",
+                yaxis_title="Tokens Used",
+                showlegend=False
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+            _, _, tokens_delta = metrics["tokens_week_over_week"]
+            tokens_per_email = metrics["tokens_per_email"]
+            mcol1, mcol2, mcol3 = st.columns(3)
+            with mcol1:
+                st.metric(
+                    "Total Tokens",
+                    f"{metrics['total_tokens']:,}",
+                    delta=f"{tokens_delta:+.0f}% week over week" if tokens_delta is not None else None
                 )
-                st.plotly_chart(fig, use_container_width=True)
+            with mcol2:
+                st.metric("Total Operations", f"{metrics['total_operations']:,}")
+            with mcol3:
+                st.metric("Tokens per Email", f"{tokens_per_email:,.0f}" if tokens_per_email else "-")
 
-                # Show total metrics
-                total_metrics = df_tokens.agg({
-                    'Tokens': 'sum',
-                    'Operations': 'sum'
-                })
-                
-                mcol1, mcol2 = st.columns(2)
-                with mcol1:
-                    st.metric("Total Tokens", f"{int(total_metrics['Tokens']):,}")
-                with mcol2:
-                    st.metric("Total Operations", f"{int(total_metrics['Operations']):,}")
-                
-            else:
-                st.info("No token usage data available yet")
-                
-        except Exception as e:
-            st.error(f"Error loading token metrics: {str(e)}")
-            print(f"Token metrics error: {str(e)}")
+            st.markdown("**Tokens by Operation**")
+            st.bar_chart(metrics["tokens_by_operation"])
+        else:
+            st.info("No token usage data available yet")
+
+    with tab3:
+        st.subheader("Last 12 Months")
+        # Includes rows moved to the Parquet archive
+        year = daily[daily["Date"] >= daily["Date"].max() - pd.Timedelta(days=364)]
+        if metrics["total_emails"]:
+            fig = px.bar(year, x='Date', y='Emails', title='Daily Emails (12 months)')
+            fig.update_layout(xaxis_title="Date", yaxis_title="Emails Sent", showlegend=False)
+            st.plotly_chart(fig, use_container_width=True)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("**Top Recipients**")
+                st.dataframe(metrics["top_recipients"], use_container_width=True, hide_index=True)
+            with col2:
+                st.markdown("**Emails per Recipient**")
+                st.bar_chart(metrics["recipient_frequency"], x="EmailsPerRecipient", y="Recipients")
+        else:
+            st.info("No email activity data available yet")
 
 if st.session_state.active_menu == "Data Metrics":
     metrics_dashboard_page()
+
+
+# ----- HISTORY -----
+def history_page():
+    st.title("History")
+    db = st.session_state.db
+
+    table = st.radio(
+        "Show",
+        ["email_activities", "conversations"],
+        format_func=lambda name: name.replace("_", " ").title(),
+        horizontal=True
+    )
+    page_size = st.selectbox("Rows per page", [25, 50, 100], index=1)
+
+    # Stack of keyset cursors, one per page visited; None is the first page
+    state_key = f"history_cursors_{table}_{page_size}"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = [None]
+    cursors = st.session_state[state_key]
+
+    try:
+        # Older pages continue into rows moved to the Parquet archive
+        rows, next_cursor = get_email_archive().get_history_page(db, table, cursors[-1], page_size)
+        if rows:
+            st.dataframe(pd.DataFrame(rows, columns=HISTORY_COLUMNS[table]), use_container_width=True)
+        else:
+            st.info("No history yet")
+
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            st.button("Previous", disabled=len(cursors) == 1, on_click=cursors.pop)
+        with col2:
+            st.caption(f"Page {len(cursors)}")
+        with col3:
+            st.button("Next", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,))
+    except Exception as e:
+        st.error(f"Error loading history: {str(e)}")
+
+    try:
+        queued, next_attempt, dead = db.get_retry_status()
+        if queued or dead:
+            st.subheader("Failed Emails")
+            st.caption(f"{queued} waiting for retry"
+                       + (f", next attempt {next_attempt:%Y-%m-%d %H:%M}" if next_attempt else "")
+                       + f" · {dead} in dead letters")
+            if dead:
+                st.dataframe(pd.DataFrame(
+                    db.get_dead_letters(),
+                    columns=['Recipient', 'Email', 'Subject', 'Stage', 'Attempts', 'Error', 'Class', 'Failed At']
+                ), use_container_width=True)
+    except Exception as e:
+        st.error(f"Error loading failed emails: {str(e)}")
+
+    st.subheader("Export")
+    export_format = st.selectbox("Format", ["csv", "parquet"])
+    if st.button("Prepare Export"):
+        # A private file per request, so concurrent exports never share a path
+        fd, export_path = tempfile.mkstemp(prefix=f"{table}_export_", suffix=f".{export_format}")
+        os.close(fd)
+        try:
+            with st.spinner("Exporting..."):
+                count = export_history(db, table, export_path, export_format, archive=get_email_archive())
+            with open(export_path, "rb") as f:
+                st.download_button(
+                    label=f"Download {count:,} rows",
+                    data=f.read(),
+                    file_name=f"{table}_export.{export_format}",
+                    mime="text/csv" if export_format == "csv" else "application/octet-stream"
+                )
+        except Exception as e:
+            st.error(f"Error exporting history: {str(e)}")
+        finally:
+            if os.path.exists(export_path):
+                os.remove(export_path)
+
+if st.session_state.active_menu == "History":
+    history_page()
         
 
 st.sidebar.caption(f"Current Menu: :red[{st.session_state.active_menu}]")
@@ -0,0 +1,286 @@
+import argparse
+import json
+import os
+import shutil
+import uuid
+from datetime import date, datetime, timedelta
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from database import ARCHIVE_COLUMNS, HISTORY_COLUMNS, DatabaseManager
+
+load_dotenv()
+
+
+ARCHIVE_SCHEMAS = {
+    "email_activities": pa.schema([
+        ("id", pa.int64()),
+        ("recipient", pa.string()),
+        ("recipient_email", pa.string()),
+        ("subject", pa.string()),
+        ("context", pa.string()),
+        ("email_body", pa.string()),
+        ("generated_text", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+    ]),
+    "token_usage": pa.schema([
+        ("id", pa.int64()),
+        ("tokens_used", pa.int64()),
+        ("operation_type", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+    ]),
+}
+
+# Archived email aggregates per tenant; the leading underscore keeps pyarrow's dataset discovery off it
+ROLLUP_FILE = "_rollup.json"
+
+# Hive-style user_id=<id>/month=YYYY-MM directories, always read back as strings
+PARTITIONING = ds.partitioning(
+    pa.schema([("user_id", pa.string()), ("month", pa.string())]), flavor="hive"
+)
+
+
+class EmailArchive:
+    """
+    Partitioned Parquet archive for cold email_activities and token_usage rows.
+    Rows older than the retention window are moved out of Postgres; the
+    analytics readers combine the archive with the live rows.
+    """
+
+    def __init__(self, root_dir=None):
+        self.root_dir = root_dir or os.getenv('ARCHIVE_DIR', 'archive')
+        # user_id -> (rollup file mtime, parsed rollup)
+        self._rollups = {}
+
+    def _table_dir(self, table):
+        return os.path.join(self.root_dir, table)
+
+    def archive_cold_rows(self, db, older_than_days=90, batch_size=10000):
+        """Move rows older than older_than_days to Parquet, returns rows archived per table"""
+        cutoff = datetime.now() - timedelta(days=older_than_days)
+        counts = {}
+        for table in ARCHIVE_COLUMNS:
+            schema = ARCHIVE_SCHEMAS[table]
+            max_id = None
+            count = 0
+            for rows in db.iter_rows_before(table, cutoff, batch_size):
+                columns = list(zip(*rows))
+                batch = pa.Table.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema
+                )
+                batch = batch.append_column("user_id", pa.array([db.user_id] * len(rows), pa.string()))
+                batch = batch.append_column("month", pc.strftime(batch["timestamp"], format="%Y-%m"))
+                pq.write_to_dataset(
+                    batch,
+                    self._table_dir(table),
+                    partitioning=PARTITIONING,
+                    basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet"
+                )
+                # Rows arrive in id order, so the last one is the batch maximum
+                max_id = columns[0][-1]
+                count += len(rows)
+            if max_id is not None:
+                db.delete_rows_before(table, cutoff, max_id)
+            counts[table] = count
+        if counts.get("email_activities"):
+            self._write_rollup(db.user_id)
+        return counts
+
+    def _rollup_path(self, user_id):
+        return os.path.join(self._tenant_dir("email_activities", user_id), ROLLUP_FILE)
+
+    def _write_rollup(self, user_id):
+        """Aggregate the archived emails once per archive run, so readers never scan the partitions"""
+        emails = self._scan("email_activities", user_id, ["timestamp", "recipient_email", "recipient"])
+        daily = emails.groupby(emails["timestamp"].dt.date).size()
+        rollup = {
+            "total_emails": len(emails),
+            "daily": {day.isoformat(): int(count) for day, count in daily.items()},
+            "last_sent": emails["timestamp"].max().isoformat() if len(emails) else None,
+            "recipients": sorted(set(emails["recipient_email"].fillna(emails["recipient"]))),
+        }
+        path = self._rollup_path(user_id)
+        # Written aside and renamed, so a reader never sees half a file
+        temp_path = os.path.join(os.path.dirname(path), f"_{uuid.uuid4().hex}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(rollup, f)
+        os.replace(temp_path, path)
+
+    def email_rollup(self, user_id):
+        """
+        Archived email aggregates: total_emails, daily counts, last_sent and
+        the distinct recipients, plus a stamp that changes with every archive
+        run. None when nothing is archived.
+        """
+        path = self._rollup_path(user_id)
+        if not os.path.exists(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                return None
+            # Archived before rollups were written
+            self._write_rollup(user_id)
+        stamp = os.stat(path).st_mtime_ns
+        cached = self._rollups.get(user_id)
+        if cached is not None and cached["stamp"] == stamp:
+            return cached
+        with open(path, encoding="utf-8") as f:
+            rollup = json.load(f)
+        rollup["stamp"] = stamp
+        rollup["daily"] = {date.fromisoformat(day): count for day, count in rollup["daily"].items()}
+        rollup["last_sent"] = rollup["last_sent"] and datetime.fromisoformat(rollup["last_sent"])
+        self._rollups[user_id] = rollup
+        return rollup
+
+    def _scan(self, table, user_id, columns):
+        path = self._table_dir(table)
+        if not os.path.isdir(path):
+            return ARCHIVE_SCHEMAS[table].empty_table().select(columns).to_pandas()
+        dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+        df = dataset.to_table(columns=["id"] + columns, filter=ds.field("user_id") == user_id).to_pandas()
+        # A run interrupted between writing and deleting can archive a row twice
+        return df.drop_duplicates("id")[columns]
+
+    def _tenant_dir(self, table, user_id):
+        # pyarrow URI-encodes partition values in directory names
+        return os.path.join(self._table_dir(table), f"user_id={quote(user_id, safe='')}")
+
+    def _history_months(self, table, user_id, newest_first=False):
+        """Archived history rows one month partition at a time, sorted by (timestamp, id)"""
+        tenant_dir = self._tenant_dir(table, user_id)
+        if table not in ARCHIVE_SCHEMAS or not os.path.isdir(tenant_dir):
+            return
+        columns = list(HISTORY_COLUMNS[table])
+        order = "descending" if newest_first else "ascending"
+        months = [name for name in os.listdir(tenant_dir) if name.startswith("month=")]
+        for month in sorted(months, reverse=newest_first):
+            rows = ds.dataset(os.path.join(tenant_dir, month), format="parquet").to_table(columns=columns)
+            rows = rows.sort_by([("timestamp", order), ("id", order)])
+            # A run interrupted between writing and deleting can archive a row twice
+            unique, seen = [], set()
+            for row in rows.to_pylist():
+                if row["id"] not in seen:
+                    seen.add(row["id"])
+                    unique.append(tuple(row.values()))
+            yield month.partition("=")[2], unique
+
+    def iter_history(self, db, table, batch_size=5000):
+        """Stream a table's full history, archived rows first and then the live rows, oldest first"""
+        for _, rows in self._history_months(table, db.user_id):
+            for i in range(0, len(rows), batch_size):
+                yield rows[i:i + batch_size]
+        yield from db.iter_history(table, batch_size)
+
+    def get_history_page(self, db, table, cursor=None, page_size=50):
+        """
+        DatabaseManager.get_history_page continued into the archive: once the
+        live rows run out, the page is filled with archived rows, which are
+        all older. The returned cursor works for both.
+        """
+        rows, next_cursor = db.get_history_page(table, cursor, page_size)
+        if next_cursor is not None:
+            return rows, next_cursor
+        if rows:
+            last = dict(zip(HISTORY_COLUMNS[table], rows[-1]))
+            cursor = (last["timestamp"], last["id"])
+        remaining = page_size - len(rows)
+        older = []
+        for month, month_rows in self._history_months(table, db.user_id, newest_first=True):
+            if cursor and month > f"{cursor[0]:%Y-%m}":
+                continue
+            older += [row for row in month_rows if not cursor or (row[-1], row[0]) < tuple(cursor)]
+            # One row past the page tells whether another page follows
+            if len(older) > remaining:
+                break
+        if len(older) <= remaining:
+            return rows + older, None
+        rows = rows + older[:remaining]
+        last = dict(zip(HISTORY_COLUMNS[table], rows[-1]))
+        return rows, (last["timestamp"], last["id"])
+
+    def delete_tenant(self, user_id):
+        """Remove every archived partition of a tenant, returns the number of tables touched"""
+        removed = 0
+        for table in ARCHIVE_SCHEMAS:
+            tenant_dir = self._tenant_dir(table, user_id)
+            if os.path.isdir(tenant_dir):
+                shutil.rmtree(tenant_dir)
+                removed += 1
+        return removed
+
+    def archived_snapshot(self, user_id):
+        """Archived rows aggregated into the same shape as DatabaseManager.get_metrics_snapshot"""
+        emails = self._scan("email_activities", user_id, ["timestamp", "recipient_email", "recipient"])
+        emails["day"] = emails["timestamp"].dt.date
+        emails["recipient"] = emails["recipient_email"].fillna(emails["recipient"])
+        tokens = self._scan("token_usage", user_id, ["timestamp", "operation_type", "tokens_used"])
+        tokens["day"] = tokens["timestamp"].dt.date
+
+        daily_emails = emails.groupby("day").size()
+        recipients = emails.groupby("recipient").agg(count=("day", "size"), last=("day", "max"))
+        daily_tokens = tokens.groupby(["day", "operation_type"])["tokens_used"].agg(["sum", "size"])
+        return {
+            "daily_emails": list(daily_emails.items()),
+            "recipients": [(r, int(c), d) for r, c, d in recipients.itertuples()],
+            "daily_tokens": [(d, op, int(t), int(n)) for (d, op), t, n in daily_tokens.itertuples()],
+        }
+
+    def email_metrics(self, db, metrics):
+        """
+        get_email_metrics as a dict (see chat_cache.email_metrics) with the
+        archived rows added from the rollup, so totals and period counts cover
+        the full history. last_id stays the live one.
+        """
+        rollup = self.email_rollup(db.user_id)
+        if not rollup or not rollup["total_emails"]:
+            return metrics
+        daily = rollup["daily"]
+        today = date.today()
+        week_start = today - timedelta(days=today.weekday())
+        merged = dict(metrics)
+        merged["total_emails"] += rollup["total_emails"]
+        merged["emails_today"] += daily.get(today, 0)
+        merged["emails_yesterday"] += daily.get(today - timedelta(days=1), 0)
+        merged["emails_this_week"] += sum(count for day, count in daily.items() if day >= week_start)
+        merged["emails_this_month"] += sum(count for day, count in daily.items() if day >= today.replace(day=1))
+        # A recipient or day can be on both sides of the cutoff, count those once
+        shared_recipients, shared_days = db.get_email_overlap(rollup["recipients"], list(daily))
+        merged["unique_recipients"] += len(rollup["recipients"]) - shared_recipients
+        merged["active_days"] += len(daily) - shared_days
+        archived_last = rollup["last_sent"]
+        merged["last_sent"] = max(metrics["last_sent"] or archived_last, archived_last)
+        return merged
+
+
+def archive_all_tenants(root_dir=None, older_than_days=90):
+    """Archive cold rows for every tracked tenant"""
+    archive = EmailArchive(root_dir)
+    admin = DatabaseManager("archiver")
+    try:
+        admin.backfill_activity()
+        tenants = admin.execute_query("SELECT user_id, storage_mode FROM public.tenant_activity")
+    finally:
+        admin.close_pool()
+
+    for user_id, storage_mode in tenants:
+        db = DatabaseManager(user_id, storage_mode=storage_mode)
+        try:
+            counts = archive.archive_cold_rows(db, older_than_days)
+            if any(counts.values()):
+                print(f"Archived {counts} for {user_id}")
+        except Exception as e:
+            print(f"Archive error for {user_id}: {e}")
+        finally:
+            db.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move cold email activity to Parquet")
+    parser.add_argument("--root-dir", default=None)
+    parser.add_argument("--older-than-days", type=int, default=90)
+    args = parser.parse_args()
+    archive_all_tenants(args.root_dir, args.older_than_days)
@@ -0,0 +1,349 @@
+import asyncio
+import inspect
+from contextlib import asynccontextmanager
+
+import aiohttp
+import aiosmtplib
+
+from autmati import EmailAutomation
+from dry_run import DryRunGenerator
+from message_renderer import set_sender
+from recipient_filter import shard_of
+from records import read_recipients
+from retry_queue import GenerationError
+from sender_pool import SenderPool, SenderPoolExhausted, THROTTLE_CODES
+
+
+class AsyncSenderPool:
+    """
+    asyncio front-end for a SenderPool: reuses its accounts, quotas and
+    rotation, but keeps pooled aiosmtplib connections per account.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._idle = {id(account): [] for account in pool.accounts}
+        self._slots = {id(account): asyncio.Semaphore(account.max_connections) for account in pool.accounts}
+
+    @property
+    def max_concurrency(self):
+        return self.pool.max_concurrency
+
+    async def _open_connection(self, account):
+        smtp = aiosmtplib.SMTP(hostname=account.smtp_server, port=account.port, start_tls=True,
+                               timeout=account.timeout)
+        await smtp.connect()
+        await smtp.login(account.sender_email, account.sender_password)
+        return smtp
+
+    @asynccontextmanager
+    async def connection(self, account):
+        """Borrow a logged-in async SMTP connection, reusing idle ones"""
+        async with self._slots[id(account)]:
+            idle = self._idle[id(account)]
+            smtp = idle.pop() if idle else await self._open_connection(account)
+            try:
+                yield smtp
+            except Exception:
+                smtp.close()
+                raise
+            idle.append(smtp)
+
+    async def send(self, message, recipient_email):
+        """Send message bytes through the first account with quota, returns the account used"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.pool.wait_timeout
+        last_error = None
+
+        while True:
+            # Accounts with a free connection first, so a saturated one does not queue every send
+            for account in sorted(self.pool._candidates(), key=lambda account: self._slots[id(account)].locked()):
+                if not account.try_reserve():
+                    continue
+                try:
+                    async with self.connection(account) as smtp:
+                        await smtp.sendmail(account.sender_email, [recipient_email],
+                                            set_sender(message, account.sender_email))
+                    return account
+                except aiosmtplib.SMTPRecipientsRefused:
+                    # The recipient is the problem, another account will not help
+                    raise
+                except aiosmtplib.SMTPAuthenticationError as e:
+                    print(f"Disabling sender {account.sender_email}: {e}")
+                    account.disabled = True
+                    last_error = e
+                except aiosmtplib.SMTPServerDisconnected as e:
+                    last_error = e
+                except aiosmtplib.SMTPResponseException as e:
+                    if e.code not in THROTTLE_CODES:
+                        raise
+                    print(f"Sender {account.sender_email} throttled: {e}")
+                    account.throttle(self.pool.throttle_cooldown)
+                    last_error = e
+                except OSError as e:
+                    print(f"Sender {account.sender_email} unreachable: {e}")
+                    account.throttle(min(self.pool.throttle_cooldown, 30))
+                    last_error = e
+
+            if all(account.disabled for account in self.pool.accounts):
+                raise SenderPoolExhausted(f"All sender accounts are disabled: {last_error}")
+
+            wait = min(account.next_available() for account in self.pool.accounts)
+            if loop.time() + wait > deadline:
+                raise SenderPoolExhausted(
+                    f"No sender account available within {self.pool.wait_timeout}s: {last_error}"
+                )
+            await asyncio.sleep(max(wait, 0.05))
+
+    async def close(self):
+        """Close all pooled connections"""
+        for idle in self._idle.values():
+            while idle:
+                smtp = idle.pop()
+                try:
+                    await smtp.quit()
+                except Exception:
+                    smtp.close()
+
+
+class AsyncEmailAutomation(EmailAutomation):
+    """
+    asyncio variant of EmailAutomation with the same inputs and outputs.
+    One event loop runs the whole campaign: generation goes through a pooled
+    aiohttp session, sends through pooled aiosmtplib connections, and
+    semaphores cap the requests in flight instead of one thread per request.
+    """
+
+    def __init__(self, *args, max_in_flight=None, http_connections=None, **kwargs):
+        self._max_in_flight = max_in_flight
+        self._http_connections = http_connections
+        super().__init__(*args, **kwargs)
+        self._session = None
+        # A SenderPool gets async connections; sinks (dry runs) are called as they are
+        self._async_pool = AsyncSenderPool(self.sender_pool) if isinstance(self.sender_pool, SenderPool) else None
+        if self.completion_fn == self._chat_completion:
+            self.completion_fn = self._async_chat_completion
+        elif isinstance(self.completion_fn, DryRunGenerator):
+            self.completion_fn = self.completion_fn.call_async
+
+    def apply_settings(self, settings):
+        super().apply_settings(settings)
+        self.max_in_flight = self._max_in_flight or settings.campaign.max_in_flight
+        # Used when the next HTTP session is opened
+        self.http_connections = self._http_connections or settings.llm.http_connections
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _http_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.http_connections),
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}"
+                }
+            )
+        return self._session
+
+    async def _async_chat_completion(self, data):
+        """POST a chat completion request, returns the message content"""
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        async with self._http_session().post(self.api_url, json=data, timeout=timeout) as response:
+            if response.status == 200:
+                result = await response.json()
+                self.token_stats.record_usage(result.get('usage'))
+                return result['choices'][0]['message']['content']
+            raise GenerationError(f"Error generating email: {response.status} - {await response.text()}",
+                                  status=response.status)
+
+    async def _complete(self, data):
+        if inspect.iscoroutinefunction(self.completion_fn):
+            return await self.completion_fn(data)
+        return await asyncio.to_thread(self.completion_fn, data)
+
+    async def generate_email(self, subject, recipient_name, email_context, raise_errors=False):
+        builder = self.prompt_builder(email_context)
+        data = builder.build(recipient_name, subject)
+        self.token_stats.record_estimate(builder.estimate_prompt_tokens(data))
+        try:
+            email_body = await self._complete(data)
+            if not email_body or not email_body.strip():
+                raise GenerationError("Empty email body returned")
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"{e}")
+            return None
+        return email_body.strip()
+
+    async def generate_email_batch(self, items, email_context):
+        builder = self.prompt_builder(email_context)
+        data = builder.build_batch(items)
+        self.token_stats.record_estimate(builder.estimate_prompt_tokens(data))
+        try:
+            bodies = builder.parse_batch(await self._complete(data), items)
+        except Exception as e:
+            print(f"Batched generation failed, retrying items one at a time: {e}")
+            bodies = {}
+        missing = [item for item in items if item[0] not in bodies]
+        retried = await asyncio.gather(*(
+            self.generate_email(subject, recipient_name, email_context)
+            for _, recipient_name, subject in missing
+        ))
+        bodies.update({row_id: body for (row_id, _, _), body in zip(missing, retried) if body})
+        return bodies
+
+    async def send_rendered(self, recipient_email, message, raise_errors=False):
+        """Send pre-serialized message bytes through the sender pool"""
+        try:
+            if self._async_pool is not None:
+                account = await self._async_pool.send(message, recipient_email)
+            else:
+                account = await asyncio.to_thread(self.sender_pool.send, message, recipient_email)
+            print(f"Email sent to {recipient_email} via {account.sender_email}")
+            self._count("sent")
+            return True
+        except Exception as e:
+            print(f"Failed to send email to {recipient_email}: {str(e)}")
+            self._count("failed")
+            if raise_errors:
+                raise
+            return False
+
+    async def send_email(self, recipient_email, subject, email_body, raise_errors=False):
+        return await self.send_rendered(recipient_email, self.render_email(recipient_email, subject, email_body),
+                                        raise_errors)
+
+    async def _send_row(self, row, context, email_body):
+        self._stage("send", 1)
+        try:
+            await self.send_email(row['email'], row['subject'], email_body, raise_errors=True)
+        except Exception as e:
+            self._record_failure(row, context, "send", e, email_body)
+            return False
+        finally:
+            self._stage("send", -1)
+        if self.on_sent is not None:
+            # on_sent usually writes to the database, keep it off the event loop
+            await asyncio.to_thread(self._record_sent, row, context, email_body)
+        return True
+
+    async def _process_row(self, row, context):
+        self._stage("generate", 1)
+        try:
+            email_body = await self.generate_email(row['subject'], row['recipient_name'], context,
+                                                   raise_errors=True)
+        except Exception as e:
+            self._record_failure(row, context, "generate", e)
+            return False
+        finally:
+            self._stage("generate", -1)
+        return await self._send_row(row, context, email_body)
+
+    async def _process_chunk(self, rows, context):
+        items = [(i, row['recipient_name'], row['subject']) for i, row in enumerate(rows)]
+        self._stage("generate", len(rows))
+        try:
+            bodies = await self.generate_email_batch(items, context)
+        finally:
+            self._stage("generate", -len(rows))
+        sends = []
+        for i, row in enumerate(rows):
+            if i in bodies:
+                sends.append(self._send_row(row, context, bodies[i]))
+            else:
+                self._record_failure(row, context, "generate", GenerationError("No body generated"))
+        # The sender pool caps connections, so the chunk's sends can all be in flight together
+        return await asyncio.gather(*sends)
+
+    async def process_csv_and_send_emails(self, csv_filename, context, max_workers=None, batch_size=None,
+                                          recipient_filter=None, shards=1, shard=None, on_progress=None,
+                                          progress=None):
+        """
+        Read CSV file and send emails to each recipient.
+        Takes the same arguments as EmailAutomation.process_csv_and_send_emails;
+        max_workers caps the rows (or row chunks) in progress at once and
+        defaults to max_in_flight. Rows are read in batches of batch_size
+        (campaign.batch_size by default); after each batch failed rows go to
+        retry_queue and on_progress, when given, is called with the running
+        totals. Returns the (email, reason) pairs rejected by recipient_filter.
+        Sharded runs (shards > 1) need worker processes and are not supported
+        here; shard=(index, count) restricts the run to one address-hash shard.
+        progress, a ProgressReporter, is updated as rows complete.
+        """
+        if shards > 1:
+            raise ValueError("AsyncEmailAutomation runs in a single event loop; use EmailAutomation for "
+                             "shards > 1, or run one process per shard with shard=(index, count)")
+        in_flight = asyncio.Semaphore(max_workers or self.max_in_flight)
+        tasks = set()
+        skipped = []
+        batch_size = batch_size or self.settings.campaign.batch_size
+        chunk_size = self.prompt_builder(context).batch_size_for(self.generation_batch_size)
+        self.progress = progress
+
+        async def run(coro):
+            try:
+                await coro
+            except Exception as e:
+                print(f"Error processing row: {e}")
+            finally:
+                in_flight.release()
+
+        async def submit(coro):
+            await in_flight.acquire()
+            task = asyncio.create_task(run(coro))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        async def process_batch(rows):
+            if chunk_size <= 1:
+                for row in rows:
+                    await submit(self._process_row(row, context))
+            else:
+                for i in range(0, len(rows), chunk_size):
+                    await submit(self._process_chunk(rows[i:i + chunk_size], context))
+            await asyncio.gather(*tasks)
+            if self.retry_queue is not None:
+                await asyncio.to_thread(self.retry_queue.flush)
+            if on_progress:
+                on_progress({**self.counts, "skipped": len(skipped)})
+
+        try:
+            batch = []
+            for row in read_recipients(csv_filename):
+                if shard is not None and shard_of(row.email, shard[1]) != shard[0]:
+                    continue
+                reason = recipient_filter.check(row.email) if recipient_filter else None
+                if reason:
+                    print(f"Skipping {row.email}: {reason}")
+                    skipped.append((row.email, reason))
+                    continue
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    await process_batch(batch)
+                    batch = []
+            if batch:
+                await process_batch(batch)
+        except Exception as e:
+            print(f"Error processing CSV file: {e}")
+        finally:
+            await self.close()
+            if self.retry_queue is not None:
+                await asyncio.to_thread(self.retry_queue.flush)
+            if progress is not None:
+                progress.finish()
+            self.progress = None
+        return skipped
+
+    async def close(self):
+        """Close the HTTP session and pooled SMTP connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._async_pool is not None:
+            await self._async_pool.close()
+        else:
+            self.sender_pool.close()
@@ -1,110 +1,445 @@
-import csv
 import requests
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 import datetime
 from dotenv import load_dotenv
 import os
+from sender_pool import SenderAccount, SenderPool
+from message_renderer import render_message, render_messages
+from dry_run import DryRunGenerator, MailSink
+from recipient_filter import shard_of
+from retry_queue import GenerationError
+from records import BodySpool, read_recipients
+from prompt_builder import PromptBuilder, TokenStats
+from settings import get_settings
+import threading
+import sys
 
 #load .env file
 load_dotenv()
 
 
 class EmailAutomation:
-    def __init__(self, api_key, smtp_server, port, sender_email, sender_password, sender_name):
+    def __init__(self, api_key, smtp_server, port, sender_email, sender_password, sender_name,
+                 sender_accounts=None, sender_pool=None, rate_limit=None,
+                 html_alternative=False, render_processes=None, completion_fn=None,
+                 generation_batch_size=None, retry_queue=None):
         self.api_key = api_key
         self.smtp_server = smtp_server
         self.port = port
         self.sender_email = sender_email
         self.sender_password = sender_password
         self.sender_name = sender_name
-        self.api_url = "https://api.hyperbolic.xyz/v1/chat/completions" 
-    
+        self.html_alternative = html_alternative
+        # Callable taking the request payload and returning the body, swapped out for dry runs
+        self.completion_fn = completion_fn or self._chat_completion
+        self.token_stats = TokenStats()
+        self._prompt_builder = None
+        self._builder_lock = threading.Lock()
+        # Running outcome counts for the campaign, merged across shards in sharded mode
+        self.counts = {"sent": 0, "failed": 0, "not_generated": 0}
+        self._counts_lock = threading.Lock()
+        self.sender_accounts = sender_accounts
+        # None follows smtp.rate_limit from the settings, 0 is unlimited
+        self.rate_limit = rate_limit
+        # Explicit arguments win over the settings, also after a reload
+        self._generation_batch_size = generation_batch_size
+        self._render_processes = render_processes
+        self._custom_pool = sender_pool is not None
+        # Failed rows are handed to the retry queue instead of being dropped
+        self.retry_queue = retry_queue
+        # Called with (row, context, email_body) after each successful send, e.g. to save the activity
+        self.on_sent = None
+        # Called with (row, stage, error) for each row that fails to generate or send
+        self.on_failed = None
+        # ProgressReporter for the campaign currently running, if any
+        self.progress = None
 
-    def generate_email(self, subject, recipient_name, email_context):
+        # The configured sender is always the first account; extra accounts
+        # (list of SenderAccount kwargs) add their own quota to the pool.
+        settings = get_settings()
+        self._settings_limited = []
+        if sender_pool is None:
+            smtp = settings.smtp
+            accounts = [{"smtp_server": smtp_server, "port": port, "sender_email": sender_email,
+                         "sender_password": sender_password, "rate_limit": rate_limit}]
+            accounts += sender_accounts or []
+            sender_pool = SenderPool(
+                [SenderAccount(**{"rate_period": smtp.rate_period, "max_connections": smtp.max_connections,
+                                  "timeout": smtp.timeout, **account,
+                                  "rate_limit": self._rate_limit(account.get("rate_limit"), smtp)})
+                 for account in accounts],
+                strategy="weighted" if sender_accounts else "round_robin",
+                throttle_cooldown=smtp.throttle_cooldown, wait_timeout=smtp.wait_timeout
+            )
+            # Accounts without their own limit pick up smtp.rate_limit on reload
+            self._settings_limited = [account for account, config in zip(sender_pool.accounts, accounts)
+                                      if config.get("rate_limit") is None]
+        self.sender_pool = sender_pool
+        self.apply_settings(settings)
+
+    @staticmethod
+    def _rate_limit(limit, smtp):
+        limit = smtp.rate_limit if limit is None else limit
+        return limit or None
+
+    def apply_settings(self, settings):
+        """
+        Adopt a settings snapshot: model, API URL, timeouts, batch sizes and
+        the limits of a pool built from the configuration. Running workers
+        call refresh_settings() between polls to pick up edits without a
+        restart; connection counts only change for new instances.
+        """
+        self.settings = settings
+        self.api_url = settings.llm.api_url
+        self.model_id = settings.llm.model_id
+        self.request_timeout = settings.llm.request_timeout
+        # Recipients packed into one LLM request, 1 keeps one request per email
+        self.generation_batch_size = self._generation_batch_size or settings.campaign.generation_batch_size
+        # Worker processes for the render stage, None renders inline
+        self.render_processes = self._render_processes or settings.campaign.render_processes
+        if not self._custom_pool:
+            smtp = settings.smtp
+            self.sender_pool.throttle_cooldown = smtp.throttle_cooldown
+            self.sender_pool.wait_timeout = smtp.wait_timeout
+            for account in self.sender_pool.accounts:
+                account.timeout = smtp.timeout
+            for account in self._settings_limited:
+                account.rate_limit = self._rate_limit(None, smtp)
+                account.rate_period = smtp.rate_period
+
+    def refresh_settings(self):
+        """Apply the current settings if they changed since the last call"""
+        settings = get_settings()
+        if settings is not self.settings:
+            self.apply_settings(settings)
+        return settings
+
+
+    @classmethod
+    def dry_run(cls, sender_name, sink_path=None, sender_email="dry-run@example.invalid",
+                latency=0.0, max_concurrency=4, **kwargs):
+        """
+        Build an instance that runs the full campaign path offline: a
+        deterministic local generator replaces the API and a MailSink
+        records the rendered messages instead of sending them.
+        """
+        return cls(
+            api_key=None, smtp_server=None, port=0, sender_email=sender_email,
+            sender_password=None, sender_name=sender_name,
+            sender_pool=MailSink(sink_path, max_concurrency, sender_email),
+            completion_fn=DryRunGenerator(latency), **kwargs
+        )
+
+    def _chat_completion(self, data):
+        """POST a chat completion request, returns the message content"""
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
-        prompt = f"""
-        Write a professional email with the following details:
-               f"[INSTRUCTION] Write a business email with these parameters:\n"
-                f"- From: {self.sender_name}\n"
-                f"- To: {recipient_name}\n"
-                f"- Subject: {subject}\n"
-                f"- Context: {email_context}\n"
-                f"[IMPORTANT]\n"
-                f"- Do not repeat or paraphrase the last email sent.\n"
-                f"- Only respond if the email requires additional information, confirmation, or follow-up.\n"
-                f"- Check the context to avoid duplicating responses.\n"
-                f"[OUTPUT FORMAT]\n"
-                f"- Write only the email body.\n"
-                f"- Be concise and professional.\n"
-                f"- Conclude with a signature using the sender's name: {self.sender_name}.\n"
-                f"[BEGIN EMAIL]\n"
-        """
-        data = {
-            "model": "meta-llama/Meta-Llama-3-70B-Instruct",  
-            "messages": [
-                {"role": "system", "content": "[SYSTEM] You are a professional email writer. Generate only the email body.\n"},
-                {"role": "user", "content": prompt}
-            ],
-            "stream": False
-        }
-        response = requests.post(self.api_url, json=data, headers=headers)
+        response = requests.post(self.api_url, json=data, headers=headers, timeout=self.request_timeout)
         if response.status_code == 200:
             result = response.json()
-            email_body = result['choices'][0]['message']['content']
-            return email_body.strip()
-        else:
-            print(f"Error generating email: {response.status_code} - {response.text}")
+            self.token_stats.record_usage(result.get('usage'))
+            return result['choices'][0]['message']['content']
+        raise GenerationError(f"Error generating email: {response.status_code} - {response.text}",
+                              status=response.status_code)
+
+    def prompt_builder(self, email_context):
+        """Prompt builder for a campaign context, compiled once and reused for every row"""
+        with self._builder_lock:
+            builder = self._prompt_builder
+            if builder is None or builder.context != email_context or builder.model != self.model_id:
+                builder = self._prompt_builder = PromptBuilder(self.sender_name, email_context, self.model_id)
+            return builder
+
+    def generate_email(self, subject, recipient_name, email_context, raise_errors=False):
+        """Generate one body; failures return None, or raise with raise_errors"""
+        builder = self.prompt_builder(email_context)
+        data = builder.build(recipient_name, subject)
+        self.token_stats.record_estimate(builder.estimate_prompt_tokens(data))
+        try:
+            email_body = self.completion_fn(data)
+            if not email_body or not email_body.strip():
+                raise GenerationError("Empty email body returned")
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"{e}")
             return None
+        return email_body.strip()
+
+    def generate_email_batch(self, items, email_context):
+        """
+        Generate bodies for several (row_id, recipient_name, subject) items in
+        one structured request. Items the reply misses or gets wrong are retried
+        one at a time; returns {row_id: body} for every item that succeeded.
+        """
+        builder = self.prompt_builder(email_context)
+        data = builder.build_batch(items)
+        self.token_stats.record_estimate(builder.estimate_prompt_tokens(data))
+        try:
+            bodies = builder.parse_batch(self.completion_fn(data), items)
+        except Exception as e:
+            print(f"Batched generation failed, retrying items one at a time: {e}")
+            bodies = {}
+        for row_id, recipient_name, subject in items:
+            if row_id not in bodies:
+                email_body = self.generate_email(subject, recipient_name, email_context)
+                if email_body:
+                    bodies[row_id] = email_body
+        return bodies
 
-    def send_email(self, recipient_email, subject, email_body):
-        # Use smtplib to send the email
-        msg = MIMEMultipart()
-        msg['From'] = f"{self.sender_name} <{self.sender_email}>"
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(email_body, 'plain'))
+    def render_email(self, recipient_email, subject, email_body):
+        """Serialize a message to bytes ahead of the send stage"""
+        return render_message(self.sender_name, self.sender_email, recipient_email,
+                              subject, email_body, self.html_alternative)
 
+    def send_rendered(self, recipient_email, message, raise_errors=False):
+        """Send pre-serialized message bytes through the sender pool"""
         try:
-            server = smtplib.SMTP(self.smtp_server, self.port)
-            server.starttls()
-            server.login(self.sender_email, self.sender_password)
-            server.send_message(msg)
-            server.quit()
-            print(f"Email sent to {recipient_email}")
+            account = self.sender_pool.send(message, recipient_email)
+            print(f"Email sent to {recipient_email} via {account.sender_email}")
+            self._count("sent")
+            return True
         except Exception as e:
             print(f"Failed to send email to {recipient_email}: {str(e)}")
+            self._count("failed")
+            if raise_errors:
+                raise
+            return False
+
+    def _count(self, outcome, n=1):
+        with self._counts_lock:
+            self.counts[outcome] += n
+        if self.progress is not None:
+            self.progress.advance(outcome, n)
+
+    def _stage(self, stage, n):
+        if self.progress is not None:
+            self.progress.enqueue(stage, n)
+
+    def send_email(self, recipient_email, subject, email_body, raise_errors=False):
+        # Render first so the pooled SMTP connection is only held for network I/O
+        return self.send_rendered(recipient_email, self.render_email(recipient_email, subject, email_body),
+                                  raise_errors)
 
-    def process_csv_and_send_emails(self, csv_filename, context):
+    def _record_failure(self, row, context, stage, error, email_body=None):
+        if stage == "generate":
+            print(f"Failed to generate email content for {row['recipient_name']}. Email not sent.")
+            self._count("not_generated")
+        if self.on_failed is not None:
+            self.on_failed(row, stage, error)
+        if self.retry_queue is not None:
+            self.retry_queue.record_failure(row, context, stage, error, email_body)
+
+    def _record_sent(self, row, context, email_body):
+        if self.on_sent is None:
+            return
+        try:
+            self.on_sent(row, context, email_body)
+        except Exception as e:
+            # The email is out, a failed record must not turn it into a retry
+            print(f"Failed to record the email sent to {row['email']}: {e}")
+
+    def _generate_row(self, row, context, spool):
+        # Generate the email body using the LLM model, keeping only its spool handle
+        try:
+            handle = spool.put(self.generate_email(row.subject, row.recipient_name, context, raise_errors=True))
+            self._stage("send", 1)
+            return handle
+        except Exception as e:
+            self._record_failure(row, context, "generate", e)
+            return None
+        finally:
+            self._stage("generate", -1)
+
+    def _send_row(self, row, context, spool, handle, message=None):
+        email_body = spool.get(handle)
+        try:
+            if message is None:
+                message = self.render_email(row.email, row.subject, email_body)
+            self.send_rendered(row.email, message, raise_errors=True)
+        except Exception as e:
+            self._record_failure(row, context, "send", e, email_body)
+            return False
+        finally:
+            self._stage("send", -1)
+        self._record_sent(row, context, email_body)
+        return True
+
+    def _map(self, executor, fn, items):
+        """executor.map that keeps rendering progress from the calling thread while it waits"""
+        futures = [executor.submit(fn, item) for item in items]
+        if self.progress is not None:
+            while wait(futures, timeout=self.progress.interval).not_done:
+                self.progress.tick()
+        return [future.result() for future in futures]
+
+    def _generate_rows(self, rows, context, executor, spool):
+        if self.generation_batch_size <= 1:
+            return self._map(executor, lambda row: self._generate_row(row, context, spool), rows)
+
+        size = self.prompt_builder(context).batch_size_for(self.generation_batch_size)
+        items = [(i, row.recipient_name, row.subject) for i, row in enumerate(rows)]
+        handles = {}
+        starts = range(0, len(items), size)
+        for start, chunk_bodies in zip(starts, self._map(
+                executor, lambda i: self.generate_email_batch(items[i:i + size], context), starts)):
+            handles.update((i, spool.put(body)) for i, body in chunk_bodies.items())
+            self._stage("generate", -len(items[start:start + size]))
+            self._stage("send", len(chunk_bodies))
+        for i, row in enumerate(rows):
+            if i not in handles:
+                self._record_failure(row, context, "generate", GenerationError("No body generated"))
+        return [handles.get(i) for i in range(len(rows))]
+
+    def _process_batch(self, rows, context, executor, spool, render_pool=None):
+        self._stage("generate", len(rows))
+        handles = self._generate_rows(rows, context, executor, spool)
+        ready = [(row, handle) for row, handle in zip(rows, handles) if handle]
+        if self.render_processes:
+            messages = render_messages(
+                [(row.email, row.subject, spool.get(handle)) for row, handle in ready],
+                self.sender_name, self.sender_email, self.html_alternative, self.render_processes,
+                executor=render_pool
+            )
+        else:
+            # Render inside the send workers so at most max_workers messages are resident
+            messages = [None] * len(ready)
+        self._map(
+            executor,
+            lambda item: self._send_row(item[0][0], context, spool, item[0][1], item[1]),
+            list(zip(ready, messages))
+        )
+        spool.clear()
+        if self.retry_queue is not None:
+            self.retry_queue.flush()
+
+    def shard_settings(self):
+        """Constructor settings for rebuilding this instance in a shard worker"""
+        if isinstance(self.sender_pool, MailSink):
+            return {
+                "dry_run": True,
+                "sender_name": self.sender_name,
+                "sender_email": self.sender_email,
+                "sink_path": self.sender_pool.path,
+                "html_alternative": self.html_alternative,
+                "render_processes": self._render_processes,
+                "generation_batch_size": self.generation_batch_size,
+            }
+        if self._custom_pool or self.completion_fn != self._chat_completion:
+            raise ValueError("Sharded mode needs a sender pool and generator built from the configuration")
+        return {
+            "api_key": self.api_key,
+            "smtp_server": self.smtp_server,
+            "port": self.port,
+            "sender_email": self.sender_email,
+            "sender_password": self.sender_password,
+            "sender_name": self.sender_name,
+            "sender_accounts": self.sender_accounts,
+            "rate_limit": self.rate_limit,
+            "html_alternative": self.html_alternative,
+            "render_processes": self._render_processes,
+            "generation_batch_size": self.generation_batch_size,
+        }
+
+    def process_csv_and_send_emails(self, csv_filename, context, max_workers=None, batch_size=None,
+                                    recipient_filter=None, shards=1, shard=None, on_progress=None,
+                                    progress=None):
         """
         Read CSV file and send emails to each recipient.
+        Rows go through generate, render and send stages in batches of batch_size;
+        generation and sending run concurrently, one worker per pooled SMTP connection by default.
+        max_workers and batch_size default to the campaign settings.
+        Rows rejected by recipient_filter are dropped before generation and
+        returned as (email, reason) pairs. Rows that fail to generate or send
+        go to retry_queue, when one is set, after each batch.
+        With shards > 1 the list is split by address hash and each shard runs
+        in its own process with a matching share of the rate limits; counts and
+        token usage are merged back into this instance. shard=(index, count)
+        restricts this call to one shard.
+        progress, a ProgressReporter, is updated as rows complete and may be
+        rendered from another thread while this runs.
+        """
+        if shards > 1:
+            from sharding import run_sharded_campaign
+            self.sender_pool.close()
+
+            def report(merged):
+                if progress is not None:
+                    progress.update(merged)
+                if on_progress:
+                    on_progress(merged)
+
+            settings = self.shard_settings()
+            if self.retry_queue is not None:
+                # Each shard process records its sends and failed rows through its own connection
+                db = self.retry_queue.db
+                settings["campaign_db"] = {"user_id": db.user_id, "storage_mode": db.storage_mode,
+                                           "row_level_security": db.row_level_security}
+            result = run_sharded_campaign(settings, csv_filename, context, shards,
+                                          recipient_filter=recipient_filter, on_progress=report)
+            for outcome in self.counts:
+                self._count(outcome, result[outcome])
+            self.token_stats.merge(result["tokens"])
+            if progress is not None:
+                progress.finish()
+            return result["skipped"]
+
+        return self.process_recipients(read_recipients(csv_filename), context, max_workers, batch_size,
+                                       recipient_filter, shard, progress)
+
+    def process_recipients(self, rows, context, max_workers=None, batch_size=None, recipient_filter=None,
+                           shard=None, progress=None):
+        """
+        The single-process body of process_csv_and_send_emails for rows
+        (Recipient records) that are already parsed, e.g. a list the caller
+        filtered itself. Returns the (email, reason) pairs recipient_filter rejected.
         """
+        campaign = self.settings.campaign
+        max_workers = max_workers or campaign.max_workers or self.sender_pool.max_concurrency
+        batch_size = batch_size or campaign.batch_size
+        skipped = []
+        spool = BodySpool()
+        # One render pool for the whole campaign, starting processes per batch costs more than it saves
+        render_pool = ProcessPoolExecutor(max_workers=self.render_processes) if self.render_processes else None
+        self.progress = progress
         try:
-            with open(csv_filename, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    recipient_name = row['recipient_name']
-                    recipient_email = row['email']
-                    subject = row['subject']
-
-                    # Generate the email body using the LLM model
-                    email_body = self.generate_email(subject, recipient_name, context)
-                    if email_body:
-                        self.send_email(recipient_email, subject, email_body)
-                    else:
-                        print(f"Failed to generate email content for {recipient_name}. Email not sent.")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                batch = []
+                for row in rows:
+                    if shard is not None and shard_of(row.email, shard[1]) != shard[0]:
+                        continue
+                    reason = recipient_filter.check(row.email) if recipient_filter else None
+                    if reason:
+                        print(f"Skipping {row.email}: {reason}")
+                        skipped.append((row.email, reason))
+                        continue
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        self._process_batch(batch, context, executor, spool, render_pool)
+                        batch = []
+                if batch:
+                    self._process_batch(batch, context, executor, spool, render_pool)
         except Exception as e:
             print(f"Error processing CSV file: {e}")
-
+        finally:
+            spool.close()
+            if render_pool is not None:
+                render_pool.shutdown()
+            self.sender_pool.close()
+            if progress is not None:
+                progress.finish()
+            self.progress = None
+            if self.retry_queue is not None:
+                self.retry_queue.flush()
+        return skipped
 
 if __name__ == "__main__":
     api_key = f"{os.getenv('API_KEY')}" 
-    smtp_server = "smtp.gmail.com"
-    port = 587
+    settings = get_settings()
+    smtp_server = settings.smtp.server
+    port = settings.smtp.port
     sender_email = "joshuaplacer09@gmail.com"
     sender_password = "SENDER_PASSWORD"  
     sender_name = "Joshua Placer"
@@ -112,6 +447,9 @@ if __name__ == "__main__":
 
     # Initialize the EmailAutomation class
     context = input("Enter the context for the email: ")
-    email_automation = EmailAutomation(api_key, smtp_server, port, sender_email, sender_password, sender_name)
+    if "--dry-run" in sys.argv or settings.campaign.dry_run:
+        email_automation = EmailAutomation.dry_run(sender_name, sink_path="dry_run.jsonl.gz")
+    else:
+        email_automation = EmailAutomation(api_key, smtp_server, port, sender_email, sender_password, sender_name)
 
     email_automation.process_csv_and_send_emails(csv_filename, context)
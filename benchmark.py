@@ -0,0 +1,85 @@
+import argparse
+import contextlib
+import csv
+import os
+import tempfile
+import time
+import tracemalloc
+
+from autmati import EmailAutomation
+from records import read_recipients
+
+
+def write_sample_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["recipient_name", "email", "subject"])
+        for i in range(rows):
+            writer.writerow([f"Recipient {i}", f"recipient{i}@example.com", "Quarterly update"])
+
+
+def measure(fn):
+    """Run fn under tracemalloc, returns (result, retained bytes, peak bytes, seconds)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+
+def bench_records(path, rows):
+    """Resident bytes per loaded recipient: csv dicts against Recipient records"""
+    def load_dicts():
+        with open(path, newline="", encoding="utf-8") as f:
+            return list(csv.DictReader(f))
+
+    results = {}
+    for name, loader in (("dict rows", load_dicts), ("Recipient records", lambda: list(read_recipients(path)))):
+        loaded, current, _, elapsed = measure(loader)
+        results[name] = (current / rows, elapsed)
+        del loaded
+    return results
+
+
+def bench_pipeline(path, rows, batch_size, max_workers, body_chars):
+    """Peak bytes per in-flight recipient for an offline (dry run) campaign"""
+    # A null sink: an in-memory one would keep every message and grow with the row count
+    automation = EmailAutomation.dry_run("Benchmark", sink_path=os.devnull, max_concurrency=max_workers)
+    # Placeholder bodies are far shorter than real ones, pad them to a realistic size
+    body = ("Thank you for your continued partnership. " * (body_chars // 43 + 1))[:body_chars]
+    automation.completion_fn = lambda data: body
+
+    def run():
+        # Per-row log lines go to devnull, a StringIO would keep them all
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            automation.process_csv_and_send_emails(path, "Quarterly product update", batch_size=batch_size)
+
+    _, _, peak, elapsed = measure(run)
+    return peak / min(batch_size, rows), rows / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure memory per recipient")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--pipeline-rows", type=int, default=5000)
+    parser.add_argument("--body-chars", type=int, default=3000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "recipients.csv")
+        write_sample_csv(path, args.rows)
+
+        for name, (per_row, elapsed) in bench_records(path, args.rows).items():
+            print(f"{name:>18}: {per_row:7.0f} bytes/recipient, loaded in {elapsed:.2f}s")
+
+        # Rendering dominates the pipeline, so it runs on a smaller list
+        pipeline_rows = min(args.rows, args.pipeline_rows)
+        write_sample_csv(path, pipeline_rows)
+        per_in_flight, rate = bench_pipeline(path, pipeline_rows, args.batch_size, args.max_workers,
+                                             args.body_chars)
+        print(f"{'pipeline':>18}: {per_in_flight:7.0f} bytes/in-flight recipient "
+              f"(batch {args.batch_size}), {rate:,.0f} recipients/s over {pipeline_rows:,} rows")
@@ -0,0 +1,133 @@
+import hashlib
+import re
+import threading
+from datetime import date
+
+from cachetools import TTLCache
+
+from database import EMAIL_METRIC_FIELDS
+
+
+PUNCTUATION = re.compile(r"[^\w\s]")
+WHITESPACE = re.compile(r"\s+")
+
+# Anchored so a question with any extra detail ("... to John?") still goes to the model
+EMAIL_COUNT_QUESTION = re.compile(
+    r"^(how many|number of|count of|count)( emails?| mails?| messages?)"
+    r"( (have|did) i| i( have)?| were| have been| was| been)?( sent| send)?( out)?"
+    r"( (?P<period>today|yesterday|this week|this month|in total|total|so far|overall|all time|altogether))?$"
+)
+RECIPIENT_COUNT_QUESTION = re.compile(
+    r"^how many (unique |different |distinct )?(recipients|people|contacts)"
+    r"( (have|did) i( emailed| email| sent to| send to| contacted| contact))?( so far| in total| total)?$"
+)
+LAST_SENT_QUESTION = re.compile(
+    r"^when (did i last send( an)? emails?|was (my|the) (last|latest|most recent) email sent)$"
+)
+
+PERIODS = {
+    "today": ("emails_today", "today"),
+    "yesterday": ("emails_yesterday", "yesterday"),
+    "this week": ("emails_this_week", "this week"),
+    "this month": ("emails_this_month", "this month"),
+}
+
+
+def normalize_question(question):
+    """Lowercase, drop punctuation and collapse whitespace so trivial rephrasings share a key"""
+    return WHITESPACE.sub(" ", PUNCTUATION.sub(" ", question.lower())).strip()
+
+
+def data_version(db, archive=None):
+    """
+    Version stamp of the email data: changes whenever a row is added or
+    removed, an archive run finishes, or the day turns over (which moves the
+    period counts). Cheap enough to check before every chat lookup.
+    """
+    count, last_id = db.get_email_version()
+    rollup = archive.email_rollup(db.user_id) if archive is not None else None
+    return f"{count}:{last_id}:{rollup['stamp'] if rollup else 0}:{date.today()}"
+
+
+def is_metrics_question(question):
+    """Whether answer_from_metrics can answer question"""
+    question = normalize_question(question)
+    return bool(EMAIL_COUNT_QUESTION.match(question) or RECIPIENT_COUNT_QUESTION.match(question)
+                or LAST_SENT_QUESTION.match(question))
+
+
+def answer_from_metrics(question, metrics):
+    """Answer common aggregate questions straight from get_email_metrics, or None"""
+    question = normalize_question(question)
+    if not metrics["total_emails"] and is_metrics_question(question):
+        return "No email records found in database."
+
+    match = EMAIL_COUNT_QUESTION.match(question)
+    if match:
+        field, label = PERIODS.get(match.group("period"), ("total_emails", "in total"))
+        count = metrics[field]
+        return f"You sent {count:,} email{'' if count == 1 else 's'} {label}."
+    if RECIPIENT_COUNT_QUESTION.match(question):
+        count = metrics["unique_recipients"]
+        return f"You have emailed {count:,} unique recipient{'' if count == 1 else 's'}."
+    if LAST_SENT_QUESTION.match(question):
+        return f"Your last email was sent on {metrics['last_sent']:%Y-%m-%d at %H:%M}."
+    return None
+
+
+class ChatResponseCache:
+    """
+    Chat answers keyed by a fingerprint of the normalized question, the model
+    and the email data version. A new data version (any email saved through
+    save_email_activity, or removed) clears the cache, so answers are never
+    served from stale context. Metric answers are cached the same way, so
+    the full metrics are only built on a miss.
+    """
+
+    def __init__(self, maxsize=512, ttl=24 * 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(question, version, model=""):
+        key = f"{model}\0{normalize_question(question)}\0{version}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._cache.clear()
+            self._version = version
+
+    def get(self, question, version, model=""):
+        with self._lock:
+            self._check_version(version)
+            answer = self._cache.get(self.fingerprint(question, version, model))
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def put(self, question, version, answer, model=""):
+        with self._lock:
+            self._check_version(version)
+            self._cache[self.fingerprint(question, version, model)] = answer
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def email_metrics(db, archive=None):
+    """
+    get_email_metrics as a dict keyed by EMAIL_METRIC_FIELDS. Pass an
+    EmailArchive to count rows moved out of Postgres as well, otherwise
+    answers only cover the retention window.
+    """
+    metrics = dict(zip(EMAIL_METRIC_FIELDS, db.get_email_metrics()))
+    if archive is not None:
+        metrics = archive.email_metrics(db, metrics)
+    return metrics
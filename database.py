@@ -1,29 +1,222 @@
 import psycopg2
 from psycopg2 import pool
+import psycopg2.errors
+import psycopg2.extras
 import json
+import functools
 from contextlib import contextmanager
 from typing import Optional, List, Tuple
 import os
+import threading
 import time
+import uuid
 
+from settings import get_settings
+
+
+
+# Storage modes: "schema" gives every user their own user_<id> schema,
+# "shared" keeps all users in one set of tables keyed by user_id.
+SHARED_SCHEMA = "tenants"
+TENANT_TABLES = ("conversations", "email_activities", "token_usage",
+                 "suppression_list", "scheduled_emails", "retry_queue", "dead_letters")
+
+TABLES_DDL = """
+    CREATE TABLE IF NOT EXISTS {schema}.conversations (
+        id SERIAL PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        context TEXT,
+        generated_text TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS {schema}.email_activities (
+        id SERIAL PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        recipient TEXT NOT NULL,
+        recipient_email TEXT,
+        subject TEXT NOT NULL,
+        context TEXT,
+        email_body TEXT,
+        generated_text TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS {schema}.token_usage (
+        id SERIAL PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        tokens_used INTEGER NOT NULL,
+        operation_type TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS {schema}.suppression_list (
+        id SERIAL PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        email TEXT NOT NULL,
+        reason TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (user_id, email)
+    );
+
+    CREATE TABLE IF NOT EXISTS {schema}.scheduled_emails (
+        id SERIAL PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        campaign_id TEXT NOT NULL,
+        recipient TEXT NOT NULL,
+        recipient_email TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        context TEXT,
+        email_body TEXT,
+        timezone TEXT,
+        send_at TIMESTAMPTZ NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        error TEXT,
+        claimed_at TIMESTAMPTZ,
+        sent_at TIMESTAMPTZ
+    );
+
+    CREATE TABLE IF NOT EXISTS {schema}.retry_queue (
+        id SERIAL PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        recipient TEXT NOT NULL,
+        recipient_email TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        context TEXT,
+        email_body TEXT,
+        stage TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 1,
+        error TEXT,
+        next_attempt_at TIMESTAMPTZ NOT NULL,
+        claimed_at TIMESTAMPTZ,
+        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS {schema}.dead_letters (
+        id SERIAL PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        recipient TEXT NOT NULL,
+        recipient_email TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        context TEXT,
+        email_body TEXT,
+        stage TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        error TEXT,
+        error_class TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS retry_queue_due_idx
+    ON {schema}.retry_queue (user_id, next_attempt_at);
+
+    CREATE INDEX IF NOT EXISTS scheduled_emails_due_idx
+    ON {schema}.scheduled_emails (user_id, status, send_at);
+
+    CREATE INDEX IF NOT EXISTS conversations_user_ts_idx
+    ON {schema}.conversations (user_id, timestamp, id);
+
+    CREATE INDEX IF NOT EXISTS email_activities_user_ts_idx
+    ON {schema}.email_activities (user_id, timestamp, id);
+
+    CREATE INDEX IF NOT EXISTS token_usage_user_ts_idx
+    ON {schema}.token_usage (user_id, timestamp, id);
+"""
+
+# Columns exposed by the history browsing / export API
+HISTORY_COLUMNS = {
+    "conversations": ("id", "role", "content", "context", "generated_text", "timestamp"),
+    "email_activities": ("id", "recipient", "recipient_email", "subject", "context",
+                         "email_body", "timestamp"),
+}
+
+# Fields returned by get_email_metrics; total_emails and last_id double as a version stamp
+EMAIL_METRIC_FIELDS = ("total_emails", "unique_recipients", "active_days", "last_sent",
+                       "emails_today", "emails_yesterday", "emails_this_week", "emails_this_month",
+                       "last_id")
+
+# Columns moved to the Parquet archive, everything needed to rebuild a row
+ARCHIVE_COLUMNS = {
+    "email_activities": ("id", "recipient", "recipient_email", "subject", "context",
+                         "email_body", "generated_text", "timestamp"),
+    "token_usage": ("id", "tokens_used", "operation_type", "timestamp"),
+}
+
+RLS_DDL = """
+    ALTER TABLE {schema}.{table} ENABLE ROW LEVEL SECURITY;
+    ALTER TABLE {schema}.{table} FORCE ROW LEVEL SECURITY;
+    DROP POLICY IF EXISTS tenant_isolation ON {schema}.{table};
+    CREATE POLICY tenant_isolation ON {schema}.{table}
+        USING (user_id = current_setting('app.user_id', true))
+        WITH CHECK (user_id = current_setting('app.user_id', true));
+"""
+
+
+def recreates_tenant(method):
+    """
+    For write paths: in schema mode, if the reaper dropped the user's schema
+    while this instance was cached, recreate the schema and its tables and
+    retry the write once.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except (psycopg2.errors.UndefinedTable, psycopg2.errors.InvalidSchemaName):
+            if self.storage_mode != "schema":
+                raise
+            print(f"Recreating dropped tables in {self.schema_name}")
+            self.recreate_tenant_tables()
+            # Track the user again right away, not after the touch interval
+            self._last_touch = float('-inf')
+            self.touch_activity()
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 #Json schema separates the users session database when logged in.
 #login function soon.
 class DatabaseManager:
-    def __init__(self, user_id: str):
+    # Set once the shared tables / activity table have been created by this process
+    _shared_ready = False
+    _activity_ready = False
+    _shards_ready = False
+
+    def __init__(self, user_id: str, storage_mode: Optional[str] = None,
+                 row_level_security: Optional[bool] = None):
         self.user_id = user_id
+        # DB_STORAGE_MODE / DB_ROW_LEVEL_SECURITY and the other [db] settings apply by default
+        db_settings = get_settings().db
+        self.storage_mode = storage_mode or db_settings.storage_mode
+        if self.storage_mode not in ("schema", "shared"):
+            raise ValueError(f"Unknown storage mode: {self.storage_mode}")
+        if row_level_security is None:
+            row_level_security = db_settings.row_level_security
+        self.row_level_security = row_level_security and self.storage_mode == "shared"
+        self._rls_backends = set()
+        self._last_touch = float('-inf')
+        self._pool_lock = threading.Lock()
         self._initialize_pool()
-        self.schema_name = f"user_{self.user_id.replace('-', '_')}"
+        if self.storage_mode == "shared":
+            self.schema_name = SHARED_SCHEMA
+        else:
+            self.schema_name = f"user_{self.user_id.replace('-', '_')}"
 
     def _initialize_pool(self):
         """Initialize the connection pool"""
-        if not hasattr(self, 'pool') or self.pool.closed:
-            self.pool = psycopg2.pool.SimpleConnectionPool(
-                minconn=1,
-                maxconn=10,
-                dsn=os.getenv('DATABASE_URL')
-            )
+        # One manager is shared by the app thread and the scheduler, retry and
+        # shard reporter threads, so the pool has to be the thread-safe one
+        with self._pool_lock:
+            if not hasattr(self, 'pool') or self.pool.closed:
+                # Read at (re)creation, so a reopened pool picks up new sizes
+                db_settings = get_settings().db
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    minconn=db_settings.min_connections,
+                    maxconn=db_settings.max_connections,
+                    dsn=os.getenv('DATABASE_URL')
+                )
 
     @contextmanager
     def get_connection(self):
@@ -32,6 +225,14 @@ class DatabaseManager:
         conn = None
         try:
             conn = self.pool.getconn()
+            if self.row_level_security and conn.get_backend_pid() not in self._rls_backends:
+                # Session-level setting read by the tenant_isolation policies
+                with conn.cursor() as cur:
+                    cur.execute("SELECT set_config('app.user_id', %s, false)", (self.user_id,))
+                # Committed on its own: a session setting made inside a transaction
+                # is undone when that transaction rolls back, and the pid stays cached
+                conn.commit()
+                self._rls_backends.add(conn.get_backend_pid())
             yield conn
         except Exception as e:
             if conn:
@@ -43,23 +244,54 @@ class DatabaseManager:
                 self.pool.putconn(conn)
 
     def get_email_metrics(self):
-        """Get email sending metrics"""
+        """Get email sending metrics over the live rows, archived rows are not included"""
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 # Get total emails
                 cur.execute(f"""
                     SELECT 
                         COUNT(*) as total_emails,
-                        COUNT(DISTINCT recipient) as unique_recipients,
+                        COUNT(DISTINCT COALESCE(recipient_email, recipient)) as unique_recipients,
                         COUNT(DISTINCT DATE(timestamp)) as active_days,
-                        MAX(timestamp) as last_sent
+                        MAX(timestamp) as last_sent,
+                        COUNT(*) FILTER (WHERE timestamp >= CURRENT_DATE) as emails_today,
+                        COUNT(*) FILTER (WHERE timestamp >= CURRENT_DATE - 1
+                                         AND timestamp < CURRENT_DATE) as emails_yesterday,
+                        COUNT(*) FILTER (WHERE timestamp >= DATE_TRUNC('week', CURRENT_DATE)) as emails_this_week,
+                        COUNT(*) FILTER (WHERE timestamp >= DATE_TRUNC('month', CURRENT_DATE)) as emails_this_month,
+                        MAX(id) as last_id
                     FROM {self.schema_name}.email_activities
                     WHERE user_id = %s
                 """, (self.user_id,))
                 return cur.fetchone()
         
-    def get_daily_email_counts(self):
-        """Get daily email sending counts"""
+    def get_email_version(self) -> Tuple[int, Optional[int]]:
+        """(row count, max id) of the live email activity, a cheap data version stamp"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT COUNT(*), MAX(id)
+                    FROM {self.schema_name}.email_activities
+                    WHERE user_id = %s
+                """, (self.user_id,))
+                return cur.fetchone()
+
+    def get_email_overlap(self, recipients: List[str], days: List) -> Tuple[int, int]:
+        """How many of recipients and of days (dates) also occur in the live email activity"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT
+                        COUNT(DISTINCT COALESCE(recipient_email, recipient))
+                            FILTER (WHERE COALESCE(recipient_email, recipient) = ANY(%s::text[])),
+                        COUNT(DISTINCT DATE(timestamp)) FILTER (WHERE DATE(timestamp) = ANY(%s::date[]))
+                    FROM {self.schema_name}.email_activities
+                    WHERE user_id = %s
+                """, (recipients, days, self.user_id))
+                return cur.fetchone()
+
+    def get_daily_email_counts(self, limit: int = 30):
+        """Get daily email sending counts for the last limit active days"""
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(f"""
@@ -70,10 +302,61 @@ class DatabaseManager:
                         WHERE user_id = %s
                         GROUP BY DATE(timestamp)
                         ORDER BY date DESC
-                        LIMIT 30
-                """, (self.user_id,))
+                        LIMIT %s
+                """, (self.user_id, limit))
                 return cur.fetchall()
 
+    def get_top_recipients(self, limit: int = 10):
+        """Get (recipient, count) for the most emailed recipients"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT COALESCE(recipient_email, recipient) as recipient, COUNT(*) as count
+                    FROM {self.schema_name}.email_activities
+                    WHERE user_id = %s
+                    GROUP BY 1
+                    ORDER BY count DESC
+                    LIMIT %s
+                """, (self.user_id, limit))
+                return cur.fetchall()
+
+    def get_metrics_snapshot(self) -> dict:
+        """
+        Get every dashboard series in one round-trip: emails per day,
+        emails per recipient and tokens per day and operation type.
+        Derived statistics are computed from this in metrics.py.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    WITH emails AS (
+                        SELECT DATE(timestamp) AS day, COALESCE(recipient_email, recipient) AS recipient
+                        FROM {self.schema_name}.email_activities
+                        WHERE user_id = %s
+                    )
+                    SELECT 'daily_emails', day, NULL::text, COUNT(*), NULL::bigint
+                    FROM emails GROUP BY day
+                    UNION ALL
+                    SELECT 'recipients', MAX(day), recipient, COUNT(*), NULL::bigint
+                    FROM emails GROUP BY recipient
+                    UNION ALL
+                    SELECT 'daily_tokens', DATE(timestamp), operation_type, SUM(tokens_used), COUNT(*)
+                    FROM {self.schema_name}.token_usage
+                    WHERE user_id = %s
+                    GROUP BY DATE(timestamp), operation_type
+                """, (self.user_id, self.user_id))
+                rows = cur.fetchall()
+
+        snapshot = {"daily_emails": [], "recipients": [], "daily_tokens": []}
+        for series, day, label, value, operations in rows:
+            if series == "daily_emails":
+                snapshot[series].append((day, value))
+            elif series == "recipients":
+                snapshot[series].append((label, value, day))
+            else:
+                snapshot[series].append((day, label, value, operations))
+        return snapshot
+
     def close_pool(self):
         """Explicitly close the connection pool"""
         if hasattr(self, 'pool') and not self.pool.closed:
@@ -128,8 +411,27 @@ class DatabaseManager:
                     )
                 """)
     
+    def _create_shared_tables(self):
+        """Create the shared tenant tables once per process"""
+        if DatabaseManager._shared_ready:
+            return True
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (SHARED_SCHEMA,))
+                cur.execute(f"CREATE SCHEMA IF NOT EXISTS {SHARED_SCHEMA}")
+                cur.execute(TABLES_DDL.format(schema=SHARED_SCHEMA))
+                if self.row_level_security:
+                    for table in TENANT_TABLES:
+                        cur.execute(RLS_DDL.format(schema=SHARED_SCHEMA, table=table))
+        DatabaseManager._shared_ready = True
+        return True
+
     def create_user_schema(self):
         """Create a schema for the user if it doesn't exist with proper error handling"""
+        if self.storage_mode == "shared":
+            # Tenants share one set of tables, so there is nothing to create per user
+            return self._create_shared_tables()
+
         max_retries = 3
         retry_delay = 1  # seconds
         
@@ -167,55 +469,41 @@ class DatabaseManager:
                         print(f"Schema creation error: {e}")
                         raise
 
+    def recreate_tenant_tables(self):
+        """Recreate the user's schema and tables, e.g. after the reaper dropped them"""
+        if self.storage_mode == "shared":
+            return
+        self.create_user_schema()
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(TABLES_DDL.format(schema=self.schema_name))
+
     def init_database(self):
         """Initialize database with user schema and tables"""
         try:
             self.create_user_schema()
+            self.touch_activity()
+            if self.storage_mode == "shared":
+                return
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(f"""
                         DROP TABLE IF EXISTS {self.schema_name}.conversations CASCADE;
                         DROP TABLE IF EXISTS {self.schema_name}.email_activities CASCADE;
-                        
-                        CREATE TABLE {self.schema_name}.conversations (
-                            id SERIAL PRIMARY KEY,
-                            user_id TEXT NOT NULL,
-                            role TEXT NOT NULL,
-                            content TEXT NOT NULL,
-                            context TEXT,
-                            generated_text TEXT,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        );
-
-                        CREATE TABLE {self.schema_name}.email_activities (
-                            id SERIAL PRIMARY KEY,
-                            user_id TEXT NOT NULL,
-                            recipient TEXT NOT NULL,
-                            subject TEXT NOT NULL,
-                            context TEXT,
-                            email_body TEXT,
-                            generated_text TEXT,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        );
-
-                        CREATE TABLE IF NOT EXISTS {self.schema_name}.token_usage (
-                            id SERIAL PRIMARY KEY,
-                            user_id TEXT NOT NULL,
-                            tokens_used INTEGER NOT NULL,
-                            operation_type TEXT NOT NULL,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        );
                     """)
+                    cur.execute(TABLES_DDL.format(schema=self.schema_name))
                     conn.commit()
         except Exception as e:
             print(f"Schema creation error: {e}")
             raise
 
+    @recreates_tenant
     def save_conversation(self, role: str, content: any, 
                          context: Optional[str] = None, 
                          generated_text: Optional[str] = None) -> None:
         if isinstance(content, (list, dict)):
             content = json.dumps(content)
+        self.touch_activity()
 
         with self.get_connection() as conn:
             with conn.cursor() as cur:
@@ -246,33 +534,133 @@ class DatabaseManager:
                     print(f"Database error: {e}")
                     return []
 
+    def get_history_page(self, table: str, cursor: Optional[Tuple] = None,
+                         page_size: int = 50) -> Tuple[List[Tuple], Optional[Tuple]]:
+        """
+        Get one page of history, newest first, using keyset pagination on
+        (timestamp, id). Pass the returned cursor to get the next page; it is
+        None on the last page. Each page costs one index range scan however deep.
+        """
+        if table not in HISTORY_COLUMNS:
+            raise ValueError(f"Unknown history table: {table}")
+        columns = ", ".join(HISTORY_COLUMNS[table])
+        keyset = "AND (timestamp, id) < (%s, %s)" if cursor else ""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT {columns}
+                    FROM {self.schema_name}.{table}
+                    WHERE user_id = %s {keyset}
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT %s
+                """, (self.user_id, *(cursor or ()), page_size + 1))
+                rows = cur.fetchall()
+        if len(rows) <= page_size:
+            return rows, None
+        rows = rows[:page_size]
+        last = dict(zip(HISTORY_COLUMNS[table], rows[-1]))
+        return rows, (last["timestamp"], last["id"])
+
+    def get_conversations_page(self, cursor: Optional[Tuple] = None, page_size: int = 50):
+        """Keyset-paginated conversation history"""
+        return self.get_history_page("conversations", cursor, page_size)
+
+    def get_email_activities_page(self, cursor: Optional[Tuple] = None, page_size: int = 50):
+        """Keyset-paginated email activity history"""
+        return self.get_history_page("email_activities", cursor, page_size)
+
+    def iter_history(self, table: str, batch_size: int = 5000):
+        """
+        Stream a table's live history in batches through a server-side named
+        cursor, so exports never hold more than batch_size rows in memory.
+        EmailArchive.iter_history adds the archived rows.
+        """
+        if table not in HISTORY_COLUMNS:
+            raise ValueError(f"Unknown history table: {table}")
+        columns = ", ".join(HISTORY_COLUMNS[table])
+        with self.get_connection() as conn:
+            with conn.cursor(name=f"export_{table}_{uuid.uuid4().hex}") as cur:
+                cur.itersize = batch_size
+                cur.execute(f"""
+                    SELECT {columns}
+                    FROM {self.schema_name}.{table}
+                    WHERE user_id = %s
+                    ORDER BY timestamp, id
+                """, (self.user_id,))
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+
+    def iter_rows_before(self, table: str, cutoff, batch_size: int = 10000):
+        """Stream rows older than cutoff in id order through a named cursor"""
+        if table not in ARCHIVE_COLUMNS:
+            raise ValueError(f"Unknown archive table: {table}")
+        columns = ", ".join(ARCHIVE_COLUMNS[table])
+        with self.get_connection() as conn:
+            with conn.cursor(name=f"archive_{table}_{uuid.uuid4().hex}") as cur:
+                cur.itersize = batch_size
+                cur.execute(f"""
+                    SELECT {columns}
+                    FROM {self.schema_name}.{table}
+                    WHERE user_id = %s AND timestamp < %s
+                    ORDER BY id
+                """, (self.user_id, cutoff))
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+
+    def delete_rows_before(self, table: str, cutoff, max_id: int, batch_size: int = 10000) -> int:
+        """Delete archived rows in short batches so the hot table is never locked for long"""
+        if table not in ARCHIVE_COLUMNS:
+            raise ValueError(f"Unknown archive table: {table}")
+        deleted = 0
+        while True:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        DELETE FROM {self.schema_name}.{table}
+                        WHERE id IN (
+                            SELECT id FROM {self.schema_name}.{table}
+                            WHERE user_id = %s AND timestamp < %s AND id <= %s
+                            LIMIT %s
+                        )
+                    """, (self.user_id, cutoff, max_id, batch_size))
+                    deleted += cur.rowcount
+                    if cur.rowcount < batch_size:
+                        return deleted
+
     def get_recent_email_activities(self, limit=5):
         """Get recent email activities with improved error handling and logging"""
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT schema_name 
-                        FROM information_schema.schemata 
-                        WHERE schema_name = %s
-                    """, (self.schema_name,))
-                    
-                    if not cur.fetchone():
-                        print(f"Schema {self.schema_name} does not exist")
-                        self.create_user_schema() 
-                    
-                    # Check if table exists
-                    cur.execute(f"""
-                        SELECT EXISTS (
-                            SELECT FROM information_schema.tables 
-                            WHERE table_schema = %s 
-                            AND table_name = 'email_activities'
-                        )
-                    """, (self.schema_name,))
-                    
-                    if not cur.fetchone()[0]:
-                        print(f"Table email_activities does not exist in schema {self.schema_name}")
-                        return []
+                    if self.storage_mode == "schema":
+                        cur.execute("""
+                            SELECT schema_name 
+                            FROM information_schema.schemata 
+                            WHERE schema_name = %s
+                        """, (self.schema_name,))
+                        
+                        if not cur.fetchone():
+                            print(f"Schema {self.schema_name} does not exist")
+                            self.create_user_schema() 
+                        
+                        # Check if table exists
+                        cur.execute(f"""
+                            SELECT EXISTS (
+                                SELECT FROM information_schema.tables 
+                                WHERE table_schema = %s 
+                                AND table_name = 'email_activities'
+                            )
+                        """, (self.schema_name,))
+                        
+                        if not cur.fetchone()[0]:
+                            print(f"Table email_activities does not exist in schema {self.schema_name}")
+                            return []
 
                     # Query with better error handling
                     try:
@@ -297,28 +685,21 @@ class DatabaseManager:
             print(f"Database connection error: {str(e)}")
             return []
 
-    def save_email_activity(self, recipient, subject, context, email_body):
+    @recreates_tenant
+    def save_email_activity(self, recipient, subject, context, email_body, recipient_email=None):
         """Save email activity to the database with better error handling"""
+        self.touch_activity()
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
-                    # First ensure schema exists
-                    cur.execute("""
-                        SELECT schema_name 
-                        FROM information_schema.schemata 
-                        WHERE schema_name = %s
-                    """, (self.schema_name,))
-                    
-                    if not cur.fetchone():
-                        self.create_user_schema()
-                    
+                    # A dropped schema is recreated by @recreates_tenant
                     # Insert the email activity
                     cur.execute(f"""
                         INSERT INTO {self.schema_name}.email_activities 
-                        (user_id, recipient, subject, context, email_body)
-                        VALUES (%s, %s, %s, %s, %s)
+                        (user_id, recipient, recipient_email, subject, context, email_body)
+                        VALUES (%s, %s, %s, %s, %s, %s)
                         RETURNING id
-                    """, (self.user_id, recipient, subject, context, email_body))
+                    """, (self.user_id, recipient, recipient_email, subject, context, email_body))
                     
                     inserted_id = cur.fetchone()[0]
                     conn.commit()
@@ -328,6 +709,328 @@ class DatabaseManager:
             print(f"Error saving email activity: {str(e)}")
             raise
     
+    @recreates_tenant
+    def add_suppression(self, email: str, reason: str = "unsubscribe") -> None:
+        """Add an address to the user's suppression list"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    INSERT INTO {self.schema_name}.suppression_list (user_id, email, reason)
+                    VALUES (%s, LOWER(TRIM(%s)), %s)
+                    ON CONFLICT (user_id, email) DO UPDATE SET reason = EXCLUDED.reason
+                """, (self.user_id, email, reason))
+
+    def get_suppressed_emails(self) -> List[str]:
+        """Get all suppressed/unsubscribed addresses"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT email FROM {self.schema_name}.suppression_list
+                        WHERE user_id = %s
+                    """, (self.user_id,))
+                    return [row[0] for row in cur.fetchall()]
+        except psycopg2.Error as e:
+            print(f"Database error: {e}")
+            return []
+
+    def get_recent_recipient_emails(self, days: int = 30) -> List[str]:
+        """Get distinct recipient addresses emailed in the last days"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT DISTINCT recipient_email
+                        FROM {self.schema_name}.email_activities
+                        WHERE user_id = %s
+                        AND recipient_email IS NOT NULL
+                        AND timestamp >= NOW() - %s * INTERVAL '1 day'
+                    """, (self.user_id, days))
+                    return [row[0] for row in cur.fetchall()]
+        except psycopg2.Error as e:
+            print(f"Database error: {e}")
+            return []
+
+    @recreates_tenant
+    def enqueue_scheduled_emails(self, campaign_id: str, rows: List[Tuple]) -> None:
+        """Queue (recipient, recipient_email, subject, context, timezone, send_at) rows for delivery"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, f"""
+                    INSERT INTO {self.schema_name}.scheduled_emails
+                    (user_id, campaign_id, recipient, recipient_email, subject, context, timezone, send_at)
+                    VALUES %s
+                """, [(self.user_id, campaign_id) + tuple(row) for row in rows], page_size=1000)
+
+    def claim_scheduled_emails(self, status: str, claimed_status: str,
+                               due_before, limit: int = 50, lease: int = 600) -> List[Tuple]:
+        """
+        Atomically move up to limit rows in status with send_at <= due_before to
+        claimed_status. SKIP LOCKED lets several workers share one queue.
+        A claim is a lease: rows left in claimed_status by a worker that died
+        are claimed again after lease seconds (at-least-once, a send that
+        went out just before the crash can repeat).
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE {self.schema_name}.scheduled_emails
+                    SET status = %s, claimed_at = NOW()
+                    WHERE id IN (
+                        SELECT id FROM {self.schema_name}.scheduled_emails
+                        WHERE user_id = %s AND send_at <= %s
+                        AND (status = %s OR (status = %s AND claimed_at < NOW() - %s * INTERVAL '1 second'))
+                        ORDER BY send_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, recipient, recipient_email, subject, context, email_body
+                """, (claimed_status, self.user_id, due_before, status, claimed_status, lease, limit))
+                return cur.fetchall()
+
+    def update_scheduled_email(self, email_id: int, status: str,
+                               email_body: Optional[str] = None,
+                               error: Optional[str] = None) -> None:
+        """Record the outcome of a generate or send step for a queued email"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE {self.schema_name}.scheduled_emails
+                    SET status = %s,
+                        email_body = COALESCE(%s, email_body),
+                        error = %s,
+                        sent_at = CASE WHEN %s = 'sent' THEN NOW() ELSE sent_at END
+                    WHERE id = %s AND user_id = %s
+                """, (status, email_body, error, status, email_id, self.user_id))
+
+    def get_schedule_status(self, campaign_id: Optional[str] = None) -> List[Tuple]:
+        """Get (status, count, next_send_at) for queued emails"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT status, COUNT(*), MIN(send_at)
+                    FROM {self.schema_name}.scheduled_emails
+                    WHERE user_id = %s AND (%s IS NULL OR campaign_id = %s)
+                    GROUP BY status
+                """, (self.user_id, campaign_id, campaign_id))
+                return cur.fetchall()
+
+    @recreates_tenant
+    def enqueue_retries(self, rows: List[Tuple]) -> None:
+        """Queue (recipient, recipient_email, subject, context, email_body, stage, attempts, error, next_attempt_at) rows"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, f"""
+                    INSERT INTO {self.schema_name}.retry_queue
+                    (user_id, recipient, recipient_email, subject, context, email_body,
+                     stage, attempts, error, next_attempt_at)
+                    VALUES %s
+                """, [(self.user_id,) + tuple(row) for row in rows], page_size=1000)
+
+    @recreates_tenant
+    def add_dead_letters(self, rows: List[Tuple]) -> None:
+        """Store (recipient, recipient_email, subject, context, email_body, stage, attempts, error, error_class) rows"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, f"""
+                    INSERT INTO {self.schema_name}.dead_letters
+                    (user_id, recipient, recipient_email, subject, context, email_body,
+                     stage, attempts, error, error_class)
+                    VALUES %s
+                """, [(self.user_id,) + tuple(row) for row in rows], page_size=1000)
+
+    def claim_retries(self, limit: int = 50, lease: int = 600) -> List[Tuple]:
+        """
+        Claim up to limit due retries. A claim is a lease: rows whose worker
+        died are handed out again after lease seconds.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE {self.schema_name}.retry_queue
+                    SET claimed_at = NOW()
+                    WHERE id IN (
+                        SELECT id FROM {self.schema_name}.retry_queue
+                        WHERE user_id = %s AND next_attempt_at <= NOW()
+                        AND (claimed_at IS NULL OR claimed_at < NOW() - %s * INTERVAL '1 second')
+                        ORDER BY next_attempt_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, recipient, recipient_email, subject, context, email_body, stage, attempts
+                """, (self.user_id, lease, limit))
+                return cur.fetchall()
+
+    def reschedule_retry(self, retry_id: int, attempts: int, next_attempt_at,
+                         error: str, stage: str, email_body: Optional[str] = None) -> None:
+        """Release a claimed retry for another attempt at next_attempt_at"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE {self.schema_name}.retry_queue
+                    SET attempts = %s, next_attempt_at = %s, error = %s, stage = %s,
+                        email_body = COALESCE(%s, email_body), claimed_at = NULL
+                    WHERE id = %s AND user_id = %s
+                """, (attempts, next_attempt_at, error, stage, email_body, retry_id, self.user_id))
+
+    def delete_retry(self, retry_id: int) -> None:
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {self.schema_name}.retry_queue WHERE id = %s AND user_id = %s",
+                            (retry_id, self.user_id))
+
+    def get_retry_status(self) -> Tuple:
+        """Get (queued retries, next attempt time, dead letters)"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT (SELECT COUNT(*) FROM {self.schema_name}.retry_queue WHERE user_id = %s),
+                           (SELECT MIN(next_attempt_at) FROM {self.schema_name}.retry_queue WHERE user_id = %s),
+                           (SELECT COUNT(*) FROM {self.schema_name}.dead_letters WHERE user_id = %s)
+                """, (self.user_id, self.user_id, self.user_id))
+                return cur.fetchone()
+
+    def get_dead_letters(self, limit: int = 100) -> List[Tuple]:
+        """Get recent (recipient, recipient_email, subject, stage, attempts, error, error_class, timestamp)"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT recipient, recipient_email, subject, stage, attempts, error, error_class, timestamp
+                    FROM {self.schema_name}.dead_letters
+                    WHERE user_id = %s
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT %s
+                """, (self.user_id, limit))
+                return cur.fetchall()
+
+    def _create_shard_table(self):
+        """Create the campaign shard job table shared by worker hosts, once per process"""
+        if DatabaseManager._shards_ready:
+            return
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS public.campaign_shards (
+                        campaign_id TEXT NOT NULL,
+                        shard INTEGER NOT NULL,
+                        shard_count INTEGER NOT NULL,
+                        user_id TEXT NOT NULL,
+                        csv_path TEXT NOT NULL,
+                        context TEXT,
+                        settings JSONB NOT NULL DEFAULT '{}',
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        worker TEXT,
+                        sent INTEGER NOT NULL DEFAULT 0,
+                        failed INTEGER NOT NULL DEFAULT 0,
+                        not_generated INTEGER NOT NULL DEFAULT 0,
+                        skipped INTEGER NOT NULL DEFAULT 0,
+                        tokens JSONB NOT NULL DEFAULT '{}',
+                        error TEXT,
+                        heartbeat TIMESTAMPTZ,
+                        finished_at TIMESTAMPTZ,
+                        PRIMARY KEY (campaign_id, shard)
+                    );
+
+                    CREATE INDEX IF NOT EXISTS campaign_shards_pending_idx
+                    ON public.campaign_shards (user_id, status);
+
+                    -- Addresses already mailed, so a reclaimed shard does not mail them again
+                    CREATE TABLE IF NOT EXISTS public.campaign_sends (
+                        campaign_id TEXT NOT NULL,
+                        user_id TEXT NOT NULL,
+                        email TEXT NOT NULL,
+                        PRIMARY KEY (campaign_id, email)
+                    );
+                """)
+        DatabaseManager._shards_ready = True
+
+    def enqueue_campaign_shards(self, campaign_id: str, csv_paths: List[str],
+                                context: str, settings: dict) -> None:
+        """Queue one job row per shard CSV; settings must not contain credentials"""
+        self._create_shard_table()
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO public.campaign_shards
+                    (campaign_id, shard, shard_count, user_id, csv_path, context, settings)
+                    VALUES %s
+                """, [(campaign_id, shard, len(csv_paths), self.user_id, csv_path, context,
+                       json.dumps(settings)) for shard, csv_path in enumerate(csv_paths)])
+
+    def claim_campaign_shard(self, worker: str, stale_after: int = 300) -> Optional[Tuple]:
+        """
+        Claim one pending shard, or a running one whose worker stopped sending
+        heartbeats for stale_after seconds. Returns (campaign_id, shard,
+        shard_count, csv_path, context, settings) or None.
+        """
+        self._create_shard_table()
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE public.campaign_shards
+                    SET status = 'running', worker = %s, heartbeat = NOW()
+                    WHERE (campaign_id, shard) = (
+                        SELECT campaign_id, shard FROM public.campaign_shards
+                        WHERE user_id = %s AND (status = 'pending' OR (
+                            status = 'running' AND heartbeat < NOW() - %s * INTERVAL '1 second'))
+                        ORDER BY campaign_id, shard
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING campaign_id, shard, shard_count, csv_path, context, settings
+                """, (worker, self.user_id, stale_after))
+                return cur.fetchone()
+
+    def update_campaign_shard(self, campaign_id: str, shard: int, status: str,
+                              progress: dict, error: Optional[str] = None) -> None:
+        """Record shard progress ({sent, failed, not_generated, skipped, tokens}) and heartbeat"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE public.campaign_shards
+                    SET status = %s, sent = %s, failed = %s, not_generated = %s, skipped = %s,
+                        tokens = %s, error = %s, heartbeat = NOW(),
+                        finished_at = CASE WHEN %s IN ('done', 'error') THEN NOW() END
+                    WHERE campaign_id = %s AND shard = %s AND user_id = %s
+                """, (status, progress.get("sent", 0), progress.get("failed", 0),
+                      progress.get("not_generated", 0), progress.get("skipped", 0),
+                      json.dumps(progress.get("tokens", {})), error, status,
+                      campaign_id, shard, self.user_id))
+
+    def mark_campaign_sent(self, campaign_id: str, email: str) -> None:
+        """Checkpoint one sent address of a queued campaign"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO public.campaign_sends (campaign_id, user_id, email)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT DO NOTHING
+                """, (campaign_id, self.user_id, email))
+
+    def get_campaign_sent(self, campaign_id: str) -> List[str]:
+        """Addresses of a queued campaign that were already sent"""
+        self._create_shard_table()
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT email FROM public.campaign_sends
+                    WHERE campaign_id = %s AND user_id = %s
+                """, (campaign_id, self.user_id))
+                return [row[0] for row in cur.fetchall()]
+
+    def get_campaign_shards(self, campaign_id: str) -> List[Tuple]:
+        """Get (shard, status, worker, sent, failed, not_generated, skipped, tokens, error) per shard"""
+        self._create_shard_table()
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT shard, status, worker, sent, failed, not_generated, skipped, tokens, error
+                    FROM public.campaign_shards
+                    WHERE campaign_id = %s AND user_id = %s
+                    ORDER BY shard
+                """, (campaign_id, self.user_id))
+                return cur.fetchall()
+
     def execute_query(self, query):
         try:
             with self.get_connection() as conn:
@@ -339,32 +1042,140 @@ class DatabaseManager:
             print(f"Database error: {e}")
             return []
 
-    def cleanup_old_schemas(self, hours_old=24):
-        """Cleanup schemas older than specified hours"""
+    def _create_activity_table(self):
+        """Create the tenant activity table used by the reaper, once per process"""
+        if DatabaseManager._activity_ready:
+            return
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS public.tenant_activity (
+                        user_id TEXT PRIMARY KEY,
+                        schema_name TEXT NOT NULL,
+                        storage_mode TEXT NOT NULL,
+                        last_activity TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    );
+
+                    CREATE INDEX IF NOT EXISTS tenant_activity_last_idx
+                    ON public.tenant_activity (last_activity);
+                """)
+        DatabaseManager._activity_ready = True
+
+    def touch_activity(self, min_interval: int = 300) -> None:
+        """
+        Record that this user is active, at most once every min_interval seconds.
+        A user the reaper removed meanwhile is tracked again and, in schema
+        mode, gets their tables back before anything reads them.
+        """
+        now = time.monotonic()
+        if now - self._last_touch < min_interval:
+            return
+        try:
+            self._create_activity_table()
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
                     cur.execute("""
-                        SELECT schema_name 
-                        FROM information_schema.schemata 
-                        WHERE schema_name LIKE 'visitor_%'
-                        AND schema_name NOT IN (
-                            SELECT DISTINCT schemaname 
-                            FROM pg_stat_activity 
-                            WHERE query_start > NOW() - interval '%s hours'
-                        )
-                    """, (hours_old,))
-                    old_schemas = cur.fetchall()
-                    for schema in old_schemas:
-                        cur.execute(f"DROP SCHEMA IF EXISTS {schema[0]} CASCADE")
+                        INSERT INTO public.tenant_activity (user_id, schema_name, storage_mode)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (user_id) DO UPDATE
+                        SET last_activity = CURRENT_TIMESTAMP,
+                            schema_name = EXCLUDED.schema_name,
+                            storage_mode = EXCLUDED.storage_mode
+                        RETURNING (xmax = 0)
+                    """, (self.user_id, self.schema_name, self.storage_mode))
+                    untracked = cur.fetchone()[0]
+            self._last_touch = now
+            if untracked:
+                self.recreate_tenant_tables()
+        except psycopg2.Error as e:
+            print(f"Activity tracking error: {e}")
+
+    def backfill_activity(self) -> int:
+        """Start tracking user_ schemas that predate the activity table"""
+        self._create_activity_table()
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO public.tenant_activity (user_id, schema_name, storage_mode)
+                    SELECT REPLACE(SUBSTRING(nspname FROM 6), '_', '-'), nspname, 'schema'
+                    FROM pg_namespace
+                    WHERE nspname LIKE 'user\\_%'
+                    ON CONFLICT (user_id) DO NOTHING
+                """)
+                return cur.rowcount
+
+    def _drop_tenant(self, cur, user_id: str, schema_name: str, storage_mode: str) -> None:
+        if storage_mode == "shared":
+            cur.execute("SELECT set_config('app.user_id', %s, true)", (user_id,))
+            for table in TENANT_TABLES:
+                cur.execute(f"DELETE FROM {SHARED_SCHEMA}.{table} WHERE user_id = %s", (user_id,))
+        else:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema_name} CASCADE")
+        cur.execute("DELETE FROM public.tenant_activity WHERE user_id = %s", (user_id,))
+
+    def cleanup_old_schemas(self, hours_old=24, batch_size=20, max_batches=10, lock_timeout="2s",
+                            on_drop=None):
+        """
+        Drop tenants with no activity for hours_old hours.
+        Expired tenants come from one indexed query on tenant_activity and are
+        dropped in batches, each tenant in its own short transaction with a lock
+        timeout, so a busy tenant is skipped instead of blocking live traffic.
+        on_drop, when given, is called with each removed user_id once its drop
+        has committed (e.g. to delete data kept outside Postgres).
+        Returns the number of tenants removed.
+        """
+        self._create_activity_table()
+        removed = 0
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                for _ in range(max_batches):
+                    cur.execute("""
+                        SELECT user_id FROM public.tenant_activity
+                        WHERE last_activity < NOW() - %s * INTERVAL '1 hour'
+                        ORDER BY last_activity
+                        LIMIT %s
+                    """, (hours_old, batch_size))
+                    expired = [row[0] for row in cur.fetchall()]
                     conn.commit()
-                except psycopg2.Error as e:
-                    print(f"Cleanup error: {e}")
-                    raise
+                    if not expired:
+                        break
+
+                    for user_id in expired:
+                        try:
+                            cur.execute("SET LOCAL lock_timeout = %s", (lock_timeout,))
+                            # Re-check under a row lock in case the user came back meanwhile
+                            cur.execute("""
+                                SELECT schema_name, storage_mode FROM public.tenant_activity
+                                WHERE user_id = %s
+                                AND last_activity < NOW() - %s * INTERVAL '1 hour'
+                                FOR UPDATE SKIP LOCKED
+                            """, (user_id, hours_old))
+                            row = cur.fetchone()
+                            if row:
+                                self._drop_tenant(cur, user_id, *row)
+                                removed += 1
+                            conn.commit()
+                        except psycopg2.errors.LockNotAvailable:
+                            conn.rollback()
+                            print(f"Cleanup skipped busy tenant {user_id}")
+                            continue
+                        except psycopg2.Error as e:
+                            conn.rollback()
+                            print(f"Cleanup error for {user_id}: {e}")
+                            continue
+                        if row and on_drop:
+                            try:
+                                on_drop(user_id)
+                            except Exception as e:
+                                print(f"Cleanup error for {user_id} outside Postgres: {e}")
+
+                    if len(expired) < batch_size:
+                        break
+        return removed
 
     def __del__(self):
         """Cleanup connection pool"""
-        if hasattr(self, 'pool'):
+        if hasattr(self, 'pool') and not self.pool.closed:
             self.pool.closeall()
 
     def create_session_schema(self):
@@ -411,8 +1222,10 @@ class DatabaseManager:
                     )
                 """)
 
+    @recreates_tenant
     def save_token_usage(self, tokens_used: int, operation_type: str):
         """Save token usage data"""
+        self.touch_activity()
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(f"""
@@ -0,0 +1,100 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import threading
+import time
+from email.utils import formatdate
+
+
+class DryRunGenerator:
+    """Deterministic local stand-in for the chat completions API"""
+
+    def __init__(self, latency=0.0):
+        # Optional simulated latency per request, for capacity rehearsals
+        self.latency = latency
+
+    def __call__(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(data)
+
+    async def call_async(self, data):
+        """Same as calling the generator, but waits without blocking the event loop"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(data)
+
+    def respond(self, data):
+        prompt = data["messages"][-1]["content"]
+        digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+        if prompt.startswith('{"recipients"'):
+            # Batched request, answer in the structured format it asks for
+            recipients = json.loads(prompt)["recipients"]
+            return json.dumps({"emails": [
+                {"id": r["id"], "body": f"[DRY RUN {digest[:12]}]\n\nPlaceholder for {r['to']}.\n\nBest regards"}
+                for r in recipients
+            ]})
+        return (
+            f"[DRY RUN {digest[:12]}]\n\n"
+            f"This is a placeholder body generated offline from a {len(prompt)} character prompt.\n\n"
+            f"Best regards"
+        )
+
+
+class DryRunAccount:
+    def __init__(self, sender_email):
+        self.sender_email = sender_email
+
+
+class MailSink:
+    """
+    Drop-in replacement for SenderPool that records messages instead of
+    sending them. Messages are kept in memory when path is None, otherwise
+    appended to a JSONL file, or an mbox file when path ends with .mbox
+    (gzip compressed when the path also ends with .gz).
+    """
+
+    def __init__(self, path=None, max_concurrency=4, sender_email="dry-run@example.invalid"):
+        self.path = path
+        self.max_concurrency = max_concurrency
+        self.account = DryRunAccount(sender_email)
+        self.messages = []
+        self.count = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._mbox = bool(path) and path.removesuffix(".gz").endswith(".mbox")
+
+    def _open(self):
+        if self._file is None:
+            opener = gzip.open if self.path.endswith(".gz") else open
+            self._file = opener(self.path, "ab")
+        return self._file
+
+    def send(self, message, recipient_email):
+        if not isinstance(message, bytes):
+            message = message.as_bytes()
+        with self._lock:
+            self.count += 1
+            self.bytes_written += len(message)
+            if self.path is None:
+                self.messages.append((recipient_email, message))
+            elif self._mbox:
+                envelope = f"From {self.account.sender_email} {formatdate(usegmt=True)}\n".encode("ascii")
+                body = message.replace(b"\r\n", b"\n").replace(b"\nFrom ", b"\n>From ")
+                self._open().write(envelope + body + b"\n")
+            else:
+                record = {
+                    "recipient": recipient_email,
+                    "size": len(message),
+                    "message": message.decode("ascii", "replace")
+                }
+                self._open().write(json.dumps(record).encode("utf-8") + b"\n")
+        return self.account
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,74 @@
+import csv
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from database import HISTORY_COLUMNS
+
+
+HISTORY_SCHEMAS = {
+    "conversations": pa.schema([
+        ("id", pa.int64()),
+        ("role", pa.string()),
+        ("content", pa.string()),
+        ("context", pa.string()),
+        ("generated_text", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+    ]),
+    "email_activities": pa.schema([
+        ("id", pa.int64()),
+        ("recipient", pa.string()),
+        ("recipient_email", pa.string()),
+        ("subject", pa.string()),
+        ("context", pa.string()),
+        ("email_body", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+    ]),
+}
+
+
+def _history_batches(db, table, batch_size, archive):
+    if archive is not None:
+        return archive.iter_history(db, table, batch_size)
+    return db.iter_history(table, batch_size)
+
+
+def export_history_csv(db, table, path, batch_size=5000, archive=None):
+    """Stream a history table to CSV, returns the number of rows written"""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(HISTORY_COLUMNS[table])
+        for rows in _history_batches(db, table, batch_size, archive):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def export_history_parquet(db, table, path, batch_size=5000, archive=None):
+    """Stream a history table to Parquet, one row group per batch"""
+    schema = HISTORY_SCHEMAS[table]
+    count = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for rows in _history_batches(db, table, batch_size, archive):
+            columns = list(zip(*rows))
+            batch = pa.record_batch(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            )
+            writer.write_batch(batch)
+            count += len(rows)
+    return count
+
+
+def export_history(db, table, path, fmt="csv", batch_size=5000, archive=None):
+    """
+    Export a tenant's full history table to CSV or Parquet. Pass an
+    EmailArchive to include rows moved out of Postgres, otherwise only the
+    live rows are exported.
+    """
+    if fmt == "parquet":
+        return export_history_parquet(db, table, path, batch_size, archive)
+    if fmt == "csv":
+        return export_history_csv(db, table, path, batch_size, archive)
+    raise ValueError(f"Unknown export format: {fmt}")
@@ -0,0 +1,93 @@
+import copy
+import html
+import re
+from concurrent.futures import ProcessPoolExecutor
+from email import policy
+from email.message import EmailMessage
+from email.utils import formataddr, parseaddr
+
+
+# 7bit keeps the serialized bytes safe for any SMTP server, no 8BITMIME needed
+SMTP_POLICY = policy.SMTP.clone(cte_type='7bit')
+
+BOLD_PATTERN = re.compile(r'\*\*(.+?)\*\*')
+
+
+def body_to_html(email_body):
+    """Render an LLM plain-text body as minimal HTML paragraphs"""
+    paragraphs = []
+    for block in re.split(r'\n\s*\n', email_body.strip()):
+        text = html.escape(block.strip())
+        text = BOLD_PATTERN.sub(r'<strong>\1</strong>', text)
+        paragraphs.append(f"<p>{text.replace(chr(10), '<br>')}</p>")
+    return "<html><body>" + "".join(paragraphs) + "</body></html>"
+
+
+def render_message(sender_name, sender_email, recipient_email, subject, email_body, html_alternative=False):
+    """
+    Build the email and serialize it to bytes ready for sendmail.
+    Plain messages are a single text/plain part; with html_alternative a
+    multipart/alternative with an HTML rendering of the body is produced.
+    """
+    msg = EmailMessage(policy=SMTP_POLICY)
+    # Quotes or encodes display names with commas, quotes or non-ASCII characters
+    msg['From'] = formataddr((sender_name, sender_email))
+    msg['To'] = recipient_email
+    msg['Subject'] = subject
+    msg.set_content(email_body)
+    if html_alternative:
+        msg.add_alternative(body_to_html(email_body), subtype='html')
+    return msg.as_bytes()
+
+
+# The address at the end of the From header, which may be folded over several lines
+# and is bare (no angle brackets) when there is no display name
+FROM_ADDRESS = re.compile(rb"^From:(?:[^\r\n]|\r?\n[ \t])*?<?([^\s<>]+)>?[ \t]*(?=\r?\n(?![ \t])|\Z)",
+                          re.MULTILINE | re.IGNORECASE)
+
+
+def set_sender(message, sender_email):
+    """
+    Point the From header of a rendered message at sender_email, keeping
+    the display name. The sender pool calls this for whichever account
+    sends, which is not always the one the message was rendered for.
+    """
+    if isinstance(message, bytes):
+        headers, separator, body = message.partition(b"\r\n\r\n")
+        address = sender_email.encode("utf-8")
+        match = FROM_ADDRESS.search(headers)
+        if match is None or match.group(1) == address:
+            return message
+        return headers[:match.start(1)] + address + headers[match.end(1):] + separator + body
+    name, address = parseaddr(message['From'] or "")
+    if address == sender_email:
+        return message
+    # Deep copy, a shallow one would share the header list with the caller
+    message = copy.deepcopy(message)
+    del message['From']
+    message['From'] = formataddr((name, sender_email))
+    return message
+
+
+def _render_item(args):
+    return render_message(*args)
+
+
+def render_messages(items, sender_name, sender_email, html_alternative=False, processes=None, executor=None):
+    """
+    Render (recipient_email, subject, email_body) items to message bytes.
+    With processes set the CPU-bound rendering runs in a process pool:
+    executor, a ProcessPoolExecutor with that many workers, when given, so
+    a campaign pays the process startup once; otherwise one for this call.
+    """
+    args = [
+        (sender_name, sender_email, recipient_email, subject, email_body, html_alternative)
+        for recipient_email, subject, email_body in items
+    ]
+    if not processes or len(args) < 2:
+        return [_render_item(arg) for arg in args]
+    chunksize = max(len(args) // (processes * 4), 1)
+    if executor is not None:
+        return list(executor.map(_render_item, args, chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_render_item, args, chunksize=chunksize))
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+
+def snapshot_frames(snapshot, archived=None):
+    """Turn metrics snapshots (live and optionally archived) into combined DataFrames"""
+    snapshots = [snapshot] + ([archived] if archived else [])
+    daily_emails = pd.concat(
+        [pd.DataFrame(s["daily_emails"], columns=["Date", "Emails"]) for s in snapshots]
+    )
+    recipients = pd.concat(
+        [pd.DataFrame(s["recipients"], columns=["Recipient", "Emails", "LastSent"]) for s in snapshots]
+    )
+    daily_tokens = pd.concat(
+        [pd.DataFrame(s["daily_tokens"], columns=["Date", "Operation", "Tokens", "Operations"]) for s in snapshots]
+    )
+
+    daily_emails["Date"] = pd.to_datetime(daily_emails["Date"])
+    daily_tokens["Date"] = pd.to_datetime(daily_tokens["Date"])
+    recipients["LastSent"] = pd.to_datetime(recipients["LastSent"])
+    daily_emails = daily_emails.astype({"Emails": "int64"}).groupby("Date")["Emails"].sum()
+    recipients = recipients.astype({"Emails": "int64"}).groupby("Recipient").agg(
+        Emails=("Emails", "sum"), LastSent=("LastSent", "max")
+    )
+    daily_tokens = daily_tokens.astype({"Tokens": "int64", "Operations": "int64"})
+    return daily_emails, recipients, daily_tokens
+
+
+def _week_over_week(series, today):
+    this_week = series[series.index > today - pd.Timedelta(days=7)].sum()
+    last_week = series[(series.index > today - pd.Timedelta(days=14))
+                       & (series.index <= today - pd.Timedelta(days=7))].sum()
+    delta = (this_week - last_week) / last_week * 100 if last_week else None
+    return int(this_week), int(last_week), delta
+
+
+def compute_dashboard_metrics(snapshot, archived=None, today=None):
+    """
+    Derive every dashboard statistic from one metrics snapshot:
+    headline totals, a continuous daily frame with 7-day rolling averages
+    and tokens per email, week-over-week deltas and recipient frequency.
+    """
+    daily_emails, recipients, daily_tokens = snapshot_frames(snapshot, archived)
+    today = pd.Timestamp(today or pd.Timestamp.now()).normalize()
+
+    tokens_by_day = daily_tokens.groupby("Date")[["Tokens", "Operations"]].sum()
+    # min() of an empty index is NaT, and NaT compares False against everything
+    firsts = [first for first in (daily_emails.index.min(), tokens_by_day.index.min()) if not pd.isna(first)]
+    start = min(firsts + [today])
+    days = pd.date_range(start, today, freq="D", name="Date")
+
+    daily = pd.DataFrame(index=days)
+    daily["Emails"] = daily_emails.reindex(days, fill_value=0)
+    daily["Tokens"] = tokens_by_day["Tokens"].reindex(days, fill_value=0)
+    daily["Operations"] = tokens_by_day["Operations"].reindex(days, fill_value=0)
+    daily["Emails7dAvg"] = daily["Emails"].rolling(7, min_periods=1).mean()
+    daily["Tokens7dAvg"] = daily["Tokens"].rolling(7, min_periods=1).mean()
+    emails = daily["Emails"].to_numpy(dtype=float)
+    daily["TokensPerEmail"] = np.divide(
+        daily["Tokens"].to_numpy(dtype=float), emails, out=np.full_like(emails, np.nan), where=emails > 0
+    )
+
+    total_emails = int(daily_emails.sum())
+    total_tokens = int(daily_tokens["Tokens"].sum())
+    frequency = recipients["Emails"].value_counts().sort_index()
+
+    return {
+        "total_emails": total_emails,
+        "unique_recipients": len(recipients),
+        "active_days": int((daily_emails > 0).sum()),
+        "last_sent": daily_emails.index.max() if total_emails else None,
+        "total_tokens": total_tokens,
+        "total_operations": int(daily_tokens["Operations"].sum()),
+        "tokens_per_email": total_tokens / total_emails if total_emails else None,
+        "emails_week_over_week": _week_over_week(daily["Emails"], today),
+        "tokens_week_over_week": _week_over_week(daily["Tokens"], today),
+        "daily": daily.reset_index(),
+        "tokens_by_operation": daily_tokens.groupby("Operation")["Tokens"].sum().sort_values(ascending=False),
+        "top_recipients": recipients.nlargest(10, "Emails").reset_index(),
+        "recipient_frequency": frequency.rename_axis("EmailsPerRecipient").rename("Recipients").reset_index(),
+    }
@@ -0,0 +1,102 @@
+import argparse
+import os
+
+import psycopg2
+from dotenv import load_dotenv
+
+from database import DatabaseManager, SHARED_SCHEMA, TENANT_TABLES
+
+load_dotenv()
+
+
+def _columns(cur, schema, table):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s
+    """, (schema, table))
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate_user_schemas(dsn=None, drop_source=False, row_level_security=False):
+    """
+    Copy every per-user user_<id> schema into the shared tenant tables.
+    Each schema is copied in its own transaction and recorded in
+    public.schema_migrations, so the tool can be re-run safely. The same
+    transaction moves the tenant to shared mode in public.tenant_activity,
+    so the reaper never drops a migrated schema's data by its old mode.
+    """
+    conn = psycopg2.connect(dsn or os.getenv('DATABASE_URL'))
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS public.schema_migrations (
+                    schema_name TEXT PRIMARY KEY,
+                    migrated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("""
+                SELECT nspname FROM pg_namespace
+                WHERE nspname LIKE 'user\\_%'
+                AND nspname NOT IN (SELECT schema_name FROM public.schema_migrations)
+                ORDER BY nspname
+            """)
+            schemas = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
+
+    # Make sure the shared tables (and policies) and the activity table exist before copying
+    manager = DatabaseManager("migration", storage_mode="shared", row_level_security=row_level_security)
+    try:
+        manager.create_user_schema()
+        manager._create_activity_table()
+    finally:
+        manager.close_pool()
+
+    migrated = 0
+    for schema in schemas:
+        # Schema names are user_<uuid> with dashes replaced by underscores
+        user_id = schema[len("user_"):].replace('_', '-')
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT set_config('app.user_id', %s, true)", (user_id,))
+                for table in TENANT_TABLES:
+                    source_columns = _columns(cur, schema, table)
+                    if not source_columns:
+                        continue
+                    columns = sorted((source_columns & _columns(cur, SHARED_SCHEMA, table)) - {'id'})
+                    column_list = ", ".join(columns)
+                    conflict = " ON CONFLICT DO NOTHING" if table == "suppression_list" else ""
+                    cur.execute(f"""
+                        INSERT INTO {SHARED_SCHEMA}.{table} ({column_list})
+                        SELECT {column_list} FROM {schema}.{table}
+                        WHERE user_id = %s{conflict}
+                    """, (user_id,))
+                    print(f"{schema}.{table}: copied {cur.rowcount} rows")
+                cur.execute("""
+                    UPDATE public.tenant_activity
+                    SET storage_mode = 'shared', schema_name = %s
+                    WHERE user_id = %s
+                """, (SHARED_SCHEMA, user_id))
+                cur.execute("INSERT INTO public.schema_migrations (schema_name) VALUES (%s)", (schema,))
+                if drop_source:
+                    cur.execute(f"DROP SCHEMA {schema} CASCADE")
+            conn.commit()
+            migrated += 1
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Migration error for {schema}: {e}")
+
+    conn.close()
+    print(f"Migrated {migrated} of {len(schemas)} schemas into {SHARED_SCHEMA}")
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy per-user schemas into shared tenant tables")
+    parser.add_argument("--drop-source", action="store_true", help="drop each user schema after copying it")
+    parser.add_argument("--row-level-security", action="store_true", help="enable row-level security policies")
+    args = parser.parse_args()
+    migrate_user_schemas(drop_source=args.drop_source, row_level_security=args.row_level_security)
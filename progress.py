@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import deque
+
+from records import CampaignCounters
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+def format_progress(snapshot):
+    """One-line status text for a progress snapshot"""
+    text = (f"{snapshot['processed']:,} of {snapshot['total']:,} processed · "
+            f"{snapshot['sent']:,} sent, {snapshot['failed'] + snapshot['not_generated']:,} failed · "
+            f"{snapshot['rate']:.1f} emails/s · ETA {format_duration(snapshot['eta'])}")
+    queues = ", ".join(f"{stage} {depth}" for stage, depth in snapshot['queues'].items() if depth)
+    return f"{text} · queued: {queues}" if queues else text
+
+
+class ProgressReporter:
+    """
+    Campaign progress that any thread can update cheaply, rendered at most
+    fps times per second. Updates made on the thread that created the
+    reporter render inline; updates from worker threads only change the
+    counters, and the owning thread renders them when it calls tick().
+    The UI cost stays the same however many rows there are.
+    """
+
+    def __init__(self, total=0, render=None, fps=4, rate_window=10.0):
+        self.counters = CampaignCounters(total=total)
+        self.queues = {}
+        self.render = render
+        self.interval = 1.0 / fps
+        self._lock = threading.Lock()
+        self._owner = threading.current_thread()
+        self._started = time.monotonic()
+        self._last_render = float('-inf')
+        # (time, processed) samples for the throughput estimate
+        self._samples = deque([(self._started, 0)])
+        self._rate_window = rate_window
+
+    def set_total(self, total):
+        with self._lock:
+            self.counters.total = total
+
+    def advance(self, outcome, n=1):
+        """Count n rows as 'sent', 'failed' or 'not_generated'"""
+        with self._lock:
+            setattr(self.counters, outcome, getattr(self.counters, outcome) + n)
+        self._maybe_render()
+
+    def update(self, counts):
+        """Replace the counts, e.g. with totals merged from shard workers"""
+        with self._lock:
+            for outcome in ("sent", "failed", "not_generated"):
+                setattr(self.counters, outcome, counts.get(outcome, 0))
+        self._maybe_render()
+
+    def enqueue(self, stage, n=1):
+        """Track rows waiting in a pipeline stage"""
+        with self._lock:
+            self.queues[stage] = self.queues.get(stage, 0) + n
+
+    def dequeue(self, stage, n=1):
+        self.enqueue(stage, -n)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            counters = self.counters
+            processed = counters.processed
+            samples = self._samples
+            samples.append((now, processed))
+            while len(samples) > 2 and now - samples[1][0] > self._rate_window:
+                samples.popleft()
+            first_time, first_processed = samples[0]
+            rate = (processed - first_processed) / (now - first_time) if now > first_time else 0.0
+            remaining = max(counters.total - processed, 0)
+            return {
+                "total": counters.total,
+                "processed": processed,
+                "sent": counters.sent,
+                "failed": counters.failed,
+                "not_generated": counters.not_generated,
+                "fraction": processed / counters.total if counters.total else 1.0,
+                "rate": rate,
+                "eta": remaining / rate if rate else None,
+                "elapsed": now - self._started,
+                "queues": dict(self.queues),
+            }
+
+    def _maybe_render(self, force=False):
+        if self.render is None or threading.current_thread() is not self._owner:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_render < self.interval:
+            return
+        self._last_render = now
+        self.render(self.snapshot())
+
+    def tick(self):
+        """Render if a frame is due; for owners waiting on workers"""
+        self._maybe_render()
+
+    def finish(self):
+        """Render the final state regardless of the frame rate"""
+        self._maybe_render(force=True)
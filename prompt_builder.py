@@ -0,0 +1,180 @@
+import json
+import re
+import threading
+
+from settings import LLMSettings
+
+
+# Default model when no settings snapshot is passed in
+MODEL_ID = LLMSettings().model_id
+
+# Kept minimal: everything here is paid for on every request that misses the prefix cache
+INSTRUCTIONS = (
+    "You write professional business emails and output only the email body.\n"
+    "Sender: {sender_name}\n"
+    "Context: {context}\n"
+    "Rules:\n"
+    "- Be concise and professional.\n"
+    "- Do not repeat or paraphrase earlier emails; only add needed information, confirmation or follow-up.\n"
+    "- End with a signature from {sender_name}."
+)
+
+# Appended as a second, equally constant system message for multi-recipient requests
+BATCH_INSTRUCTIONS = (
+    "The user sends JSON {\"recipients\": [{\"id\", \"to\", \"subject\"}]}. Write one separate email per "
+    "recipient and reply with JSON only: {\"emails\": [{\"id\": <id>, \"body\": <email body>}]}."
+)
+
+# Output budget used to size multi-recipient batches
+TOKENS_PER_BODY = 250
+MAX_OUTPUT_TOKENS = 4096
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """Rough token count (words and punctuation) for when the provider reports no usage"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def compact_text(text):
+    """Strip indentation, trailing spaces and blank lines"""
+    return "\n".join(line.strip() for line in text.strip().splitlines() if line.strip())
+
+
+class PromptBuilder:
+    """
+    Builds chat requests for one campaign. The system message holds every
+    campaign-constant instruction and is compiled once, so it is byte-identical
+    across rows and providers can reuse their prefix cache; the user message
+    only carries the per-recipient fields.
+    """
+
+    def __init__(self, sender_name, context, model=MODEL_ID):
+        self.sender_name = sender_name
+        self.context = context
+        self.model = model
+        self.system_message = {
+            "role": "system",
+            "content": INSTRUCTIONS.format(sender_name=sender_name, context=compact_text(context))
+        }
+        self.batch_message = {"role": "system", "content": BATCH_INSTRUCTIONS}
+        self.prefix_tokens = estimate_tokens(self.system_message["content"])
+
+    def build(self, recipient_name, subject):
+        """Request payload for one recipient"""
+        return {
+            "model": self.model,
+            "messages": [
+                self.system_message,
+                {"role": "user", "content": f"To: {recipient_name}\nSubject: {subject}"}
+            ],
+            "stream": False
+        }
+
+    def batch_size_for(self, requested):
+        """Largest batch up to requested whose bodies fit in the output token limit"""
+        return max(1, min(requested, MAX_OUTPUT_TOKENS // TOKENS_PER_BODY))
+
+    def build_batch(self, items):
+        """Request payload asking for one body per (row_id, recipient_name, subject) item"""
+        recipients = [{"id": str(row_id), "to": name, "subject": subject} for row_id, name, subject in items]
+        return {
+            "model": self.model,
+            "messages": [
+                self.system_message,
+                self.batch_message,
+                {"role": "user", "content": json.dumps({"recipients": recipients}, separators=(",", ":"))}
+            ],
+            "max_tokens": len(items) * TOKENS_PER_BODY + 64,
+            "stream": False
+        }
+
+    @staticmethod
+    def parse_batch(content, items):
+        """
+        Validate a batched reply and return {row_id: body} for the items it
+        answered correctly; missing or malformed entries are simply left out.
+        """
+        wanted = {str(row_id): row_id for row_id, _, _ in items}
+        start, end = (content or "").find("{"), (content or "").rfind("}")
+        if start < 0 or end < start:
+            return {}
+        try:
+            emails = json.loads(content[start:end + 1]).get("emails", [])
+        except (ValueError, AttributeError):
+            return {}
+        bodies = {}
+        for entry in emails if isinstance(emails, list) else []:
+            if not isinstance(entry, dict):
+                continue
+            row_id = wanted.get(str(entry.get("id")))
+            body = entry.get("body")
+            if row_id is not None and isinstance(body, str) and body.strip():
+                bodies[row_id] = body.strip()
+        return bodies
+
+    def estimate_prompt_tokens(self, data):
+        """Estimated prompt tokens for a payload built by this builder"""
+        return self.prefix_tokens + sum(
+            estimate_tokens(m["content"]) for m in data["messages"] if m is not self.system_message
+        )
+
+
+class TokenStats:
+    """Thread-safe running totals of LLM token usage for a campaign"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.estimated_prompt_tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def record_estimate(self, tokens):
+        with self._lock:
+            self.requests += 1
+            self.estimated_prompt_tokens += tokens
+
+    def record_usage(self, usage):
+        """Add a provider usage block ({prompt_tokens, completion_tokens, ...})"""
+        if not usage:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        with self._lock:
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            self.cached_tokens += details.get("cached_tokens", 0) or 0
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "estimated_prompt_tokens": self.estimated_prompt_tokens,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
+
+    def merge(self, totals):
+        """Add totals from as_dict(), e.g. reported by a shard worker"""
+        with self._lock:
+            for key, value in totals.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    @property
+    def total_tokens(self):
+        """Provider-reported total, falling back to the prompt estimate"""
+        return (self.prompt_tokens or self.estimated_prompt_tokens) + self.completion_tokens
+
+    def prompt_tokens_per_request(self):
+        if not self.requests:
+            return 0
+        return (self.prompt_tokens or self.estimated_prompt_tokens) / self.requests
+
+    def prompt_tokens_per_email(self, emails):
+        """Prompt tokens spread over emails generated, lower than per request when requests are batched"""
+        if not emails:
+            return 0
+        return (self.prompt_tokens or self.estimated_prompt_tokens) / emails
@@ -0,0 +1,49 @@
+import argparse
+import threading
+
+from dotenv import load_dotenv
+
+from archive import EmailArchive
+from database import DatabaseManager
+
+load_dotenv()
+
+
+def run_reaper(hours_old=24, interval=600, batch_size=20, archive_dir=None, stop_event=None):
+    """Periodically drop tenants that have been inactive for hours_old hours, archive included"""
+    stop_event = stop_event or threading.Event()
+    archive = EmailArchive(archive_dir)
+    db = DatabaseManager("reaper")
+    try:
+        tracked = db.backfill_activity()
+        if tracked:
+            print(f"Reaper: started tracking {tracked} existing schemas")
+        while not stop_event.is_set():
+            try:
+                removed = db.cleanup_old_schemas(hours_old=hours_old, batch_size=batch_size,
+                                                 on_drop=archive.delete_tenant)
+                if removed:
+                    print(f"Reaper: removed {removed} inactive tenants")
+            except Exception as e:
+                print(f"Reaper error: {e}")
+            stop_event.wait(interval)
+    finally:
+        db.close_pool()
+
+
+def start_reaper(**kwargs):
+    """Run the reaper in a daemon thread, returns the stop event"""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_reaper, kwargs={**kwargs, "stop_event": stop_event}, daemon=True)
+    thread.start()
+    return stop_event
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drop inactive tenant data")
+    parser.add_argument("--hours-old", type=int, default=24)
+    parser.add_argument("--interval", type=int, default=600, help="seconds between runs")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--archive-dir", default=None, help="defaults to ARCHIVE_DIR")
+    args = parser.parse_args()
+    run_reaper(args.hours_old, args.interval, args.batch_size, args.archive_dir)
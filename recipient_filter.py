@@ -0,0 +1,100 @@
+import hashlib
+import math
+
+
+GMAIL_DOMAINS = {"gmail.com", "googlemail.com"}
+
+
+def normalize_email(address):
+    """Canonical form of an address used for dedupe and suppression checks"""
+    if not isinstance(address, str):
+        return None
+    address = address.strip().lower()
+    local, sep, domain = address.rpartition("@")
+    if not sep or not local or "." not in domain:
+        return None
+    if domain in GMAIL_DOMAINS:
+        # Gmail ignores dots and +tags, so they all reach the same inbox
+        local = local.split("+", 1)[0].replace(".", "")
+        domain = "gmail.com"
+    return f"{local}@{domain}"
+
+
+def shard_of(address, shard_count):
+    """Stable shard index for an address, the same on every process and host"""
+    key = normalize_email(address) or str(address).strip().lower()
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shard_count
+
+
+class BloomFilter:
+    """Fixed-size probabilistic set for very large recipient lists"""
+
+    def __init__(self, capacity, error_rate=1e-6):
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RecipientFilter:
+    """
+    Pre-generation filter that drops rows which would not be sent anyway:
+    invalid addresses, suppressed/unsubscribed addresses, recipients emailed
+    recently and duplicates within the current list.
+    """
+
+    def __init__(self, suppressed=(), recently_sent=(), expected_size=0, bloom_threshold=100000):
+        self.suppressed = {e for e in map(normalize_email, suppressed) if e}
+        self.recently_sent = {e for e in map(normalize_email, recently_sent) if e}
+        # Past the threshold the in-list duplicate check switches to a Bloom filter
+        if expected_size > bloom_threshold:
+            self.seen = BloomFilter(expected_size)
+        else:
+            self.seen = set()
+
+    @classmethod
+    def from_database(cls, db, days=30, **kwargs):
+        """Build a filter from the user's suppression list and recent sends"""
+        return cls(
+            suppressed=db.get_suppressed_emails(),
+            recently_sent=db.get_recent_recipient_emails(days),
+            **kwargs
+        )
+
+    def check(self, address):
+        """Returns the skip reason for address, or None if it should be sent"""
+        email = normalize_email(address)
+        if email is None:
+            return "invalid address"
+        if email in self.suppressed:
+            return "suppressed"
+        if email in self.recently_sent:
+            return "already emailed"
+        if email in self.seen:
+            return "duplicate in list"
+        self.seen.add(email)
+        return None
+
+    def filter_rows(self, rows, email_key="email"):
+        """Split rows into (kept, skipped) where skipped holds (row, reason) pairs"""
+        kept, skipped = [], []
+        for row in rows:
+            reason = self.check(row[email_key])
+            if reason:
+                skipped.append((row, reason))
+            else:
+                kept.append(row)
+        return kept, skipped
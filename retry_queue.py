@@ -0,0 +1,182 @@
+import random
+import smtplib
+import threading
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from sender_pool import SenderPoolExhausted, THROTTLE_CODES
+from settings import get_settings
+
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# HTTP statuses worth retrying: rate limits and server-side failures
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class GenerationError(Exception):
+    """The completions API returned no usable email body"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def classify_error(error):
+    """Whether a failed row is worth retrying (TRANSIENT) or never will succeed (PERMANENT)"""
+    if isinstance(error, GenerationError):
+        if error.status is None or error.status in RETRYABLE_STATUS:
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return TRANSIENT if codes and all(400 <= code < 500 for code in codes) else PERMANENT
+    if isinstance(error, smtplib.SMTPResponseException):
+        return TRANSIENT if error.smtp_code in THROTTLE_CODES or 400 <= error.smtp_code < 500 else PERMANENT
+    if isinstance(error, (SenderPoolExhausted, smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                          requests.ConnectionError, requests.Timeout, OSError)):
+        return TRANSIENT
+    # aiosmtplib errors, without importing it for sync-only installs
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and 400 <= code < 600:
+        return TRANSIENT if code < 500 else PERMANENT
+    return PERMANENT
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped at max_delay seconds"""
+
+    def __init__(self, max_attempts=5, base_delay=60, max_delay=3600):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_settings(cls, retry=None):
+        """Policy from the [retry] settings, the current ones by default"""
+        retry = retry or get_settings().retry
+        return cls(retry.max_attempts, retry.base_delay, retry.max_delay)
+
+    def delay(self, attempts):
+        """Seconds to wait after the attempts-th failure"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1)))
+
+    def next_attempt_at(self, attempts):
+        return datetime.now(timezone.utc) + timedelta(seconds=self.delay(attempts))
+
+
+class RetryQueue:
+    """
+    Collects failed rows during a campaign. Transient failures are queued in
+    the retry_queue table with backoff; permanent ones, and rows out of
+    attempts, go to dead_letters. Failures are buffered in memory so worker
+    threads never touch the database; flush() writes them in one round trip.
+    """
+
+    def __init__(self, db, policy=None):
+        self.db = db
+        self.policy = policy or RetryPolicy.from_settings()
+        self._lock = threading.Lock()
+        self._retries = []
+        self._dead = []
+        self.queued = 0
+        self.dead_lettered = 0
+
+    def record_failure(self, row, context, stage, error, email_body=None, attempts=1):
+        """
+        Record one failed row (dict with recipient_name, email, subject) at
+        stage 'generate' or 'send'. Returns TRANSIENT if it will be retried,
+        PERMANENT if it was dead-lettered.
+        """
+        error_class = classify_error(error)
+        fields = (row['recipient_name'], row['email'], row['subject'], context, email_body, stage, attempts)
+        with self._lock:
+            if error_class == TRANSIENT and attempts < self.policy.max_attempts:
+                self._retries.append(fields + (str(error), self.policy.next_attempt_at(attempts)))
+                self.queued += 1
+                return TRANSIENT
+            self._dead.append(fields + (str(error), error_class))
+            self.dead_lettered += 1
+            return PERMANENT
+
+    def flush(self):
+        """Write buffered failures to the database"""
+        with self._lock:
+            retries, self._retries = self._retries, []
+            dead, self._dead = self._dead, []
+        if retries:
+            self.db.enqueue_retries(retries)
+        if dead:
+            self.db.add_dead_letters(dead)
+
+
+class RetryWorker:
+    """
+    Replays rows from the retry queue without rerunning their campaign.
+    Rows that failed at the send stage keep their generated body, so only
+    the failed step is repeated.
+    """
+
+    def __init__(self, db, email_automation, policy=None):
+        self.db = db
+        self.email_automation = email_automation
+        # None follows the [retry] settings, reloaded between polls
+        self._policy = policy
+        self.policy = policy or RetryPolicy.from_settings()
+
+    def _retry(self, retry_id, recipient, recipient_email, subject, context, email_body, attempts):
+        automation = self.email_automation
+        stage = "generate"
+        try:
+            if not email_body:
+                email_body = automation.generate_email(subject, recipient, context, raise_errors=True)
+            stage = "send"
+            automation.send_email(recipient_email, subject, email_body, raise_errors=True)
+        except Exception as e:
+            error_class = classify_error(e)
+            if error_class == TRANSIENT and attempts + 1 < self.policy.max_attempts:
+                self.db.reschedule_retry(retry_id, attempts + 1, self.policy.next_attempt_at(attempts + 1),
+                                         str(e), stage, email_body)
+            else:
+                self.db.add_dead_letters([(recipient, recipient_email, subject, context, email_body,
+                                           stage, attempts + 1, str(e), error_class)])
+                self.db.delete_retry(retry_id)
+            return False
+        self.db.delete_retry(retry_id)
+        self.db.save_email_activity(recipient, subject, context, email_body, recipient_email=recipient_email)
+        return True
+
+    def run_once(self, limit=None):
+        """Retry due rows, returns (attempted, succeeded)"""
+        claimed = self.db.claim_retries(limit or get_settings().retry.batch_size)
+        succeeded = 0
+        for retry_id, recipient, recipient_email, subject, context, email_body, _, attempts in claimed:
+            succeeded += self._retry(retry_id, recipient, recipient_email, subject, context, email_body, attempts)
+        return len(claimed), succeeded
+
+    def run(self, poll_interval=None, stop_event=None):
+        """
+        Poll the retry queue until stop_event is set. Settings are reloaded
+        between polls; poll_interval defaults to workers.retry_poll_interval.
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            settings = self.email_automation.refresh_settings()
+            if self._policy is None:
+                self.policy = RetryPolicy.from_settings(settings.retry)
+            try:
+                attempted, _ = self.run_once()
+            except Exception as e:
+                print(f"Retry worker error: {e}")
+                attempted = 0
+            if not attempted:
+                stop_event.wait(poll_interval or settings.workers.retry_poll_interval)
+
+    def start(self, **kwargs):
+        """Run the retry worker in a daemon thread, returns the stop event"""
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self.run, kwargs={**kwargs, "stop_event": stop_event}, daemon=True)
+        thread.start()
+        return stop_event
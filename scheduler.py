@@ -0,0 +1,189 @@
+import argparse
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from retry_queue import RetryQueue
+
+
+def _zone(name, default):
+    try:
+        return ZoneInfo(name) if name else default
+    except (ZoneInfoNotFoundError, ValueError):
+        return default
+
+
+def _in_hours(hour, quiet_hours):
+    start, end = quiet_hours
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def defer_past_quiet_hours(send_at, tz, quiet_hours):
+    """The first time at or after send_at outside the recipient's local quiet hours"""
+    if not quiet_hours:
+        return send_at
+    local = send_at.astimezone(tz)
+    if not _in_hours(local.hour, quiet_hours):
+        return send_at
+    end_hour = quiet_hours[1]
+    resume = local.replace(hour=end_hour, minute=0, second=0, microsecond=0)
+    if resume <= local:
+        resume += timedelta(days=1)
+    return resume.astimezone(timezone.utc)
+
+
+def plan_send_times(rows, start_at, rate_per_hour=None, window=None,
+                    quiet_hours=(21, 8), default_timezone="UTC"):
+    """
+    Spread rows evenly from start_at, either at rate_per_hour or across a
+    window (timedelta). Rows may carry a 'timezone' key; sends landing inside
+    the recipient's local quiet_hours (start_hour, end_hour) are deferred.
+    Each timezone keeps a running next free slot, so deferred sends resume
+    one interval apart instead of all at the end of the quiet hours.
+    Returns (row, timezone_name, send_at) tuples.
+    """
+    if start_at.tzinfo is None:
+        start_at = start_at.replace(tzinfo=timezone.utc)
+    if window is not None:
+        interval = window / max(len(rows), 1)
+    elif rate_per_hour:
+        interval = timedelta(hours=1) / rate_per_hour
+    else:
+        interval = timedelta(0)
+
+    default_tz = _zone(default_timezone, timezone.utc)
+    next_free = {}
+    planned = []
+    for i, row in enumerate(rows):
+        tz_name = row.get('timezone') or default_timezone
+        send_at = max(start_at + interval * i, next_free.get(tz_name, start_at))
+        send_at = defer_past_quiet_hours(send_at, _zone(tz_name, default_tz), quiet_hours)
+        next_free[tz_name] = send_at + interval
+        planned.append((row, tz_name, send_at))
+    return planned
+
+
+class CampaignScheduler:
+    """
+    Delivers campaigns from the persisted scheduled_emails queue.
+    Bodies can be generated ahead of time (pregenerate) so the send window
+    only does SMTP work; send_due delivers whatever is due. Rows that fail
+    go through retry_queue like campaign rows: transient failures are
+    retried with backoff, permanent ones dead-lettered.
+    """
+
+    def __init__(self, db, email_automation, retry_queue=None):
+        self.db = db
+        self.email_automation = email_automation
+        self.retry_queue = retry_queue or RetryQueue(db)
+
+    def schedule_campaign(self, rows, context, start_at, rate_per_hour=None, window=None,
+                          quiet_hours=(21, 8), default_timezone="UTC"):
+        """Queue rows (dicts with recipient_name, email, subject) and return the campaign id"""
+        campaign_id = uuid.uuid4().hex
+        planned = plan_send_times(rows, start_at, rate_per_hour, window, quiet_hours, default_timezone)
+        self.db.enqueue_scheduled_emails(campaign_id, [
+            (row['recipient_name'], row['email'], row['subject'], context, tz_name, send_at)
+            for row, tz_name, send_at in planned
+        ])
+        return campaign_id
+
+    def pregenerate(self, horizon=timedelta(hours=24), limit=50):
+        """Generate bodies for queued emails due within horizon, returns how many were done"""
+        due_before = datetime.now(timezone.utc) + horizon
+        claimed = self.db.claim_scheduled_emails('pending', 'generating', due_before, limit)
+        generated = 0
+        for email_id, recipient, _, subject, context, _ in claimed:
+            email_body = self.email_automation.generate_email(subject, recipient, context)
+            if email_body:
+                self.db.update_scheduled_email(email_id, 'generated', email_body=email_body)
+                generated += 1
+            else:
+                # Back to pending so the send step retries generation inline
+                self.db.update_scheduled_email(email_id, 'pending', error="generation failed")
+        return generated
+
+    def send_due(self, limit=50):
+        """Send queued emails whose send_at has passed, returns how many were sent"""
+        now = datetime.now(timezone.utc)
+        claimed = self.db.claim_scheduled_emails('generated', 'sending', now, limit)
+        if len(claimed) < limit:
+            claimed += self.db.claim_scheduled_emails('pending', 'sending', now, limit - len(claimed))
+        sent = 0
+        try:
+            for email_id, recipient, recipient_email, subject, context, email_body in claimed:
+                stage = "generate"
+                try:
+                    if not email_body:
+                        email_body = self.email_automation.generate_email(subject, recipient, context,
+                                                                          raise_errors=True)
+                    stage = "send"
+                    self.email_automation.send_email(recipient_email, subject, email_body, raise_errors=True)
+                except Exception as e:
+                    # The retry worker takes it from here, or it is dead-lettered
+                    row = {"recipient_name": recipient, "email": recipient_email, "subject": subject}
+                    self.retry_queue.record_failure(row, context, stage, e, email_body)
+                    self.db.update_scheduled_email(email_id, 'failed', email_body=email_body,
+                                                   error=f"{stage} failed: {e}")
+                    continue
+                self.db.update_scheduled_email(email_id, 'sent', email_body=email_body)
+                self.db.save_email_activity(recipient, subject, context, email_body,
+                                            recipient_email=recipient_email)
+                sent += 1
+        finally:
+            self.retry_queue.flush()
+        return sent
+
+    def run(self, poll_interval=None, pregenerate_horizon=timedelta(hours=24),
+            off_peak_hours=None, stop_event=None):
+        """
+        Poll the queue until stop_event is set. With off_peak_hours
+        (start_hour, end_hour) pregeneration only runs inside those hours.
+        Settings are reloaded between polls; poll_interval defaults to
+        workers.scheduler_poll_interval.
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            settings = self.email_automation.refresh_settings()
+            try:
+                busy = self.send_due()
+                if not off_peak_hours or _in_hours(datetime.now().hour, off_peak_hours):
+                    busy += self.pregenerate(pregenerate_horizon)
+            except Exception as e:
+                print(f"Scheduler error: {e}")
+                busy = 0
+            if not busy:
+                stop_event.wait(poll_interval or settings.workers.scheduler_poll_interval)
+
+    def start(self, **kwargs):
+        """Run the scheduler in a daemon thread, returns the stop event"""
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self.run, kwargs={**kwargs, "stop_event": stop_event}, daemon=True)
+        thread.start()
+        return stop_event
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+    from autmati import EmailAutomation
+    from retry_queue import RetryWorker
+    from settings import install_reload_signal
+    from sharding import settings_from_env
+
+    parser = argparse.ArgumentParser(description="Deliver a user's scheduled emails and retries")
+    parser.add_argument("user_id")
+    parser.add_argument("--poll-interval", type=float, help="defaults to workers.scheduler_poll_interval")
+    args = parser.parse_args()
+    install_reload_signal()
+    db = DatabaseManager(args.user_id)
+    try:
+        # Survives app restarts: queued rows are drained without anyone opening the app.
+        # Both send through one sender pool, so together they keep to each account's rate limit
+        email_automation = EmailAutomation(**settings_from_env())
+        RetryWorker(db, email_automation).start()
+        CampaignScheduler(db, email_automation).run(args.poll_interval)
+    finally:
+        db.close_pool()
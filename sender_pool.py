@@ -0,0 +1,277 @@
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from message_renderer import set_sender
+
+
+# SMTP reply codes that mean "slow down / try later" rather than "never".
+THROTTLE_CODES = {421, 450, 451, 452, 454}
+
+
+class SenderPoolExhausted(Exception):
+    """Raised when no account in the pool could accept a message in time"""
+
+
+class SenderAccount:
+    """A single SMTP account with its own send-rate limit and connection pool"""
+
+    def __init__(self, smtp_server, port, sender_email, sender_password,
+                 rate_limit=None, rate_period=60, max_connections=2, weight=1, timeout=60):
+        self.smtp_server = smtp_server
+        self.port = int(port)
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        # rate_limit messages per rate_period seconds, None means unlimited
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.max_connections = max_connections
+        self.weight = weight
+        # Socket timeout in seconds for the SMTP session
+        self.timeout = timeout
+        self.throttled_until = 0.0
+        self.disabled = False
+
+        self._lock = threading.Lock()
+        self._sent = deque()
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _prune(self, now):
+        while self._sent and self._sent[0] <= now - self.rate_period:
+            self._sent.popleft()
+
+    def remaining_quota(self, now=None):
+        """Messages this account may still send in the current window"""
+        now = now or time.monotonic()
+        if self.disabled or now < self.throttled_until:
+            return 0
+        if self.rate_limit is None:
+            return float('inf')
+        with self._lock:
+            self._prune(now)
+            return max(self.rate_limit - len(self._sent), 0)
+
+    def next_available(self, now=None):
+        """Seconds until this account can send again"""
+        now = now or time.monotonic()
+        if self.disabled:
+            return float('inf')
+        wait = max(self.throttled_until - now, 0)
+        if self.rate_limit is not None:
+            with self._lock:
+                self._prune(now)
+                if len(self._sent) >= self.rate_limit:
+                    wait = max(wait, self._sent[0] + self.rate_period - now)
+        return wait
+
+    def try_reserve(self):
+        """Reserve one send from the quota, returns False if none is left"""
+        now = time.monotonic()
+        if self.disabled or now < self.throttled_until:
+            return False
+        with self._lock:
+            if self.rate_limit is not None:
+                self._prune(now)
+                if len(self._sent) >= self.rate_limit:
+                    return False
+            self._sent.append(now)
+            return True
+
+    def throttle(self, seconds):
+        """Take the account out of rotation for a while"""
+        self.throttled_until = time.monotonic() + seconds
+
+    def _open_connection(self):
+        server = smtplib.SMTP(self.smtp_server, self.port, timeout=self.timeout)
+        server.starttls()
+        server.login(self.sender_email, self.sender_password)
+        return server
+
+    def acquire_slot(self, blocking=True, timeout=None):
+        """Take one of the max_connections slots, returns False if none freed up"""
+        return self._slots.acquire(blocking, timeout)
+
+    def release_slot(self):
+        self._slots.release()
+
+    @contextmanager
+    def connection(self, slot_held=False):
+        """
+        Borrow a logged-in SMTP connection, reusing idle ones. With slot_held
+        the caller already took a connection slot; it is released either way.
+        """
+        if not slot_held:
+            self._slots.acquire()
+        server = None
+        try:
+            with self._lock:
+                server = self._idle.pop() if self._idle else None
+            if server is None:
+                server = self._open_connection()
+            yield server
+        except Exception:
+            if server is not None:
+                try:
+                    server.close()
+                except Exception:
+                    pass
+                server = None
+            raise
+        finally:
+            if server is not None:
+                with self._lock:
+                    self._idle.append(server)
+            self._slots.release()
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server in idle:
+            try:
+                server.quit()
+            except Exception:
+                pass
+
+
+class SenderPool:
+    """Distributes outgoing mail across several SMTP accounts with failover"""
+
+    def __init__(self, accounts, strategy="round_robin",
+                 throttle_cooldown=300, wait_timeout=60):
+        if not accounts:
+            raise ValueError("SenderPool needs at least one account")
+        if strategy not in ("round_robin", "weighted"):
+            raise ValueError(f"Unknown strategy: {strategy}")
+        self.accounts = list(accounts)
+        self.strategy = strategy
+        self.throttle_cooldown = throttle_cooldown
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._cursor = 0
+
+    @classmethod
+    def from_config(cls, accounts, **kwargs):
+        """Build a pool from a list of account dicts"""
+        return cls([SenderAccount(**account) for account in accounts], **kwargs)
+
+    @property
+    def max_concurrency(self):
+        """Total number of SMTP connections the pool may hold open"""
+        return sum(account.max_connections for account in self.accounts if not account.disabled)
+
+    def _candidates(self):
+        # Rotate first so accounts with equal (or unlimited) quota take turns
+        with self._lock:
+            start = self._cursor
+            self._cursor = (self._cursor + 1) % len(self.accounts)
+        accounts = self.accounts[start:] + self.accounts[:start]
+        if self.strategy == "weighted":
+            now = time.monotonic()
+            # sorted() is stable, ties keep the rotated order
+            return sorted(
+                accounts,
+                key=lambda account: account.remaining_quota(now) * account.weight,
+                reverse=True
+            )
+        return accounts
+
+    def _deliver(self, account, message, recipient_email):
+        """
+        Send through an account that holds a connection slot. Returns None on
+        success or the error that makes another account worth trying; errors
+        no other account can fix are raised.
+        """
+        try:
+            with account.connection(slot_held=True) as server:
+                # The From header has to match the account that actually sends
+                message = set_sender(message, account.sender_email)
+                if isinstance(message, bytes):
+                    server.sendmail(account.sender_email, [recipient_email], message)
+                else:
+                    server.send_message(message, from_addr=account.sender_email,
+                                        to_addrs=[recipient_email])
+            return None
+        except smtplib.SMTPRecipientsRefused:
+            # The recipient is the problem, another account will not help
+            raise
+        except smtplib.SMTPAuthenticationError as e:
+            print(f"Disabling sender {account.sender_email}: {e}")
+            account.disabled = True
+            return e
+        except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError,
+                smtplib.SMTPConnectError, smtplib.SMTPHeloError) as e:
+            if getattr(e, 'smtp_code', None) in THROTTLE_CODES:
+                print(f"Sender {account.sender_email} throttled: {e}")
+                account.throttle(self.throttle_cooldown)
+                return e
+            raise
+        except smtplib.SMTPServerDisconnected as e:
+            # Stale pooled connection, it was dropped; try the next account
+            return e
+        except OSError as e:
+            print(f"Sender {account.sender_email} unreachable: {e}")
+            account.throttle(min(self.throttle_cooldown, 30))
+            return e
+
+    def _try_account(self, account, message, recipient_email):
+        """Deliver through an account holding a slot, (sent, error); the slot is given back if it has no quota"""
+        if not account.try_reserve():
+            account.release_slot()
+            return False, None
+        error = self._deliver(account, message, recipient_email)
+        return error is None, error
+
+    def send(self, message, recipient_email):
+        """
+        Send a message through the first account with quota and a free
+        connection, returns the account used. Busy accounts are skipped
+        rather than queued on; only when every account with quota is busy
+        does the send wait for a connection.
+        message is either pre-serialized bytes or an email.message.Message.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        last_error = None
+
+        while True:
+            busy = None
+            for account in self._candidates():
+                if not account.acquire_slot(blocking=False):
+                    if busy is None and account.remaining_quota() > 0:
+                        busy = account
+                    continue
+                sent, error = self._try_account(account, message, recipient_email)
+                if sent:
+                    return account
+                last_error = error or last_error
+
+            if all(account.disabled for account in self.accounts):
+                raise SenderPoolExhausted(f"All sender accounts are disabled: {last_error}")
+
+            if busy is not None:
+                # Every account with quota is at its connection limit, queue on one of them
+                if busy.acquire_slot(timeout=max(deadline - time.monotonic(), 0)):
+                    sent, error = self._try_account(busy, message, recipient_email)
+                    if sent:
+                        return busy
+                    last_error = error or last_error
+                if time.monotonic() > deadline:
+                    raise SenderPoolExhausted(
+                        f"No sender connection free within {self.wait_timeout}s: {last_error}"
+                    )
+                continue
+
+            wait = min(account.next_available() for account in self.accounts)
+            if time.monotonic() + wait > deadline:
+                raise SenderPoolExhausted(
+                    f"No sender account available within {self.wait_timeout}s: {last_error}"
+                )
+            time.sleep(max(wait, 0.05))
+
+    def close(self):
+        """Close all pooled connections"""
+        for account in self.accounts:
+            account.close()
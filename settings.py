@@ -0,0 +1,326 @@
+import argparse
+import os
+import threading
+import time
+import typing
+from dataclasses import asdict, dataclass, field, fields, replace
+from typing import Optional
+
+import toml
+import yaml
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+@dataclass(frozen=True, slots=True)
+class LLMSettings:
+    model_id: str = "meta-llama/Meta-Llama-3-70B-Instruct"
+    api_url: str = "https://api.hyperbolic.xyz/v1/chat/completions"
+    # Seconds to wait for a completion before the row counts as failed
+    request_timeout: float = 60.0
+    # Pooled HTTP connections of the async engine
+    http_connections: int = 100
+
+
+@dataclass(frozen=True, slots=True)
+class SMTPSettings:
+    server: str = "smtp.gmail.com"
+    port: int = 587
+    # Messages per rate_period seconds for each account, None or 0 is unlimited
+    rate_limit: Optional[int] = None
+    rate_period: float = 60.0
+    max_connections: int = 2
+    throttle_cooldown: float = 300.0
+    wait_timeout: float = 60.0
+    timeout: float = 60.0
+
+
+@dataclass(frozen=True, slots=True)
+class DatabaseSettings:
+    storage_mode: str = "schema"
+    row_level_security: bool = False
+    min_connections: int = 1
+    max_connections: int = 10
+
+
+@dataclass(frozen=True, slots=True)
+class CampaignSettings:
+    # None uses one worker per pooled SMTP connection
+    max_workers: Optional[int] = None
+    batch_size: int = 500
+    generation_batch_size: int = 1
+    render_processes: Optional[int] = None
+    max_in_flight: int = 200
+    progress_fps: float = 4.0
+    dry_run: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class RetrySettings:
+    max_attempts: int = 5
+    base_delay: float = 60.0
+    max_delay: float = 3600.0
+    batch_size: int = 50
+
+
+@dataclass(frozen=True, slots=True)
+class ChatSettings:
+    cache_size: int = 512
+    cache_ttl: float = 24 * 3600.0
+    # Seconds between streamed words, 0 shows the answer at once
+    stream_delay: float = 0.05
+
+
+@dataclass(frozen=True, slots=True)
+class WorkerSettings:
+    scheduler_poll_interval: float = 30.0
+    retry_poll_interval: float = 30.0
+    shard_poll_interval: float = 10.0
+    shard_report_interval: float = 15.0
+    # How often get_settings() checks the settings file for changes
+    reload_interval: float = 5.0
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """One immutable snapshot of the engine settings, replaced as a whole on reload"""
+    profile: str = "default"
+    llm: LLMSettings = field(default_factory=LLMSettings)
+    smtp: SMTPSettings = field(default_factory=SMTPSettings)
+    db: DatabaseSettings = field(default_factory=DatabaseSettings)
+    campaign: CampaignSettings = field(default_factory=CampaignSettings)
+    retry: RetrySettings = field(default_factory=RetrySettings)
+    chat: ChatSettings = field(default_factory=ChatSettings)
+    workers: WorkerSettings = field(default_factory=WorkerSettings)
+
+    def as_dict(self):
+        return asdict(self)
+
+
+SECTIONS = {f.name: f.default_factory for f in fields(Settings) if f.name != "profile"}
+
+# Overrides applied on top of the defaults, before the settings file and the environment
+PROFILES = {
+    "default": {},
+    "low_latency_chat": {
+        "llm": {"request_timeout": 20},
+        "db": {"min_connections": 2},
+        "chat": {"cache_size": 2048, "stream_delay": 0},
+        "campaign": {"progress_fps": 10},
+    },
+    "bulk_throughput": {
+        "llm": {"request_timeout": 120, "http_connections": 200},
+        "smtp": {"max_connections": 4, "wait_timeout": 300},
+        "db": {"max_connections": 20},
+        "campaign": {"batch_size": 2000, "generation_batch_size": 8, "max_in_flight": 500, "progress_fps": 1},
+        "retry": {"batch_size": 200},
+        "workers": {"scheduler_poll_interval": 10, "retry_poll_interval": 10},
+    },
+    "dry_run": {
+        "campaign": {"dry_run": True, "max_workers": 16, "generation_batch_size": 8},
+        "workers": {"reload_interval": 1},
+    },
+}
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+def _coerce(field_type, value):
+    args = typing.get_args(field_type)
+    if type(None) in args:
+        if value is None or (isinstance(value, str) and value.strip().lower() in ("", "none", "null")):
+            return None
+        field_type = next(arg for arg in args if arg is not type(None))
+    if field_type is bool and isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return field_type(value)
+
+
+def _build_section(name, values, source):
+    section = SECTIONS[name]()
+    known = {f.name: f.type for f in fields(section)}
+    unknown = set(values) - set(known)
+    if unknown:
+        raise ValueError(f"Unknown {name} settings in {source}: {', '.join(sorted(unknown))}")
+    try:
+        return replace(section, **{key: _coerce(known[key], value) for key, value in values.items()})
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid {name} setting in {source}: {e}") from None
+
+
+def read_settings_file(path):
+    """Settings overrides from a TOML or YAML file, {} if it does not exist"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            data = yaml.safe_load(f) or {}
+        else:
+            data = toml.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must contain a table of settings")
+    return data
+
+
+def env_overrides(environ):
+    """
+    <SECTION>_<FIELD> environment variables, e.g. SMTP_RATE_LIMIT or
+    DB_MAX_CONNECTIONS, as a settings overrides dict.
+    """
+    overrides = {}
+    for name, section in SECTIONS.items():
+        for f in fields(section):
+            value = environ.get(f"{name}_{f.name}".upper())
+            if value is not None:
+                overrides.setdefault(name, {})[f.name] = value
+    return overrides
+
+
+def validate(settings):
+    if settings.db.storage_mode not in ("schema", "shared"):
+        raise ValueError(f"Unknown storage mode: {settings.db.storage_mode}")
+    if not 1 <= settings.db.min_connections <= settings.db.max_connections:
+        raise ValueError("db.min_connections must be between 1 and db.max_connections")
+    for name, value in (("campaign.batch_size", settings.campaign.batch_size),
+                        ("campaign.generation_batch_size", settings.campaign.generation_batch_size),
+                        ("campaign.max_in_flight", settings.campaign.max_in_flight),
+                        ("smtp.max_connections", settings.smtp.max_connections),
+                        ("retry.max_attempts", settings.retry.max_attempts)):
+        if value < 1:
+            raise ValueError(f"{name} must be at least 1")
+    if settings.campaign.progress_fps <= 0:
+        raise ValueError("campaign.progress_fps must be positive")
+    return settings
+
+
+def load_settings(path=None, profile=None, environ=None):
+    """
+    Build a Settings snapshot. Layers, each overriding the previous one:
+    the defaults, the named profile, the settings file (TOML, or YAML for
+    .yaml/.yml paths) and <SECTION>_<FIELD> environment variables.
+    The file is SETTINGS_FILE (default settings.toml) and the profile is
+    SETTINGS_PROFILE, else the file's top-level 'profile' key, else 'default'.
+    """
+    environ = os.environ if environ is None else environ
+    path = path or environ.get("SETTINGS_FILE", "settings.toml")
+    data = dict(read_settings_file(path))
+    profile = profile or environ.get("SETTINGS_PROFILE") or data.pop("profile", None) or "default"
+    data.pop("profile", None)
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown settings profile: {profile} (expected one of {', '.join(PROFILES)})")
+    unknown = set(data) - set(SECTIONS)
+    if unknown:
+        raise ValueError(f"Unknown settings sections in {path}: {', '.join(sorted(unknown))}")
+
+    layers = ((PROFILES[profile], f"profile {profile}"), (data, path), (env_overrides(environ), "environment"))
+    sections = {}
+    for name in SECTIONS:
+        values = {}
+        for layer, source in layers:
+            values.update(layer.get(name) or {})
+            # Build per layer so errors name the source that introduced them
+            _build_section(name, values, source)
+        sections[name] = _build_section(name, values, "settings")
+    return validate(Settings(profile=profile, **sections))
+
+
+class SettingsStore:
+    """
+    Holds the current Settings and reloads them when the settings file
+    changes, checking its mtime at most every workers.reload_interval
+    seconds. A file that fails to load keeps the previous settings, so a
+    bad edit never takes a running worker down.
+    """
+
+    def __init__(self, path=None, profile=None):
+        self.path = path
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._settings = load_settings(path, profile)
+        self._mtime = self._file_mtime()
+        self._checked = time.monotonic()
+
+    def _file_path(self):
+        return self.path or os.getenv("SETTINGS_FILE", "settings.toml")
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self._file_path()).st_mtime_ns
+        except OSError:
+            return None
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked >= self._settings.workers.reload_interval:
+            with self._lock:
+                if now - self._checked >= self._settings.workers.reload_interval:
+                    self._checked = now
+                    if self._file_mtime() != self._mtime:
+                        self._reload(quiet=True)
+        return self._settings
+
+    def _reload(self, quiet=False):
+        mtime = self._file_mtime()
+        try:
+            settings = load_settings(self.path, self.profile)
+        except Exception as e:
+            if not quiet:
+                raise
+            print(f"Keeping previous settings, reload failed: {e}")
+            settings = self._settings
+        self._mtime = mtime
+        self._settings = settings
+        return settings
+
+    def reload(self):
+        """Re-read the file and environment now, raises if they are invalid"""
+        with self._lock:
+            self._checked = time.monotonic()
+            return self._reload()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SettingsStore()
+    return _store
+
+
+def get_settings():
+    """Current settings for this process, picking up settings file edits"""
+    return _get_store().get()
+
+
+def reload_settings():
+    """Reload the settings right away, e.g. from a SIGHUP handler"""
+    return _get_store().reload()
+
+
+def use_settings(path=None, profile=None):
+    """Switch this process to another settings file or profile"""
+    global _store
+    with _store_lock:
+        _store = SettingsStore(path, profile)
+    return _store.get()
+
+
+def install_reload_signal():
+    """Reload the settings on SIGHUP, where the platform has it"""
+    import signal
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda *_: reload_settings())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the effective engine settings")
+    parser.add_argument("--file", help="settings file, defaults to SETTINGS_FILE or settings.toml")
+    parser.add_argument("--profile", choices=sorted(PROFILES))
+    args = parser.parse_args()
+    print(toml.dumps(load_settings(args.file, args.profile).as_dict()))
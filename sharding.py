@@ -0,0 +1,334 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import queue
+import socket
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from autmati import EmailAutomation
+from database import DatabaseManager
+from recipient_filter import RecipientFilter, shard_of
+from retry_queue import RetryQueue
+from settings import get_settings, install_reload_signal
+
+load_dotenv()
+
+
+OUTCOMES = ("sent", "failed", "not_generated")
+
+# Settings that are safe to store in the shared job table
+PUBLIC_SETTINGS = ("sender_name", "html_alternative", "render_processes", "generation_batch_size", "dry_run",
+                   "sink_path")
+
+
+def rate_share(limit, shard_count, shard):
+    """
+    shard's share of a rate limit. The remainder goes to the lowest shards,
+    so the shares add up to exactly the limit. A limit smaller than the
+    shard count cannot be split without a shard getting nothing, so it is
+    refused.
+    """
+    if not limit:
+        return limit
+    limit = int(limit)
+    if shard_count > limit:
+        raise ValueError(f"Rate limit {limit} cannot be split across {shard_count} shards, use at most {limit}")
+    return limit // shard_count + (1 if shard < limit % shard_count else 0)
+
+
+def shard_config(settings, shard_count, shard):
+    """
+    Copy of the campaign settings for one shard, with every sender's rate
+    limit split across shards. Senders without their own limit split
+    smtp.rate_limit.
+    """
+    default = get_settings().smtp.rate_limit
+
+    def share(limit):
+        return rate_share(default if limit is None else limit, shard_count, shard)
+
+    settings = dict(settings)
+    settings["rate_limit"] = share(settings.get("rate_limit"))
+    settings["sender_accounts"] = [
+        {**account, "rate_limit": share(account.get("rate_limit"))}
+        for account in settings.get("sender_accounts") or []
+    ]
+    return settings
+
+
+def _shard_path(path, shard):
+    if not path:
+        return path
+    directory, name = os.path.split(path)
+    stem, dot, suffix = name.partition(".")
+    return os.path.join(directory, f"{stem}.shard{shard}{dot}{suffix}")
+
+
+def split_csv(csv_filename, shard_count, paths):
+    """
+    Write each row of csv_filename to paths[shard_of(email)] in one pass, so
+    every shard parses only its own rows instead of the whole list.
+    """
+    files = [open(path, "w", newline="", encoding="utf-8") for path in paths]
+    try:
+        writers = [csv.writer(f) for f in files]
+        with open(csv_filename, newline="", encoding="utf-8-sig") as source:
+            reader = csv.reader(source)
+            header = next(reader, None)
+            if header is None:
+                return paths
+            for writer in writers:
+                writer.writerow(header)
+            email = header.index("email")
+            for row in reader:
+                writers[shard_of(row[email], shard_count)].writerow(row)
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def _build_automation(settings, shard):
+    if settings.get("dry_run"):
+        return EmailAutomation.dry_run(
+            settings["sender_name"],
+            sink_path=_shard_path(settings.get("sink_path"), shard),
+            sender_email=settings.get("sender_email", "dry-run@example.invalid"),
+            html_alternative=settings.get("html_alternative", False),
+            render_processes=settings.get("render_processes"),
+            generation_batch_size=settings.get("generation_batch_size")
+        )
+    kwargs = {key: value for key, value in settings.items() if key not in ("dry_run", "sink_path", "campaign_db")}
+    return EmailAutomation(**kwargs)
+
+
+def _record_sends(db, campaign_id=None):
+    """on_sent hook saving each send as email activity, checkpointed per campaign when queued"""
+    def record(row, context, email_body):
+        if campaign_id is not None:
+            db.mark_campaign_sent(campaign_id, row['email'])
+        db.save_email_activity(row['recipient_name'], row['subject'], context, email_body,
+                               recipient_email=row['email'])
+    return record
+
+
+def _progress(automation, shard, skipped):
+    return {
+        "shard": shard,
+        **automation.counts,
+        "skipped": len(skipped) if isinstance(skipped, list) else skipped,
+        "tokens": automation.token_stats.as_dict(),
+    }
+
+
+def run_shard(settings, csv_filename, context, shard, shard_count, recipient_filter=None,
+              report=None, report_interval=1.0, db=None, campaign_id=None):
+    """
+    Run one shard of a campaign in this process. settings must already hold
+    this shard's rate-limit share; report, if given, is called with a
+    progress dict every report_interval seconds and once at the end.
+    Sends are saved as email activity and token usage, and failed rows go
+    to a retry queue, on db or on a connection opened from
+    settings["campaign_db"] (DatabaseManager arguments) when a parent process
+    passed those instead. With campaign_id each send is also checkpointed for
+    that queued campaign. Dry runs record nothing.
+    """
+    owned_db = None
+    if settings.get("dry_run"):
+        db = None
+    elif db is None and settings.get("campaign_db"):
+        db = owned_db = DatabaseManager(**settings["campaign_db"])
+    automation = _build_automation(settings, shard)
+    if db is not None:
+        automation.retry_queue = RetryQueue(db)
+        automation.on_sent = _record_sends(db, campaign_id)
+    done = threading.Event()
+
+    def reporter():
+        while not done.wait(report_interval):
+            report(_progress(automation, shard, 0))
+
+    if report:
+        threading.Thread(target=reporter, daemon=True).start()
+    try:
+        skipped = automation.process_csv_and_send_emails(
+            csv_filename, context, recipient_filter=recipient_filter, shard=(shard, shard_count)
+        )
+        if db is not None and automation.token_stats.requests:
+            db.save_token_usage(tokens_used=automation.token_stats.total_tokens,
+                                operation_type="email_generation")
+    finally:
+        done.set()
+        if owned_db is not None:
+            owned_db.close_pool()
+    result = _progress(automation, shard, skipped)
+    result["skipped"] = skipped
+    if report:
+        report({**result, "skipped": len(skipped)})
+    return result
+
+
+def merge_progress(progress):
+    """Sum per-shard progress dicts into campaign totals"""
+    merged = {outcome: 0 for outcome in OUTCOMES}
+    merged["skipped"] = 0
+    merged["tokens"] = {}
+    for entry in progress:
+        for key in merged:
+            if key == "tokens":
+                for name, value in entry.get("tokens", {}).items():
+                    merged["tokens"][name] = merged["tokens"].get(name, 0) + value
+            elif key == "skipped" and isinstance(entry.get(key), list):
+                merged[key] += len(entry[key])
+            else:
+                merged[key] += entry.get(key, 0)
+    return merged
+
+
+def run_sharded_campaign(settings, csv_filename, context, shards=None, recipient_filter=None,
+                         on_progress=None, progress_interval=1.0):
+    """
+    Split a campaign into shards by address hash and run each shard in its
+    own worker process. on_progress is called with merged totals while the
+    shards run. Returns the merged totals with the full skipped list.
+    """
+    shards = shards or os.cpu_count() or 1
+    # Built up front so a limit that cannot be split fails before any process starts
+    per_shard = [shard_config(settings, shards, shard) for shard in range(shards)]
+    # Spawned workers do not inherit the parent's threads or open connections
+    context_mp = multiprocessing.get_context("spawn")
+    latest = {}
+    with tempfile.TemporaryDirectory(prefix="shards_") as directory, context_mp.Manager() as manager:
+        paths = split_csv(csv_filename, shards,
+                          [os.path.join(directory, f"shard{shard}.csv") for shard in range(shards)])
+        updates = manager.Queue()
+        with ProcessPoolExecutor(max_workers=shards, mp_context=context_mp) as executor:
+            futures = [
+                executor.submit(run_shard, per_shard[shard], paths[shard], context, shard, shards,
+                                recipient_filter, updates.put, progress_interval)
+                for shard in range(shards)
+            ]
+            while not all(future.done() for future in futures):
+                try:
+                    update = updates.get(timeout=progress_interval)
+                except queue.Empty:
+                    continue
+                latest[update["shard"]] = update
+                if on_progress:
+                    on_progress(merge_progress(latest.values()))
+
+            results = []
+            for shard, future in enumerate(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"Shard {shard} failed: {e}")
+                    results.append(latest.get(shard, {"shard": shard}))
+
+    merged = merge_progress(results)
+    merged["skipped"] = [item for result in results for item in result.get("skipped") or []
+                         if isinstance(result.get("skipped"), list)]
+    if on_progress:
+        on_progress({**merged, "skipped": len(merged["skipped"])})
+    return merged
+
+
+def enqueue_sharded_campaign(db, settings, csv_filename, context, shards):
+    """
+    Queue a campaign in the shared job table so worker hosts can claim its
+    shards. The list is split into one CSV per shard next to csv_filename,
+    which must be on storage every worker host can read. Returns the
+    campaign id.
+    """
+    campaign_id = str(uuid.uuid4())
+    public = {key: settings[key] for key in PUBLIC_SETTINGS if key in settings}
+    paths = split_csv(csv_filename, shards,
+                      [_shard_path(csv_filename, f"{shard}.{campaign_id[:8]}") for shard in range(shards)])
+    db.enqueue_campaign_shards(campaign_id, paths, context, public)
+    return campaign_id
+
+
+def campaign_progress(db, campaign_id):
+    """Merged totals and per-shard statuses for a queued campaign"""
+    rows = db.get_campaign_shards(campaign_id)
+    progress = [
+        {"sent": sent, "failed": failed, "not_generated": not_generated, "skipped": skipped,
+         "tokens": tokens or {}}
+        for _, _, _, sent, failed, not_generated, skipped, tokens, _ in rows
+    ]
+    merged = merge_progress(progress)
+    merged["shards"] = {shard: status for shard, status, *_ in rows}
+    return merged
+
+
+def run_shard_worker(db, settings, poll_interval=None, stop_event=None, worker=None):
+    """
+    Claim and run shards from the job table until stop_event is set.
+    settings carries this host's credentials and full rate limits; the stored
+    campaign settings are layered on top and the limits split per shard.
+    Engine settings are re-read for every shard, so edits to the settings
+    file apply from the next claim without restarting the worker.
+    """
+    stop_event = stop_event or threading.Event()
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    while not stop_event.is_set():
+        workers = get_settings().workers
+        job = db.claim_campaign_shard(worker)
+        if job is None:
+            stop_event.wait(poll_interval or workers.shard_poll_interval)
+            continue
+        campaign_id, shard, shard_count, csv_path, context, stored = job
+        print(f"Worker {worker}: running shard {shard}/{shard_count} of {campaign_id}")
+        # A shard reclaimed from a stalled worker skips the addresses it already mailed
+        already_sent = RecipientFilter(recently_sent=db.get_campaign_sent(campaign_id))
+
+        def report(progress):
+            db.update_campaign_shard(campaign_id, shard, "running", progress)
+
+        try:
+            result = run_shard(shard_config({**settings, **stored}, shard_count, shard), csv_path, context,
+                               shard, shard_count, recipient_filter=already_sent, report=report,
+                               report_interval=workers.shard_report_interval, db=db, campaign_id=campaign_id)
+            db.update_campaign_shard(campaign_id, shard, "done", {**result, "skipped": len(result["skipped"])})
+        except Exception as e:
+            print(f"Worker {worker}: shard {shard} of {campaign_id} failed: {e}")
+            db.update_campaign_shard(campaign_id, shard, "error", {}, error=str(e))
+
+
+def settings_from_env():
+    """
+    Sender settings for a worker host. Credentials come from the environment;
+    server, port and rate limit from the [smtp] settings (SMTP_SERVER,
+    SMTP_PORT and SMTP_RATE_LIMIT still override them).
+    """
+    smtp = get_settings().smtp
+    return {
+        "api_key": os.getenv("API_KEY"),
+        "smtp_server": smtp.server,
+        "port": smtp.port,
+        "sender_email": os.getenv("SENDER_EMAIL"),
+        "sender_password": os.getenv("SENDER_PASSWORD"),
+        "sender_name": os.getenv("SENDER_NAME", ""),
+        # None follows smtp.rate_limit, re-read for every claimed shard
+        "rate_limit": None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run campaign shards queued in Postgres")
+    parser.add_argument("user_id")
+    parser.add_argument("--poll-interval", type=float, help="defaults to workers.shard_poll_interval")
+    args = parser.parse_args()
+    # kill -HUP reloads the settings now instead of at the next file check
+    install_reload_signal()
+    db = DatabaseManager(args.user_id)
+    try:
+        run_shard_worker(db, settings_from_env(), args.poll_interval)
+    finally:
+        db.close_pool()
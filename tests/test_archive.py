@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from archive import ARCHIVE_SCHEMAS, PARTITIONING, EmailArchive
+from chat_cache import answer_from_metrics, data_version, email_metrics
+from database import EMAIL_METRIC_FIELDS, HISTORY_COLUMNS
+
+
+def row(id, timestamp):
+    return (id, f"n{id}", f"a{id}@example.com", "s", "c", "b", timestamp)
+
+
+class FakeDB:
+    """Live rows only, paged the way DatabaseManager.get_history_page does"""
+
+    user_id = "u-1"
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda r: (r[-1], r[0]), reverse=True)
+
+    def get_history_page(self, table, cursor=None, page_size=50):
+        rows = [r for r in self.rows if not cursor or (r[-1], r[0]) < cursor][:page_size + 1]
+        if len(rows) <= page_size:
+            return rows, None
+        return rows[:page_size], (rows[page_size - 1][-1], rows[page_size - 1][0])
+
+    def iter_history(self, table, batch_size=5000):
+        rows = self.rows[::-1]
+        for i in range(0, len(rows), batch_size):
+            yield rows[i:i + batch_size]
+
+    def get_email_metrics(self):
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        timestamps = [r[-1] for r in self.rows]
+        return (len(self.rows), len({r[2] for r in self.rows}), len({t.date() for t in timestamps}),
+                max(timestamps, default=None), sum(t >= today for t in timestamps), 0, 0, 0,
+                max((r[0] for r in self.rows), default=None))
+
+    def get_email_version(self):
+        return len(self.rows), max((r[0] for r in self.rows), default=None)
+
+    def get_email_overlap(self, recipients, days):
+        return (len({r[2] for r in self.rows} & set(recipients)),
+                len({r[-1].date() for r in self.rows} & set(days)))
+
+
+def archive_rows(root, rows, user_id="u-1"):
+    schema = ARCHIVE_SCHEMAS["email_activities"]
+    columns = dict(zip(HISTORY_COLUMNS["email_activities"], zip(*rows)))
+    table = pa.Table.from_arrays(
+        [pa.array(columns.get(field.name, [None] * len(rows)), type=field.type) for field in schema],
+        schema=schema
+    )
+    table = table.append_column("user_id", pa.array([user_id] * len(rows), pa.string()))
+    table = table.append_column("month", pa.array([f"{r[-1]:%Y-%m}" for r in rows], pa.string()))
+    pq.write_to_dataset(table, str(root / "email_activities"), partitioning=PARTITIONING)
+
+
+def test_history_pages_continue_into_the_archive(tmp_path):
+    archived = [row(i, datetime(2024, 1 + i % 3, 1 + i)) for i in range(1, 8)]
+    archive_rows(tmp_path, archived)
+    # A row archived twice by an interrupted run shows up once
+    archive_rows(tmp_path, archived[:1])
+    live = [row(i, datetime(2024, 6, i)) for i in range(8, 13)]
+    archive = EmailArchive(str(tmp_path))
+    db = FakeDB(live)
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = archive.get_history_page(db, "email_activities", cursor, page_size=3)
+        seen += rows
+        if cursor is None:
+            break
+    keys = [(r[-1], r[0]) for r in seen]
+    assert keys == sorted(keys, reverse=True)
+    assert sorted(r[0] for r in seen) == list(range(1, 13))
+
+    exported = [r for rows in archive.iter_history(db, "email_activities", batch_size=4) for r in rows]
+    assert [r[0] for r in exported] == [r[0] for r in seen[::-1]]
+
+
+def test_delete_tenant_removes_only_that_tenant(tmp_path):
+    archive_rows(tmp_path, [row(1, datetime(2024, 1, 1))], user_id="u-1")
+    archive_rows(tmp_path, [row(2, datetime(2024, 1, 1))], user_id="u-2")
+    archive = EmailArchive(str(tmp_path))
+
+    assert archive.delete_tenant("u-1") == 1
+    assert list(archive.iter_history(FakeDB([]), "email_activities")) == []
+    assert archive.delete_tenant("u-1") == 0
+    assert len(archive._scan("email_activities", "u-2", ["recipient"])) == 1
+
+
+def test_chat_metrics_count_archived_rows(tmp_path):
+    now = datetime.now()
+    # a1 was emailed before and after the cutoff, so it counts once
+    archive_rows(tmp_path, [row(1, now - timedelta(days=200)), row(2, now - timedelta(days=150))])
+    db = FakeDB([(3, "n1", "a1@example.com", "s", "c", "b", now)])
+    archive = EmailArchive(str(tmp_path))
+
+    live = email_metrics(db)
+    merged = email_metrics(db, archive)
+    assert set(merged) == set(EMAIL_METRIC_FIELDS)
+    assert (live["total_emails"], merged["total_emails"]) == (1, 3)
+    assert merged["unique_recipients"] == 2
+    assert merged["active_days"] == 3
+    assert merged["emails_today"] == 1
+    assert merged["last_id"] == live["last_id"]
+    assert answer_from_metrics("How many emails have I sent?", merged) == "You sent 3 emails in total."
+
+    db = FakeDB([])
+    assert answer_from_metrics("How many emails have I sent?", email_metrics(db)) == \
+        "No email records found in database."
+    assert email_metrics(db, archive)["last_sent"].date() == (now - timedelta(days=150)).date()
+
+
+def test_archive_runs_refresh_the_rollup(tmp_path):
+    now = datetime.now()
+    archive_rows(tmp_path, [row(1, now - timedelta(days=200))])
+    db = FakeDB([])
+    archive = EmailArchive(str(tmp_path))
+    version = data_version(db, archive)
+    assert archive.email_rollup("u-1")["total_emails"] == 1
+    assert data_version(db, archive) == version
+
+    archive_rows(tmp_path, [row(2, now - timedelta(days=100))])
+    archive._write_rollup("u-1")
+    assert data_version(db, archive) != version
+    assert email_metrics(db, archive)["total_emails"] == 2
+    # The rollup sits next to the partitions without being read as one
+    assert len(archive._scan("email_activities", "u-1", ["recipient"])) == 2
+    assert archive.email_rollup("u-2") is None
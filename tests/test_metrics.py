@@ -0,0 +1,36 @@
+from datetime import date
+
+from metrics import compute_dashboard_metrics
+
+
+def snapshot(daily_emails=(), recipients=(), daily_tokens=()):
+    return {"daily_emails": list(daily_emails), "recipients": list(recipients), "daily_tokens": list(daily_tokens)}
+
+
+def test_token_history_without_emails_spans_every_day():
+    metrics = compute_dashboard_metrics(
+        snapshot(daily_tokens=[(date(2024, 5, 1), "chat_completion", 100, 1),
+                               (date(2024, 5, 3), "chat_completion", 200, 1)]),
+        today=date(2024, 5, 5)
+    )
+    daily = metrics["daily"]
+    assert metrics["total_tokens"] == 300
+    assert len(daily) == 5
+    assert daily["Tokens"].sum() == 300
+
+
+def test_frame_starts_at_the_earliest_history():
+    metrics = compute_dashboard_metrics(
+        snapshot(daily_emails=[(date(2024, 5, 2), 3)],
+                 recipients=[("a@example.com", 3, date(2024, 5, 2))],
+                 daily_tokens=[(date(2024, 4, 30), "email_generation", 50, 1)]),
+        today=date(2024, 5, 5)
+    )
+    assert metrics["daily"]["Date"].iloc[0].date() == date(2024, 4, 30)
+    assert metrics["total_emails"] == 3
+
+
+def test_empty_history_is_a_single_day():
+    metrics = compute_dashboard_metrics(snapshot(), today=date(2024, 5, 5))
+    assert len(metrics["daily"]) == 1
+    assert metrics["total_emails"] == 0
@@ -0,0 +1,24 @@
+import json
+
+from prompt_builder import PromptBuilder
+
+ITEMS = [(0, "Ann", "Hello"), (1, "Bob", "Hi"), (2, "Cy", "Hey")]
+
+
+def test_parse_batch_keeps_only_valid_entries():
+    content = "Here you go:\n" + json.dumps({"emails": [
+        {"id": 0, "body": "  Dear Ann  "},
+        {"id": "1", "body": "Dear Bob"},
+        {"id": 2, "body": "   "},
+        {"id": 7, "body": "Dear nobody"},
+        "not an entry",
+    ]}) + "\nThanks"
+    assert PromptBuilder.parse_batch(content, ITEMS) == {0: "Dear Ann", 1: "Dear Bob"}
+
+
+def test_parse_batch_tolerates_broken_replies():
+    assert PromptBuilder.parse_batch(None, ITEMS) == {}
+    assert PromptBuilder.parse_batch("no json here", ITEMS) == {}
+    assert PromptBuilder.parse_batch('{"emails": [{"id": 0,', ITEMS) == {}
+    assert PromptBuilder.parse_batch('{"emails": {"id": 0}}', ITEMS) == {}
+    assert PromptBuilder.parse_batch('["emails"]', ITEMS) == {}
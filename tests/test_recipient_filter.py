@@ -0,0 +1,33 @@
+import pytest
+
+from recipient_filter import BloomFilter, RecipientFilter, normalize_email
+
+
+@pytest.mark.parametrize("address,expected", [
+    (" Jane.Doe@Example.COM ", "jane.doe@example.com"),
+    ("j.a.n.e+news@googlemail.com", "jane@gmail.com"),
+    ("jane+news@example.com", "jane+news@example.com"),
+    ("no-at-sign", None),
+    ("@example.com", None),
+    ("jane@localhost", None),
+    (None, None),
+])
+def test_normalize_email(address, expected):
+    assert normalize_email(address) == expected
+
+
+def test_filter_reports_why_rows_were_skipped():
+    recipient_filter = RecipientFilter(suppressed=["Gone@Example.com"], recently_sent=["j.ane@gmail.com"])
+    rows = [{"email": e} for e in ["a@example.com", "gone@example.com", "jane+x@gmail.com",
+                                   "A@example.com", "broken"]]
+    kept, skipped = recipient_filter.filter_rows(rows)
+    assert kept == [{"email": "a@example.com"}]
+    assert [reason for _, reason in skipped] == ["suppressed", "already emailed", "duplicate in list",
+                                                 "invalid address"]
+
+
+def test_large_lists_dedupe_with_a_bloom_filter():
+    recipient_filter = RecipientFilter(expected_size=11, bloom_threshold=10)
+    assert isinstance(recipient_filter.seen, BloomFilter)
+    assert recipient_filter.check("a@example.com") is None
+    assert recipient_filter.check("A@example.com") == "duplicate in list"
@@ -0,0 +1,50 @@
+import smtplib
+
+import pytest
+import requests
+
+from retry_queue import PERMANENT, TRANSIENT, GenerationError, RetryPolicy, RetryQueue, classify_error
+from sender_pool import SenderPoolExhausted
+
+
+@pytest.mark.parametrize("error,expected", [
+    (GenerationError("timeout"), TRANSIENT),
+    (GenerationError("rate limited", status=429), TRANSIENT),
+    (GenerationError("bad request", status=400), PERMANENT),
+    (smtplib.SMTPRecipientsRefused({"a@example.com": (450, b"mailbox busy")}), TRANSIENT),
+    (smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no such user")}), PERMANENT),
+    (smtplib.SMTPDataError(421, b"try later"), TRANSIENT),
+    (smtplib.SMTPDataError(554, b"rejected"), PERMANENT),
+    (smtplib.SMTPServerDisconnected("gone"), TRANSIENT),
+    (SenderPoolExhausted("no account"), TRANSIENT),
+    (requests.ConnectionError("refused"), TRANSIENT),
+    (ValueError("bug"), PERMANENT),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+
+class FakeDB:
+    def __init__(self):
+        self.retries, self.dead = [], []
+
+    def enqueue_retries(self, rows):
+        self.retries += rows
+
+    def add_dead_letters(self, rows):
+        self.dead += rows
+
+
+def test_failures_are_buffered_until_flush():
+    db = FakeDB()
+    retry_queue = RetryQueue(db, RetryPolicy(max_attempts=3))
+    row = {"recipient_name": "A", "email": "a@example.com", "subject": "s"}
+
+    assert retry_queue.record_failure(row, "c", "send", SenderPoolExhausted("busy"), "body") == TRANSIENT
+    assert retry_queue.record_failure(row, "c", "send", SenderPoolExhausted("busy"), "body", attempts=3) == PERMANENT
+    assert retry_queue.record_failure(row, "c", "generate", GenerationError("bad", status=400)) == PERMANENT
+    assert (db.retries, db.dead) == ([], [])
+
+    retry_queue.flush()
+    assert (len(db.retries), len(db.dead)) == (1, 2)
+    assert (retry_queue.queued, retry_queue.dead_lettered) == (1, 2)
@@ -0,0 +1,95 @@
+import smtplib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from retry_queue import GenerationError
+from scheduler import CampaignScheduler, defer_past_quiet_hours, plan_send_times
+
+
+def rows(n, tz=None):
+    return [{"email": f"a{i}@example.com", **({"timezone": tz} if tz else {})} for i in range(n)]
+
+
+def test_deferred_sends_keep_their_spacing():
+    start = datetime(2024, 5, 1, 20, tzinfo=timezone.utc)
+    planned = plan_send_times(rows(800), start, window=timedelta(hours=8), quiet_hours=(21, 8))
+    times = [send_at for _, _, send_at in planned]
+    interval = timedelta(hours=8) / 800
+
+    assert len(set(times)) == 800
+    assert all(b - a >= interval for a, b in zip(times, times[1:]))
+    assert not [t for t in times if t.hour >= 21 or t.hour < 8]
+    by_hour = Counter(t.replace(minute=0, second=0, microsecond=0) for t in times)
+    assert max(by_hour.values()) == 100
+    assert times[100] == datetime(2024, 5, 2, 8, tzinfo=timezone.utc)
+
+
+def test_undeferred_sends_follow_the_rate():
+    start = datetime(2024, 5, 1, 9, tzinfo=timezone.utc)
+    planned = plan_send_times(rows(3), start, rate_per_hour=60)
+    assert [send_at for _, _, send_at in planned] == [start + timedelta(minutes=i) for i in range(3)]
+
+
+def test_timezones_are_paced_independently():
+    start = datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+    # 12:00 UTC is 21:00 in Tokyo, so those rows wait for 08:00 local (23:00 UTC)
+    planned = plan_send_times(rows(2, "Asia/Tokyo") + rows(2), start, rate_per_hour=60)
+    tokyo = [send_at for _, tz, send_at in planned if tz == "Asia/Tokyo"]
+    utc = [send_at for _, tz, send_at in planned if tz == "UTC"]
+    assert tokyo == [datetime(2024, 5, 1, 23, tzinfo=timezone.utc),
+                     datetime(2024, 5, 1, 23, 1, tzinfo=timezone.utc)]
+    assert utc == [start + timedelta(minutes=2), start + timedelta(minutes=3)]
+
+
+def test_defer_past_quiet_hours_wraps_midnight():
+    tz = timezone.utc
+    assert defer_past_quiet_hours(datetime(2024, 5, 1, 23, 30, tzinfo=tz), tz, (21, 8)) == \
+        datetime(2024, 5, 2, 8, tzinfo=tz)
+    assert defer_past_quiet_hours(datetime(2024, 5, 1, 12, tzinfo=tz), tz, (21, 8)) == \
+        datetime(2024, 5, 1, 12, tzinfo=tz)
+
+
+class FakeQueueDB:
+    def __init__(self, claimed):
+        self.claimed = claimed
+        self.updates, self.activities, self.retries, self.dead = [], [], [], []
+
+    def claim_scheduled_emails(self, status, new_status, due_before, limit):
+        claimed = [row for row in self.claimed if row[-1] or status == "pending"][:limit]
+        self.claimed = [row for row in self.claimed if row not in claimed]
+        return claimed
+
+    def update_scheduled_email(self, email_id, status, email_body=None, error=None):
+        self.updates.append((email_id, status))
+
+    def save_email_activity(self, *args, **kwargs):
+        self.activities.append(args)
+
+    def enqueue_retries(self, rows):
+        self.retries += rows
+
+    def add_dead_letters(self, rows):
+        self.dead += rows
+
+
+class FakeAutomation:
+    def generate_email(self, subject, recipient, context, raise_errors=False):
+        raise GenerationError("no body", status=503)
+
+    def send_email(self, recipient_email, subject, email_body, raise_errors=False):
+        if recipient_email.startswith("bad"):
+            raise smtplib.SMTPRecipientsRefused({recipient_email: (550, b"no such user")})
+        return True
+
+
+def test_send_due_hands_failures_to_the_retry_queue():
+    db = FakeQueueDB([(1, "A", "a@example.com", "s", "c", "body"),
+                      (2, "B", "bad@example.com", "s", "c", "body"),
+                      (3, "C", "c@example.com", "s", "c", None)])
+    scheduler = CampaignScheduler(db, FakeAutomation())
+
+    assert scheduler.send_due() == 1
+    assert sorted(db.updates) == [(1, "sent"), (2, "failed"), (3, "failed")]
+    # The refused address is dead-lettered, the generation outage retried
+    assert [row[1] for row in db.dead] == ["bad@example.com"]
+    assert [(row[1], row[5]) for row in db.retries] == [("c@example.com", "generate")]
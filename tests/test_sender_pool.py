@@ -0,0 +1,79 @@
+import smtplib
+from email import message_from_bytes
+from email.utils import parseaddr
+
+import pytest
+
+from message_renderer import render_message, set_sender
+from sender_pool import SenderAccount, SenderPool, SenderPoolExhausted
+
+
+@pytest.mark.parametrize("name", ["Jane Doe", "", "Doe, Jane", 'Jane "JD" <Doe>', "Zoë", "Long name " * 10])
+def test_set_sender_replaces_only_the_address(name):
+    message = render_message(name, "one@example.com", "to@example.com", "Subject", "Body")
+    rewritten = set_sender(message, "two@example.com")
+
+    original_name, _ = parseaddr(message_from_bytes(message)["From"])
+    assert parseaddr(message_from_bytes(rewritten)["From"]) == (original_name, "two@example.com")
+    assert rewritten.split(b"\r\n\r\n", 1)[1] == message.split(b"\r\n\r\n", 1)[1]
+
+
+class FakeServer:
+    def __init__(self, account):
+        self.account = account
+
+    def sendmail(self, from_addr, to_addrs, message):
+        if self.account.error is not None:
+            raise self.account.error
+        self.account.sent.append((from_addr, message))
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeAccount(SenderAccount):
+    def __init__(self, sender_email, error=None, **kwargs):
+        super().__init__("smtp.example.com", 587, sender_email, "secret", **kwargs)
+        self.error = error
+        self.sent = []
+
+    def _open_connection(self):
+        return FakeServer(self)
+
+
+def message():
+    return render_message("Sender", "first@example.com", "to@example.com", "Subject", "Body")
+
+
+def test_failover_skips_disabled_and_throttled_accounts():
+    locked_out = FakeAccount("a@example.com", smtplib.SMTPAuthenticationError(535, b"bad credentials"))
+    throttled = FakeAccount("b@example.com", smtplib.SMTPDataError(421, b"slow down"))
+    healthy = FakeAccount("c@example.com")
+    pool = SenderPool([locked_out, throttled, healthy], wait_timeout=1)
+
+    assert pool.send(message(), "to@example.com") is healthy
+    assert locked_out.disabled
+    assert throttled.remaining_quota() == 0
+    from_addr, sent = healthy.sent[0]
+    assert from_addr == "c@example.com"
+    assert parseaddr(message_from_bytes(sent)["From"])[1] == "c@example.com"
+
+
+def test_rate_limits_spread_sends_across_accounts():
+    first, second = FakeAccount("a@example.com", rate_limit=1), FakeAccount("b@example.com", rate_limit=1)
+    pool = SenderPool([first, second], wait_timeout=0)
+
+    assert {pool.send(message(), "to@example.com") for _ in range(2)} == {first, second}
+    with pytest.raises(SenderPoolExhausted):
+        pool.send(message(), "to@example.com")
+
+
+def test_refused_recipients_are_not_retried_elsewhere():
+    refused = smtplib.SMTPRecipientsRefused({"to@example.com": (550, b"no such user")})
+    first, second = FakeAccount("a@example.com", refused), FakeAccount("b@example.com")
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        SenderPool([first, second]).send(message(), "to@example.com")
+    assert second.sent == []
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from settings import LLMSettings, Settings, load_settings
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "settings.example.toml")
+
+
+def test_example_file_leaves_the_profile_in_charge():
+    settings = load_settings(EXAMPLE, "bulk_throughput", environ={})
+    assert settings.campaign.batch_size == 2000
+    assert settings.campaign.generation_batch_size == 8
+    assert settings.smtp.max_connections == 4
+    assert settings.db.max_connections == 20
+
+
+def test_example_file_matches_the_defaults():
+    assert load_settings(EXAMPLE, environ={}) == Settings()
+
+
+def test_layers_override_in_order(tmp_path):
+    path = tmp_path / "settings.toml"
+    path.write_text('profile = "bulk_throughput"\n[campaign]\nbatch_size = 800\n[smtp]\nmax_connections = 3\n')
+
+    settings = load_settings(str(path), environ={"SMTP_MAX_CONNECTIONS": "6"})
+    assert settings.profile == "bulk_throughput"
+    # profile < file < environment
+    assert settings.campaign.generation_batch_size == 8
+    assert settings.campaign.batch_size == 800
+    assert settings.smtp.max_connections == 6
+    assert settings.llm.model_id == LLMSettings().model_id
+
+
+def test_unknown_keys_are_rejected(tmp_path):
+    path = tmp_path / "settings.toml"
+    path.write_text("[campaign]\nbatch_sise = 10\n")
+    with pytest.raises(ValueError, match="batch_sise"):
+        load_settings(str(path), environ={})
@@ -0,0 +1,39 @@
+import pytest
+
+from records import read_recipients
+from recipient_filter import shard_of
+from sharding import rate_share, split_csv
+
+
+@pytest.mark.parametrize("limit,shard_count", [(3, 3), (10, 4), (7, 2), (100, 8), (5, 1)])
+def test_shares_add_up_to_the_limit(limit, shard_count):
+    shares = [rate_share(limit, shard_count, shard) for shard in range(shard_count)]
+    assert sum(shares) == limit
+    assert min(shares) >= 1
+    assert max(shares) - min(shares) <= 1
+
+
+@pytest.mark.parametrize("limit,shard_count", [(3, 4), (1, 2)])
+def test_limit_below_shard_count_is_refused(limit, shard_count):
+    with pytest.raises(ValueError):
+        rate_share(limit, shard_count, 0)
+
+
+@pytest.mark.parametrize("limit", [None, 0])
+def test_unlimited_stays_unlimited(limit):
+    assert rate_share(limit, 4, 0) == limit
+
+
+def test_split_csv_routes_each_row_to_its_shard(tmp_path):
+    source = tmp_path / "list.csv"
+    source.write_text("recipient_name,email,subject\n"
+                      + "".join(f"N{i},u{i}@example.com,\"Hi, {i}\"\n" for i in range(50)), encoding="utf-8")
+    paths = split_csv(str(source), 3, [str(tmp_path / f"shard{i}.csv") for i in range(3)])
+
+    seen = []
+    for shard, path in enumerate(paths):
+        rows = list(read_recipients(path))
+        assert all(shard_of(row.email, 3) == shard for row in rows)
+        seen += rows
+    assert sorted(row.email for row in seen) == sorted(f"u{i}@example.com" for i in range(50))
+    assert {row.subject for row in seen} == {f"Hi, {i}" for i in range(50)}